@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+# Command line batch renderer: shade many alignment files without the GUI, spread over a pool of
+# worker processes. A single file has its blocks drawn by the pool instead, for the formats that allow it.
+# A failure with one file is reported and the rest carry on; the exit status is non-zero if any file failed.
+#
+#   python BS_batch.py -f ps -o out/ 'families/*.fas'
+#   python BS_batch.py -f txt --scflag --consensnum 2 -s mysettings.json a.aln b.aln
+#   python BS_batch.py -f png --renderer numpy -o out/ 'families/*.fas'
+#   python BS_batch.py -f ps --compress gz -o out/ big.aln
+
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from BS_core import DEFAULTS, Settings, Alignment
+from BS_devices import RTFdev, PSdev, PDFdev, HTMLdev, ASCIIdev, PNGdev, SVGdev
+
+formats = {"rtf": ".rtf", "ps": ".ps", "pdf": ".pdf", "txt": ".txt", "png": ".png", "svg": ".svg", "html": ".html"}
+compressible = ("rtf", "ps", "txt", "svg")
+qapp = None # the QApplication of a worker that makes PNGs
+
+def parse_value(key, text):
+# a command line value for a settings key, converted to the type of its default
+    default = DEFAULTS[key]
+    if key in ("PSfgds", "PSbgds"):
+# colours are given as #rrggbb, separated by commas
+        cols = [c.strip().lstrip('#') for c in text.split(',')]
+        return [tuple(int(c[i:i+2], 16) for i in (0, 2, 4)) for c in cols]
+    elif key == "PSLCs":
+        return [c.strip().lower() in ('1', 'true', 'yes', 'y') for c in text.split(',')]
+    elif isinstance(default, list):
+        return [c for c in text.split(',')]
+    elif isinstance(default, float):
+        return float(text)
+    elif isinstance(default, int):
+        return int(text)
+    return text
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Shade alignment files without the pyBoxshade window.")
+    parser.add_argument("inputs", nargs="+", help="alignment files, or glob patterns matching them")
+    parser.add_argument("-f", "--format", choices=sorted(formats), default="ps", help="output format (default ps)")
+    parser.add_argument("-o", "--outdir", help="directory for the output files (default: next to each input)")
+    parser.add_argument("-s", "--settings", help="JSON file of settings, with the same keys as the preferences")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--consensnum", type=int, default=1,
+                        help="the sequence used as the consensus when scflag is set (default 1)")
+    parser.add_argument("--compress", choices=("gz", "xz"),
+                        help="compress the output files (rtf, ps, txt and svg only)")
+    parser.add_argument("--renderer", choices=("auto", "qt", "numpy"), default="auto",
+                        help="how PNGs are drawn: with Qt, or with numpy and a built in bitmap font, which "
+                             "needs no Qt (default: Qt if it can be imported)")
+    group = parser.add_argument_group("settings", "override single settings; lists are separated by commas, "
+                                                  "colours given as #rrggbb")
+    for key, default in DEFAULTS.items():
+        if isinstance(default, bool):
+            group.add_argument("--"+key, action=argparse.BooleanOptionalAction, default=None)
+        else:
+            group.add_argument("--"+key, metavar="VALUE", default=None)
+    return parser
+
+def expand_inputs(patterns):
+# missing files, and patterns that match nothing, are kept so that they are reported as failures
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else []
+        paths.extend(matches if matches else [pattern])
+    return paths
+
+def output_name(path, fmt, outdir, compress=None):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    name = stem + formats[fmt] + ('.'+compress if compress else '')
+    return os.path.join(outdir if outdir else os.path.dirname(path), name)
+
+def clashes(outpaths):
+    seen = {}
+    for i, outpath in enumerate(outpaths):
+        seen.setdefault(os.path.normpath(outpath), []).append(i)
+    return [group for group in seen.values() if len(group) > 1]
+
+def output_paths(paths, fmt, outdir, compress=None):
+# inputs that would share an output file, such as families/*/aln.sto, are given their own: under the
+# output directory, the directories of those inputs are kept below the one they have in common; inputs
+# in the same directory keep their extension as well (aln.fas.ps, aln.sto.ps). Any output still shared,
+# when a file is given twice, is None for all but the first of them.
+    outpaths = [output_name(path, fmt, outdir, compress) for path in paths]
+    if outdir:
+        for group in clashes(outpaths):
+            dirs = [os.path.dirname(os.path.abspath(paths[i])) for i in group]
+            base = os.path.commonpath(dirs)
+            for i, d in zip(group, dirs):
+                name = os.path.basename(outpaths[i])
+                outpaths[i] = os.path.normpath(os.path.join(outdir, os.path.relpath(d, base), name))
+    for group in clashes(outpaths):
+        for i in group:
+            name = os.path.basename(paths[i]) + formats[fmt] + ('.'+compress if compress else '')
+            outpaths[i] = os.path.join(os.path.dirname(outpaths[i]), name)
+    for group in clashes(outpaths):
+        for i in group[1:]:
+            outpaths[i] = None
+    return outpaths
+
+def qt_available():
+    return importlib.util.find_spec("PyQt5") is not None
+
+def render_png(aln, settings, outpath):
+# drawing with Qt needs a QApplication; Qt is only imported by the workers that make PNGs with it
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from platform import system
+    from PyQt5.QtGui import QFont
+    from PyQt5.QtWidgets import QApplication
+    import BS_config as BS
+    from OutDevs import Paintdev
+    global qapp
+    if QApplication.instance() is None:
+        qapp = QApplication([])
+    if not BS.monofont:
+        BS.monofont = QFont("")
+        BS.monofont.setStyleHint(QFont.Monospace)
+        BS.monofont.setStyleStrategy(QFont.PreferOutline)
+        BS.monofont.setFamily("Courier" if system() == "Darwin" else "Courier New")
+    gr_out = Paintdev(None, settings, outpath)
+    if not aln.prep_out(gr_out, settings):
+        raise ValueError("picture too large to draw")
+    aln.do_out(gr_out)
+
+def render_file(path, fmt, settings, outpath, consensnum=1, renderer="auto", block_jobs=1):
+# shade one alignment file and write it in the given format
+    aln = Alignment()
+    aln.read(path)
+    if aln.no_seqs < 2:
+        raise ValueError("fewer than two sequences")
+    if settings["scflag"]:
+        if not 1 <= consensnum <= aln.no_seqs:
+            raise ValueError("consensus sequence {} out of range".format(consensnum))
+        aln.consensnum = consensnum
+    elif fmt == "txt":
+        raise ValueError("text output needs a specific sequence as the consensus (scflag)")
+    aln.process(settings)
+    name = os.path.basename(path)
+    if fmt == "png" and (renderer == "qt" or (renderer == "auto" and qt_available())):
+        render_png(aln, settings, outpath)
+        return
+    if fmt == "png":
+        gr_out = PNGdev(name, settings, outpath)
+    elif fmt == "rtf":
+        gr_out = RTFdev(name, settings, outpath)
+    elif fmt == "ps":
+        gr_out = PSdev(name, settings, outpath)
+    elif fmt == "pdf":
+        gr_out = PDFdev(name, settings, outpath)
+    elif fmt == "svg":
+        gr_out = SVGdev(name, settings, outpath)
+    elif fmt == "html":
+        gr_out = HTMLdev(name, settings, outpath)
+    else:
+        gr_out = ASCIIdev(name, settings, outpath)
+    aln.prep_out(gr_out, settings)
+    aln.do_out(gr_out, block_jobs)
+
+def run_job(job):
+# worker entry point: never raises, returns (input, output, error message or None)
+    path, fmt, settings, outpath, consensnum, renderer, block_jobs = job
+    try:
+        render_file(path, fmt, settings, outpath, consensnum, renderer, block_jobs)
+    except Exception as e:
+        return path, outpath, "{}: {}".format(type(e).__name__, e)
+    return path, outpath, None
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    values = {}
+    try:
+        if args.settings:
+            with open(args.settings, encoding='utf-8') as f:
+                values.update(json.load(f))
+        for key in DEFAULTS:
+            value = getattr(args, key)
+            if value is not None:
+                values[key] = value if isinstance(value, bool) else parse_value(key, value)
+        settings = Settings(values)
+    except (OSError, TypeError, ValueError) as e:
+        parser.error(str(e))
+    if args.compress and args.format not in compressible:
+        parser.error("{} output can't be compressed".format(args.format))
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+
+    paths = expand_inputs(args.inputs)
+    outpaths = output_paths(paths, args.format, args.outdir, args.compress)
+# an input whose output is already written for another one is reported as a failure, not run
+    results, todo = [], []
+    for path, outpath in zip(paths, outpaths):
+        if outpath is None:
+            results.append((path, None, "its output is already written for an earlier input"))
+        else:
+            todo.append((path, outpath))
+            if args.outdir:
+                os.makedirs(os.path.dirname(outpath), exist_ok=True)
+# the pool works on files, or on the blocks of a file when there is only one
+    block_jobs = args.jobs if len(todo) == 1 else 1
+    jobs = [(path, args.format, settings, outpath, args.consensnum, args.renderer, block_jobs)
+            for path, outpath in todo]
+    if args.jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results += pool.map(run_job, jobs)
+    else:
+        results += [run_job(job) for job in jobs]
+
+    failed = 0
+    for path, outpath, error in results:
+        if error is None:
+            print("ok      {} -> {}".format(path, outpath))
+        else:
+            failed += 1
+            print("FAILED  {}: {}".format(path, error), file=sys.stderr)
+    print("{} file(s) shaded, {} failed".format(len(results)-failed, failed))
+    return 1 if failed or not results else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
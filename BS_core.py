@@ -0,0 +1,779 @@
+#!/usr/bin/env python
+
+# The alignment container, shading engine and output layout of pyBoxshade, with no Qt dependency,
+# so that alignments can be shaded headless (batch jobs, worker processes). Every stage takes an
+# explicit Settings object instead of reading the QSettings store; the GUI in BS_app.py builds one
+# from its preferences.
+
+import os
+from collections import namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from Bio import AlignIO
+
+from BS_readers import readers, read_matrix, mappers
+
+aaset = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+lenaa = len(aaset)
+aasetlow = 'abcdefghijklmnopqrstuvwxyz'
+gapchars = '-.~'
+
+aa_dict = dict(zip(list(aaset), range(1,lenaa+1)))
+aalow_dict = dict(zip(list(aasetlow), range(1,len(aasetlow)+1)))
+
+# translation tables for changing the case of the uint8 (ASCII code) sequence matrix
+to_upper = np.arange(256, dtype=np.uint8)
+to_upper[ord('a'):ord('z')+1] -= 32
+to_lower = np.arange(256, dtype=np.uint8)
+to_lower[ord('A'):ord('Z')+1] += 32
+
+# The preferences and their default values, as written by set_defaults the first time the program is run.
+# Colours are (r, g, b) tuples.
+DEFAULTS = {
+    "simsline": 'SIMS:F YW:Y FW:W FY:I LM:L IM:M IL:R KH:K RH:H KR:A G:S T:D EN:E DQ:N EQ:P G:V M:END',
+    "grpsline": 'GRPS:FYW:ILVM:DE:GA:ST:NQ:RKH:END',
+    "DNAsimsline": 'SIMS:A GR:G AR:C TY:T CY:R AG:Y CT:END',
+    "DNAgrpsline": 'GRPS:AGR:CTY:END',
+    "thrfrac": 0.7,
+    "scflag": False,
+    "countGaps": True,
+    "snameflag": True,
+    "RHsnumsflag": False,
+    "LHsnumsflag": False,
+    "defnumsflag": False,
+    "simflag": True,
+    "globalflag": True,
+    "consflag": False,
+    "outlen": 60,
+    "interlines": 1,
+    "symbcons": ' LU',
+    "consline": 1,
+    "rulerflag": False,
+    "pepseqsflag": True,
+    "PSfgds": [(0, 0, 0), (255, 255, 255), (0, 0, 0), (255, 255, 255)],
+    "PSbgds": [(255, 255, 255), (0, 0, 0), (180, 180, 180), (0, 0, 0)],
+    "PSFsize": 12,
+    "PSLCs": [False, False, False, False],
+    "PSlandscapeflag": False,
+    "RTFcompact": False,
+    "HTMLfragments": False,
+    "ASCIIchars": ['L', '.', 'l', '*'],
+}
+
+
+def typed_setting(key, value):
+# a settings value converted to the type of its default; lists become tuples, so that they can't change
+    default = DEFAULTS[key]
+    if isinstance(default, list):
+        if len(value) != len(default):
+            raise ValueError("setting '{}' needs a list of {} values".format(key, len(default)))
+        if key in ("PSfgds", "PSbgds"):
+            return tuple(tuple(int(x) for x in c[0:3]) for c in value)
+        return tuple(typed_setting_item(default[0], v) for v in value)
+    return typed_setting_item(default, value)
+
+def typed_setting_item(default, value):
+    if isinstance(default, bool):
+        return value.lower() in ('true', '1') if isinstance(value, str) else bool(value)
+    return type(default)(value)
+
+
+class Settings(Mapping):
+# A read only snapshot of the settings used by one operation: the defaults, updated with any values
+# given, each converted to the type of its default. Read as settings["key"] or settings.key;
+# settings.tables gives the similarity and group tables for the sequence type.
+
+    __slots__ = ("store", "hashval")
+
+    def __init__(self, values=None, **kwargs):
+        given = dict(values if values else {}, **kwargs)
+        for key in given:
+            if key not in DEFAULTS:
+                raise ValueError("unknown setting '{}'".format(key))
+        store = {key: typed_setting(key, given.get(key, default)) for key, default in DEFAULTS.items()}
+        object.__setattr__(self, "store", store)
+        object.__setattr__(self, "hashval", hash(tuple(store.items())))
+
+    def __getitem__(self, key):
+        return self.store[key]
+
+    def __getattr__(self, key):
+        try:
+            return self.store[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __setattr__(self, key, value):
+        raise AttributeError("settings are read only")
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __hash__(self):
+        return self.hashval
+
+    def __reduce__(self):
+        return (Settings, (self.store,))
+
+    def __repr__(self):
+        return "Settings({!r})".format(self.store)
+
+    @property
+    def tables(self):
+        return settings_tables(self)
+
+
+def make_tables(simsline, grpsline):
+# build the similarity and group tables from the SIMS:...:END and GRPS:...:END strings
+# the tables are indexed by the values in aa_dict, which run from 1 to lenaa; row/column 0 is never a residue
+    simsline = simsline.split(":")
+    grpsline = grpsline.split(":")
+    sims = np.full((lenaa+1, lenaa+1), False, dtype=bool)
+    for i in range(1, lenaa+1):
+        sims[i, i] = True
+    grps = np.copy(sims)
+    for i in range(1,len(simsline)-1):
+        p1=aa_dict[simsline[i][0]] if simsline[i][0] in aa_dict else False
+        if p1:
+            for j in range (2,len(simsline[i])):
+                p2 = aa_dict[simsline[i][j]] if simsline[i][j] in aa_dict else False
+                if p2 :
+                    sims[p1,p2] = True
+                    sims[p2,p1] = True
+
+    for k in range(1,len(grpsline)-1):
+        for j in range(0, len(grpsline[k])-1):
+            p1 = aa_dict[grpsline[k][j]] if grpsline[k][j] in aa_dict else False
+            if p1 :
+                for i in range (j+1, len(grpsline[k])):
+                    p2 = aa_dict[grpsline[k][i]] if grpsline[k][i] in aa_dict else False
+                    if p2 :
+                        grps[p1, p2] = True
+                        grps[p2, p1] = True
+    return sims, grps
+
+# The processing stages, in the order they run: the settings each one reads, and the earlier stages
+# whose results it uses. A stage is rerun when one of its settings changes, or when an earlier stage
+# it uses gives a different result. Settings not listed here (consflag, simflag, outlen, ...) only
+# affect the layout, which is done afresh for every output anyway.
+STAGES = {
+    "tables": (["pepseqsflag", "simsline", "grpsline", "DNAsimsline", "DNAgrpsline"], []),
+    "consensus": (["scflag", "consensnum", "thrfrac", "countGaps"], ["tables"]),
+    "colours": (["thrfrac", "countGaps"], ["tables", "consensus"]),
+    "consline": (["symbcons"], ["consensus", "colours"]),
+}
+
+@lru_cache(maxsize=None)
+def compiled_tables(simsline, grpsline):
+# make_tables, built once for each pair of strings; the tables are shared, so they are made read only
+    tables = make_tables(simsline, grpsline)
+    for table in tables:
+        table.setflags(write=False)
+    return tables
+
+def settings_tables(settings):
+# the similarity and group tables for the sequence type (protein or DNA) chosen in the settings
+    if settings["pepseqsflag"]:
+        return compiled_tables(settings["simsline"], settings["grpsline"])
+    else:
+        return compiled_tables(settings["DNAsimsline"], settings["DNAgrpsline"])
+
+# Vectorised consensus engine. The alignment is held as a uint8 matrix of ASCII codes; residues are
+# encoded as their aa_dict values (1..26, 0 for gaps and anything else), so that whole columns can be
+# counted at once rather than comparing every pair of residues in a column.
+chunk_cells = 1 << 22 # number of matrix cells handled per numpy pass, to bound temporary memory
+map_bytes = 1 << 26 # files this large are memory mapped, when their layout allows it
+
+residue_code = np.zeros(256, dtype=np.uint8) # ASCII code -> aa_dict value
+residue_code[ord('A'):ord('Z')+1] = np.arange(1, lenaa+1)
+gapcodes = np.frombuffer(gapchars.encode(), dtype=np.uint8)
+trailcodes = np.frombuffer(b' -.', dtype=np.uint8) # not counted at the end of a sequence
+
+def encode_residues(seqs):
+    return residue_code[seqs]
+
+def residue_profile(seqs):
+# count of each residue code (rows 0..lenaa) in each column of an alignment, encoding a block of
+# columns at a time so that a memory mapped alignment is never held whole
+    nrows, ncols = seqs.shape
+    prof = np.zeros((lenaa+1, ncols), dtype=np.int64)
+    step = max(1, chunk_cells // max(nrows, 1))
+    for c0 in range(0, ncols, step):
+        blk = encode_residues(seqs[:, c0:c0+step])
+        w = blk.shape[1]
+        idx = blk.astype(np.intp) * w + np.arange(w)
+        prof[:, c0:c0+w] = np.bincount(idx.ravel(), minlength=(lenaa+1)*w).reshape(lenaa+1, w)
+    return prof
+
+def vector_consensus(seqs, thrfrac, countGaps, grptable):
+# Same rules as the original column by column consensus: a single most common residue at or above
+# the threshold, otherwise a group consensus (lowercase if more than one residue makes up the group).
+# Columns are independent, so long alignments are taken a block of columns at a time.
+    nrows, ncols = seqs.shape
+    cons = np.full(ncols, ord(' '), dtype=np.uint8)
+    step = max(1, chunk_cells // max(nrows, lenaa+1))
+    for c0 in range(0, ncols, step):
+        cons[c0:c0+step] = block_consensus(seqs[:, c0:c0+step], thrfrac, countGaps, grptable)
+    return cons
+
+def block_consensus(seqs, thrfrac, countGaps, grptable):
+    nrows, ncols = seqs.shape
+    cons = np.full(ncols, ord(' '), dtype=np.uint8)
+    if ncols == 0:
+        return cons
+    counts = residue_profile(seqs)
+    counts[0] = 0 # non-residues never count towards identities or groups
+    present = counts > 0
+    if countGaps:
+        thr = np.full(ncols, round(thrfrac*nrows))
+    else:
+        thr = np.rint(thrfrac*counts.sum(0))
+    letters = np.frombuffer((' ' + aaset).encode(), dtype=np.uint8)
+
+    maxid = counts.max(0)
+    nmaxid = np.sum((counts == maxid) & present, 0)
+    idok = maxid >= thr
+    single = idok & (nmaxid == 1)
+    cons[single] = letters[np.argmax(counts[:, single], 0)]
+# a column with no residues at all can only reach a zero threshold; then all its rows tie
+    empty = np.flatnonzero(idok & (maxid == 0))
+    if empty.size:
+        same = np.all(seqs[:, empty] == seqs[0, empty], 0)
+        cons[empty[same]] = seqs[0, empty[same]]
+
+    gcols = np.flatnonzero(~idok)
+    if gcols.size == 0:
+        return cons
+    gcounts = counts[:, gcols]
+    gpresent = present[:, gcols]
+    grpcount = np.where(gpresent, grptable.astype(np.int64) @ gcounts, 0)
+    maxgrp = grpcount.max(0)
+    inmax = (grpcount == maxgrp) & gpresent & (maxgrp >= thr[gcols])
+    nmaxrows = np.sum(gcounts * inmax, 0)
+    one = nmaxrows == 1
+    cons[gcols[one]] = letters[np.argmax(inmax[:, one], 0)]
+    many = np.flatnonzero(nmaxrows > 1)
+    if many.size:
+# the original test compares the first sequence with a maximal group count against all the others
+        cols = gcols[many]
+        inmany = inmax[:, many]
+        res = encode_residues(seqs[:, cols])
+        rowsin = inmany[res, np.arange(many.size)]
+        first = res[np.argmax(rowsin, 0), np.arange(many.size)]
+        allgrp = np.all(grptable[first].T | ~inmany, 0)
+        best = np.argmax(np.where(inmany, gcounts[:, many], -1), 0)
+        cons[cols[allgrp]] = to_lower[letters[best[allgrp]]]
+    return cons
+
+def encode_consensus(cons):
+# residue code of each consensus character, and whether it is a group (lowercase) consensus
+    upper = residue_code[cons] > 0
+    cres = residue_code[to_upper[cons]]
+    return cres, upper, (cres > 0) & ~upper
+
+def vector_colours(seqs, cons, thrfrac, countGaps, simtable, grptable):
+# Shading classes for every residue: 0 different, 1 identical, 2 similar, 3 all the same.
+# Also returns, per column, the level (0, 1 or 2) used to pick the consensus line symbol.
+    nrows, ncols = seqs.shape
+    cols = np.zeros((nrows, ncols), dtype=np.uint8)
+    level = np.zeros(ncols, dtype=np.int32)
+    cres, upcons, grpcons = encode_consensus(cons)
+    step = max(1, chunk_cells // max(nrows, 1))
+    for c0 in range(0, ncols, step):
+        c1 = min(c0+step, ncols)
+        x = seqs[:, c0:c1]
+        res = encode_residues(x)
+        cr = cres[c0:c1]
+        grpc = grpcons[c0:c1]
+        eq = (x == cons[c0:c1]) & ~grpc
+        simm = simtable[res, cr] & ~eq
+        grpm = grptable[res, cr]
+        idcount = np.sum(eq, 0)
+        simcount = np.where(grpc, np.sum(grpm, 0), np.sum(simm, 0))
+        if countGaps:
+            seqcount = nrows
+            thr = round(thrfrac * nrows)
+        else:
+            seqcount = np.sum(res > 0, 0)
+            thr = np.rint(thrfrac * seqcount)
+        allid = (idcount == seqcount) & upcons[c0:c1]
+        part = ((idcount+simcount) >= thr) & upcons[c0:c1] & ~allid
+        blk = np.where(grpc & grpm, 2, 0)
+        blk = np.where(part & eq, 1, blk)
+        blk = np.where(part & simm, 2, blk)
+        if countGaps:
+            blk = np.where(allid, 3, blk)
+        else:
+            blk = np.where(allid & ~np.isin(x, gapcodes), 3, blk)
+        cols[:, c0:c1] = blk
+        level[c0:c1] = np.where(idcount == seqcount, 2, np.where((idcount+simcount) >= thr, 1, 0))
+    return cols, level
+
+def consensus_line(cons, level, symbcons):
+# symbcons holds the symbols for the three levels: 'U'/'L' give the consensus residue in upper/lower
+# case, 'B' or a space give a blank, anything else is used as it is
+    choices = []
+    for k in range(3):
+        symbchar = symbcons[k].upper()
+        if symbchar == 'U':
+            choices.append(to_upper[cons])
+        elif symbchar == 'L':
+            choices.append(to_lower[cons])
+        elif symbchar == 'B' or symbchar == ' ':
+            choices.append(np.full(cons.shape, ord(' '), dtype=np.uint8))
+        else:
+            choices.append(np.full(cons.shape, symbcons[k].encode('ascii', 'replace')[0], dtype=np.uint8))
+    return np.choose(level, choices)
+
+dedup_fraction = 0.9 # distinct columns are only shaded once if at most this fraction of the columns is distinct
+
+def distinct_columns(seqs):
+# Identical columns get the same consensus and shading, so each distinct column need only be worked
+# out once. Returns (index of one column of each distinct content, index into those for every column),
+# or None if too few columns repeat to be worth it. Columns are told apart by a 64 bit hash of their
+# contents, and every column is then checked against the one it was matched with.
+    nrows, ncols = seqs.shape
+    if ncols < 2:
+        return None
+    weights = np.random.default_rng(1).integers(0, 1 << 62, size=nrows, dtype=np.uint64) * 2 + 1
+    hashes = np.zeros(ncols, dtype=np.uint64)
+    step = max(1, chunk_cells // ncols)
+    for r0 in range(0, nrows, step):
+        hashes += (seqs[r0:r0+step].astype(np.uint64) * weights[r0:r0+step, None]).sum(0, dtype=np.uint64)
+    first, inverse = np.unique(hashes, return_index=True, return_inverse=True)[1:]
+    reps = first[inverse]
+    same = np.ones(ncols, dtype=bool)
+    step = max(1, chunk_cells // nrows)
+    for c0 in range(0, ncols, step):
+        same[c0:c0+step] = np.all(seqs[:, c0:c0+step] == seqs[:, reps[c0:c0+step]], 0)
+    if not same.all():
+# columns that only share a hash stand for themselves
+        extra = np.flatnonzero(~same)
+        inverse[extra] = first.size + np.arange(extra.size)
+        first = np.concatenate([first, extra])
+    if first.size > dedup_fraction * ncols:
+        return None
+    return first, inverse
+
+def rep_blocks(reps, nrows):
+# the distinct columns of a colmap in blocks of about chunk_cells residues, as (position in reps, block),
+# so that no more of the alignment than that is copied out at once
+    step = max(1, chunk_cells // max(nrows, 1))
+    for c0 in range(0, reps.size, step):
+        yield c0, reps[c0:c0+step]
+
+def trimmed_lengths(seqs):
+# length of each sequence not counting blanks, '-' or '.' at the "far" end
+    lens = np.zeros(seqs.shape[0], dtype=np.int64)
+    step = max(1, chunk_cells // max(seqs.shape[1], 1))
+    for r0 in range(0, seqs.shape[0], step):
+        filled = ~np.isin(seqs[r0:r0+step], trailcodes)
+        lens[r0:r0+step] = np.where(filled.any(1), seqs.shape[1] - np.argmax(filled[:, ::-1], 1), 0)
+    return lens
+
+
+def colour_runs(line, cols):
+# split a line of output into runs of the same shading class: a list of (class, text)
+    if not line:
+        return []
+    bounds = [0] + (np.flatnonzero(cols[1:] != cols[:-1]) + 1).tolist() + [len(line)]
+    return [(int(cols[b0]), line[b0:b1]) for b0, b1 in zip(bounds[:-1], bounds[1:])]
+
+
+class AlignmentError(Exception):
+    pass
+
+class UnknownFormatError(AlignmentError):
+# the first line of the file does not match any of the formats we can read
+    pass
+
+class AlignmentFormatError(AlignmentError):
+# the format was recognised, but the sequences could not be extracted
+    pass
+
+def sniff_format(Line1):
+# the AlignIO format name for a file, judged by its first line, or None
+    if Line1.startswith(">"):
+        return "fasta"
+    elif Line1.upper().startswith("CLUSTAL"):
+        return "clustal"
+    elif Line1.upper().startswith("#NEXUS"):
+        return "nexus"
+    elif Line1.upper().find("STOCKHOLM") > -1:
+        return "stockholm"
+    elif Line1.upper().find("MULTIPLE_ALIGNMENT") > -1 or Line1.upper().find("PILEUP") > -1:
+        return "msf"
+    elif len([int(i) for i in Line1.split() if i.isdigit()]) == 2:
+        return "phylip-relaxed"
+    return None
+
+
+class Alignment():
+# An alignment and everything derived from it: the consensus, the shading class ("colour") of every
+# residue and the consensus line. prep_out/do_out lay it out on an output device.
+
+    def __init__(self):
+        self.seqs = np.full((2, 2), ord(' '), dtype=np.uint8) # the alignment, as a matrix of ASCII codes
+        self.cons = np.full(3, ord(' '), dtype=np.uint8)
+        self.conschar = np.copy(self.cons)
+        self.cols = np.zeros(self.seqs.shape, dtype=np.uint8)
+        self.seqlens = np.array([0,0,0])
+        self.startnums = np.copy(self.seqlens)
+        self.no_seqs = 0
+        self.maxseqlen = 0
+        self.consenslen = 0
+        self.consensnum = 1 # the sequence that acts as consensus if scflag=True
+        self.seqnames =[] # will become a list of sequence names
+        self.level = np.zeros(3, dtype=np.int32)
+        self.colmap = None
+        self.tables = None
+        self.inputs = {}
+
+    def read(self, fileName):
+# read an alignment file, working out its format from the first line; OSError if the file can't be opened.
+# Only the keywords of the first line matter, so bytes that aren't UTF-8 are let through to the readers.
+        with open(fileName, mode='r', encoding='utf-8', errors='replace') as f:
+            seq_format = sniff_format(f.readline().rstrip('\r\n'))
+            if seq_format is None:
+                raise UnknownFormatError("unrecognised alignment format in {}".format(fileName))
+        seqs = None
+        if seq_format in mappers and os.path.getsize(fileName) >= map_bytes:
+# a large file laid out at fixed widths is used where it is, through a read-only memory map
+            try:
+                seqs, seqnames = mappers[seq_format](fileName)
+            except ValueError:
+                pass
+        if seqs is None:
+# the streaming reader fills the matrix directly; files it is unsure of go through AlignIO
+            try:
+                seqs, seqnames = read_matrix(fileName, readers[seq_format])
+                np.take(to_upper, seqs, out=seqs)
+            except ValueError:
+                seqs, seqnames = self.read_alignio(fileName, seq_format)
+        self.set_seqs(seqs, seqnames)
+
+    def read_alignio(self, fileName, seq_format):
+        with open(fileName, mode='r', encoding='utf-8') as f:
+            try:
+                al = AlignIO.read(f, seq_format)
+            except ValueError as e:
+                raise AlignmentFormatError("unable to extract sequences from {}: {}".format(fileName, e)) from e
+        seqs = np.empty((len(al), al.get_alignment_length()), dtype=np.uint8)
+        for i, rec in enumerate(al):
+            seqs[i] = np.frombuffer(str(rec.seq).upper().encode('ascii', 'replace'), dtype=np.uint8)
+        return seqs, [rec.id for rec in al]
+
+    def set_seqs(self, seqs, seqnames):
+# take a new alignment (uint8 matrix of uppercase ASCII codes, possibly a read-only view of a memory
+# mapped file) and size the derived arrays to match
+        self.seqs = seqs
+        self.seqnames = seqnames
+        self.no_seqs = self.seqs.shape[0]
+        self.maxseqlen = self.seqs.shape[1]
+        self.cols = np.full(self.seqs.shape, 0, dtype=np.uint8)
+        self.cons = np.full(self.maxseqlen, ord(' '), dtype=np.uint8)
+        self.conschar = np.copy(self.cons)
+        self.startnums = np.full(self.no_seqs, 1, dtype=np.int64) # a newly loaded file has all startnums set to 1 by default
+#
+#set consensus length = length of longest sequence (not counting dots,
+#spaces, etc. at the "far" end. May be a problem here for some strange cases
+        self.seqlens = trimmed_lengths(self.seqs).astype(np.int32)
+        self.consenslen = int(np.amax(self.seqlens))
+        self.level = np.zeros(self.maxseqlen, dtype=np.int32) # consensus line level of each column
+        self.colmap = distinct_columns(self.seqs[:, 0:self.consenslen])
+        self.tables = None
+        self.inputs = {} # the settings each stage was last run with; empty, so that all stages run
+
+    def make_consensus(self, settings, tables):
+# procedure to make a consensus which forms the basis of the shading
+        if not settings["scflag"]:
+# if there is a single residue with the highest count, at or above the threshold, that is the consensus.
+# If an equally high count belongs to a different residue there can't be a single residue consensus,
+# so look for a group consensus; if the residues with the top group count are all in the same
+# group as the first of them, flag that consensus position by making the residue lowercase
+            if self.colmap is None:
+                self.cons[0:self.consenslen] = vector_consensus(self.seqs[:, 0:self.consenslen], settings["thrfrac"],
+                                                                settings["countGaps"], tables[1])
+            else:
+                reps, inverse = self.colmap
+                cons = np.empty(reps.size, dtype=np.uint8)
+                for c0, block in rep_blocks(reps, self.no_seqs):
+                    cons[c0:c0+block.size] = vector_consensus(self.seqs[:, block], settings["thrfrac"],
+                                                              settings["countGaps"], tables[1])
+                self.cons[0:self.consenslen] = cons[inverse]
+
+        else:
+# this 'else' means that the scflag (make specific sequence the consensus) is true, so copy the sequence at row self.consensnum-1 into cons[]
+            np.copyto(self.cons[0:self.consenslen], self.seqs[self.consensnum-1, 0:self.consenslen])
+
+    def make_colours(self, settings, tables):
+# The array of "colours" defines the shading that will be applied to each array
+        self.cols.fill(0)
+        n = self.consenslen
+        if self.colmap is None:
+            self.cols[:, 0:n], self.level[0:n] = vector_colours(self.seqs[:, 0:n], self.cons[0:n], settings["thrfrac"],
+                                                                settings["countGaps"], *tables)
+        else:
+# shade each distinct column once, then copy the result to the columns like it, a block of the
+# distinct columns at a time; order lists the columns grouped by the distinct column they are like
+            reps, inverse = self.colmap
+            order = np.argsort(inverse, kind='stable')
+            starts = np.searchsorted(inverse[order], np.arange(reps.size+1))
+            step = max(1, chunk_cells // self.no_seqs)
+            for c0, block in rep_blocks(reps, self.no_seqs):
+                cols, level = vector_colours(self.seqs[:, block], self.cons[block], settings["thrfrac"],
+                                             settings["countGaps"], *tables)
+                like = order[starts[c0]:starts[c0+block.size]]
+                for t0 in range(0, like.size, step):
+                    t = like[t0:t0+step]
+                    self.cols[:, t] = cols[:, inverse[t]-c0]
+                    self.level[t] = level[inverse[t]-c0]
+
+    def make_consline(self, settings):
+# the consensus line is made whether or not it is shown, so that consflag only affects the layout
+        n = self.consenslen
+        self.conschar[0:n] = consensus_line(self.cons[0:n], self.level[0:n], settings["symbcons"])
+
+    def run_stage(self, stage, settings):
+# run one stage; False if its result is the same as before, so later stages need not rerun for it
+        if stage == "tables":
+            tables = settings_tables(settings)
+            same = self.tables is not None and all(np.array_equal(a, b) for a, b in zip(tables, self.tables))
+            self.tables = tables
+            return not same
+        elif stage == "consensus":
+            old = self.cons.copy()
+            self.make_consensus(settings, self.tables)
+            return not np.array_equal(old, self.cons)
+        elif stage == "colours":
+            self.make_colours(settings, self.tables)
+        else:
+            self.make_consline(settings)
+        return True
+
+    def process(self, settings):
+# bring the consensus, shading and consensus line up to date with the settings, rerunning only the
+# stages whose inputs have changed (see STAGES); returns the names of the stages that were rerun
+        if self.no_seqs < 2:
+            return []
+        values = dict(settings, consensnum=self.consensnum)
+        changed = set()
+        rerun = []
+        for stage, (keys, uses) in STAGES.items():
+            inputs = {k: values[k] for k in keys}
+            if stage in self.inputs and inputs == self.inputs[stage] and not changed.intersection(uses):
+                continue
+            rerun.append(stage)
+            self.inputs.pop(stage, None) # not up to date, should this stage fail part way
+            if self.run_stage(stage, settings):
+                changed.add(stage)
+            self.inputs[stage] = inputs
+        return rerun
+
+    def overview(self, settings):
+# the shading of the whole alignment as a picture with a pixel for each residue, in one pass over cols:
+# an array of (r, g, b) of shape (no_seqs, consenslen, 3), in the background colours, with gaps, the
+# ends of short sequences and (with scflag) the consensus sequence left white, as they are in the output
+        bgds = np.array(list(settings["PSbgds"]) + [(255, 255, 255)], dtype=np.uint8)
+        if not settings["simflag"]:
+            bgds[2] = bgds[0]
+        if not settings["globalflag"]:
+            bgds[3] = bgds[1]
+        n = self.consenslen
+        seqs = self.seqs[:, 0:n]
+        cols = np.where(np.isin(seqs, gapcodes) | (seqs == ord(' ')), 4, self.cols[:, 0:n])
+        if settings["scflag"] and self.consensnum > 0:
+            cols[self.consensnum-1] = 4
+        return bgds[cols]
+
+    def prep_out(self, gr_out, settings):
+        self.LHsnumsflag = settings["LHsnumsflag"]
+        self.RHsnumsflag = settings["RHsnumsflag"]
+        self.scflag = settings["scflag"]
+        self.consflag = settings["consflag"]
+        self.snameflag = settings["snameflag"]
+        self.outlen = settings["outlen"]
+        self.interlines = settings["interlines"]
+        self.rulerflag = settings["rulerflag"]
+
+        sname_just = max((self.consflag*9), max(map(len, self.seqnames)))
+        nseqs = self.no_seqs
+        if self.consflag:
+            nseqs += 1
+        if self.rulerflag:
+            nseqs += 1
+            gr_out.seqnames.append(" ".ljust(sname_just))
+        if nseqs == self.no_seqs:
+# no lines are added, so the device can use the alignment's own matrices (seqs may be a read-only map
+# of the file), copying only one that is going to be changed
+            gr_out.seqs = self.seqs.copy() if any(gr_out.lcs[0:4]) else self.seqs
+            gr_out.cols = self.cols.copy() if self.scflag and self.consensnum > 0 else self.cols
+        else:
+            gr_out.seqs = np.full((nseqs, self.seqs.shape[1]), ord(' '), dtype=np.uint8)
+            gr_out.cols = np.full((nseqs, self.seqs.shape[1]), 0, dtype=np.uint8)
+            np.copyto(gr_out.seqs[self.rulerflag:self.rulerflag+self.no_seqs, :], self.seqs)
+            np.copyto(gr_out.cols[self.rulerflag:self.rulerflag+self.no_seqs, :], self.cols)
+        gr_out.seqlens = np.full(nseqs, 0, dtype=np.int64)
+        gr_out.seqnames.extend([name.ljust(sname_just) for name in self.seqnames])
+        if self.consflag:
+            gr_out.seqnames.append("consensus".ljust(sname_just))
+        if self.rulerflag: #code here to create ruler and put it in first line of gr_out.seqs
+            gr_out.seqlens[0] = self.consenslen
+            gr_out.seqs[0] = ord('.')
+            gr_out.seqs[0, 4:self.consenslen:10] = ord(':')
+            gr_out.cols[0] = 4
+            for i in range(10, self.consenslen+1, 10):
+                inum = str(i).encode()
+                gr_out.seqs[0, i-len(inum):i] = np.frombuffer(inum, dtype=np.uint8)
+        np.copyto(gr_out.seqlens[self.rulerflag:self.rulerflag+self.no_seqs], self.seqlens)
+        if self.scflag and (self.consensnum >0):
+            gr_out.cols[self.consensnum-1+self.rulerflag] = 4
+        if self.consflag:
+            np.copyto(gr_out.seqs[nseqs-1,:], self.conschar)
+            gr_out.cols[nseqs-1,:] = 4
+            gr_out.seqlens[nseqs-1] = self.consenslen
+
+        gr_out.no_seqs = self.no_seqs
+        gr_out.make_lowercase(self.rulerflag)
+        gr_out.no_seqs = nseqs
+        if self.LHsnumsflag or self.RHsnumsflag:
+            gr_out.startnums = np.full(nseqs, 0, dtype=np.int64)
+            if self.rulerflag:
+                gr_out.startnums[0] = 1
+            np.copyto(gr_out.startnums[self.rulerflag:self.rulerflag + self.no_seqs], self.startnums)
+            if self.consflag:
+                gr_out.startnums[nseqs - 1] = 1
+            nblocks = (self.consenslen//self.outlen)+1
+            gr_out.LHprenums = [['' for i in range(nblocks)] for j in range(nseqs)]
+            gr_out.RHprenums = [['' for i in range(nblocks)] for j in range(nseqs)]
+            numlen = len(str(np.amax(self.startnums)+self.consenslen))
+            if self.rulerflag:
+                gr_out.LHprenums[0] = [' ' * numlen for x in gr_out.LHprenums[0]]
+                gr_out.RHprenums[0] = [' ' * numlen for x in gr_out.RHprenums[0]]
+# count the residues of each sequence in each output line; a line gets no numbers if there have been
+# no residues yet, or if it is empty and past the end of the sequence
+            rows = range(self.rulerflag, nseqs-self.consflag)
+            starts = np.arange(0, self.consenslen, self.outlen)
+            ends = np.minimum(starts+self.outlen, self.consenslen)-1
+            isres = residue_code[to_upper[gr_out.seqs[rows.start:rows.stop, 0:self.consenslen]]] > 0
+            counts = np.add.reduceat(isres.astype(np.int64), starts, axis=1) if starts.size else \
+                np.zeros((len(rows), 0), dtype=np.int64)
+            first = gr_out.startnums[rows.start:rows.stop, None]
+            before = first+np.cumsum(counts, 1)-counts
+            blank = (counts == 0) & ((before == first) | (ends > gr_out.seqlens[rows.start:rows.stop, None]))
+            for r, i in enumerate(rows):
+                for bn in range(starts.size):
+                    if blank[r, bn]:
+                        gr_out.LHprenums[i][bn] = ' ' * numlen
+                        gr_out.RHprenums[i][bn] = ' ' * numlen
+                    else:
+                        gr_out.LHprenums[i][bn] = str(before[r, bn]).rjust(numlen)
+                        gr_out.RHprenums[i][bn] = str(before[r, bn]+counts[r, bn]-1).rjust(numlen)
+            if self.consflag:
+                consl = nseqs - 1
+                gr_out.LHprenums[consl] = [' ' * numlen for x in gr_out.LHprenums[consl]]
+                gr_out.RHprenums[consl] = [' ' * numlen for x in gr_out.RHprenums[consl]]
+        return gr_out.graphics_init()
+# at the end out prep_out, the formatted set of seqs/ruler, consensus, etc are stored in the output object
+
+    def out_layout(self, gr_out):
+# the line breaks of the output, worked out from the line counts alone, so that blocks can be drawn
+# in any order: for each block, where it starts and how each of its lines ends ('n' newline, 'p' newpage),
+# followed by the blank lines between blocks; and the position at the end
+        nblocks = ((self.consenslen -1)// self.outlen)+1
+        layout = []
+        pages, lcount, newlines = 0, 0, 0
+        for i in range(0, nblocks):
+            start = OutPosition(pages, lcount, newlines)
+            ends = []
+            for j in range(0, gr_out.no_seqs):
+                lcount +=1
+                if lcount >= gr_out.lines_per_page:
+                    lcount = 0
+                    pages += 1
+                    ends.append('p')
+                else:
+                    newlines += 1
+                    ends.append('n')
+            if (lcount + gr_out.no_seqs + self.interlines) <= gr_out.lines_per_page:
+                ends.extend(['n']*self.interlines)
+                lcount += self.interlines
+                newlines += self.interlines
+            else:
+                lcount = 0
+                pages += 1
+                ends.append('p')
+            layout.append((start, ends))
+        return layout, OutPosition(pages, lcount, newlines)
+
+    def block_out(self, gr_out, i, start, ends, lines=None):
+# draw block i; if lines is given, only those lines of it are drawn, the others just get their line ends
+        gr_out.block_start(i, start)
+        if gr_out.whole_blocks:
+# the device lays out the block itself, from the residues and the text either side of them on each line
+            io=i*self.outlen
+            ie=min(io+self.outlen, self.consenslen)
+            heads = [(gr_out.seqnames[j]+' ' if self.snameflag else '') + (gr_out.LHprenums[j][i]+' ' if self.LHsnumsflag else '')
+                     for j in range(gr_out.no_seqs)]
+            tails = [' '+gr_out.RHprenums[j][i] if self.RHsnumsflag else '' for j in range(gr_out.no_seqs)]
+            gr_out.block_text(heads, gr_out.seqs[:, io:ie], tails, ends)
+            return
+        for j, end in enumerate(ends):
+            if j < gr_out.no_seqs and (lines is None or j in lines):
+                if self.snameflag:
+                    gr_out.set_colour(4)
+                    gr_out.string_out(gr_out.seqnames[j]+' ')
+                if self.LHsnumsflag:
+                    gr_out.set_colour(4)
+                    gr_out.string_out(gr_out.LHprenums[j][i]+' ')
+                io=i*self.outlen
+                ie=min(io+self.outlen, self.consenslen)
+                line = gr_out.seqs[j, io:ie].tobytes().decode('latin-1')
+                gr_out.runs_out(colour_runs(line, gr_out.cols[j, io:ie]))
+                if self.RHsnumsflag:
+                    gr_out.set_colour(4)
+                    gr_out.string_out(' '+gr_out.RHprenums[j][i])
+            if end == 'p':
+                gr_out.newpage()
+            else:
+                gr_out.newline()
+
+    def do_out(self, gr_out, jobs=1):
+# with jobs > 1, and a device that allows it, runs of blocks are drawn by a pool of worker processes,
+# each into a fragment of output, and the fragments are written in order
+        layout, end = self.out_layout(gr_out)
+        if jobs > 1 and gr_out.parallel_blocks and len(layout) > 1:
+            chunks = np.array_split(np.arange(len(layout)), min(len(layout), jobs*4))
+            chunks = [[(i, *layout[i]) for i in chunk] for chunk in chunks]
+            with ProcessPoolExecutor(max_workers=jobs, initializer=init_block_worker, initargs=(self, gr_out)) as pool:
+                for fragment in pool.map(draw_blocks, chunks):
+                    gr_out.fragment_out(fragment)
+        else:
+            for i, (start, ends) in enumerate(layout):
+                self.block_out(gr_out, i, start, ends)
+        gr_out.block_start(None, end)
+        gr_out.exit()
+
+
+# where a block starts in the output: the pages finished, the lines on the current page and the newlines
+# so far
+OutPosition = namedtuple('OutPosition', ['pages', 'lines', 'newlines'])
+block_worker = None # the alignment and output device of a process that draws blocks
+
+def init_block_worker(aln, gr_out):
+    global block_worker
+    block_worker = (aln, gr_out)
+
+def draw_blocks(chunk):
+# draw a run of blocks, and return what the device would have written for them
+    aln, gr_out = block_worker
+    gr_out.capture()
+    for i, start, ends in chunk:
+        aln.block_out(gr_out, i, start, ends)
+    return gr_out.captured()
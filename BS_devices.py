@@ -0,0 +1,1211 @@
+#!/usr/bin/env python
+
+# Output devices for the file formats (RTF, PostScript, PDF, HTML, ASCII), with no Qt dependency.
+# Each device takes the Settings object of the operation and where to write: the name of a file, which
+# is compressed if it ends in .gz or .xz, or an open file object (text, or binary such as io.BytesIO);
+# OutDevs.py subclasses them to ask for the file name with a dialog instead.
+# PNGfile writes the pictures drawn by OutDevs.Paintdev, a band of rows at a time. PNGdev draws the same
+# pictures without Qt, straight into numpy arrays, with a built in bitmap font, and SVGdev writes them as
+# SVG.
+
+import datetime
+import gzip
+import io
+import lzma
+import os
+import struct
+from platform import system
+from xml.sax.saxutils import escape
+import zlib
+
+import numpy as np
+
+from BS_core import to_lower
+
+BUFFER_SIZE = 1 << 18 # output is written to files in pieces of this size, not in the pieces the devices make
+
+def open_sink(target, binary=False):
+# a stream to write the output to. A file name is opened with a large buffer, and compressed with gzip
+# or xz going by its extension; a binary file object is given a text wrapper unless binary is set.
+    if isinstance(target, (str, os.PathLike)):
+        path = os.fspath(target)
+        if path.endswith('.gz'):
+# no time stamp in the header, so that the same output makes the same file
+            stream = gzip.GzipFile(path, mode='wb', mtime=0)
+        elif path.endswith('.xz'):
+            stream = lzma.LZMAFile(path, mode='wb')
+        else:
+            stream = open(path, mode='wb', buffering=BUFFER_SIZE)
+    else:
+        stream = target
+    if binary:
+        if isinstance(stream, io.TextIOBase):
+            raise ValueError("binary output can't be written to a text stream")
+        return stream
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding='utf-8')
+
+def close_sink(stream, target):
+# close a stream from open_sink; file objects passed in by the caller are flushed and left open
+    if isinstance(target, (str, os.PathLike)):
+        stream.close()
+    elif stream is target:
+        stream.flush()
+    else:
+        stream.detach()
+
+# class object that will handle output to a file
+# will subclass this for output to RTF/ASCII/PDF
+# noinspection PyMethodMayBeStatic
+class Filedev():
+    parallel_blocks = False # whether Alignment.do_out may draw the blocks in other processes
+    whole_blocks = False # whether Alignment.do_out hands over whole blocks to block_text, not a line at a time
+
+    def __init__(self, filename=None):
+# create the reference points for instance variables that will hold all the data to be processed by this instance
+        self.seqs = np.full((2, 2), ord(' '), dtype=np.uint8)
+        self.cols = np.full(self.seqs.shape, 0, dtype=np.uint8)
+        self.seqnames =[]
+        self.no_seqs = 0
+        self.LHprenums = []
+        self.RHprenums = []
+        self.seqlens = []
+        self.startnums = []
+        self.lcs = []
+        self.interlines = 0
+        self.file_filter = ("All files (*);;PDF files (*.pdf);;RTF files (*.rtf);;ASCII files (*.txt)")
+        self.filename = filename
+        self.file = None
+        self.outstream = None
+        self.parent = None
+
+
+    def rgb(self, col):
+        return tuple(col[0:3])
+
+    def open_output_file(self):
+# open self.filename for writing; OSError if that fails
+        self.file = open_sink(self.filename)
+        self.outstream = self.file
+        return True
+
+    def runs_out(self, runs):
+# write a line of residues given as (shading class, text) runs; devices override this to write a
+# whole run at once, this fallback goes a character at a time
+        for c, text in runs:
+            for ch in text:
+                self.set_colour(c)
+                self.char_out(ch)
+
+    def block_start(self, block, pos):
+# called by do_out before each block, and with block None at the end; pos is the OutPosition it starts at.
+# Devices that draw blocks in parallel set up everything a block depends on here, so that a block
+# comes out the same whatever was drawn before it.
+        pass
+
+    def capture(self):
+# start keeping the output in memory, in a worker process drawing blocks
+        self.outstream = io.StringIO()
+
+    def captured(self):
+        return self.outstream.getvalue()
+
+    def fragment_out(self, fragment):
+# write output captured by a worker
+        self.outstream.write(fragment)
+
+    def __getstate__(self):
+# what is sent to the worker processes: everything but the open files and the window
+        state = dict(self.__dict__)
+        state.update(filename=None, file=None, outstream=None, parent=None)
+        return state
+
+    def make_lowercase(self, rulerflag):
+        lc = np.array(list(self.lcs[0:4]) + [False], dtype=bool) # colour 4 (names, ruler, consensus) is left alone
+        if not lc.any():
+            return
+        np.copyto(self.seqs, to_lower[self.seqs], where=lc[self.cols])
+
+    def exit(self):
+        if self.file is not None:
+            close_sink(self.file, self.filename)
+        self.file=None
+
+class RTFdev(Filedev):
+    parallel_blocks = True
+
+    def __init__(self, fname, settings, filename=None):
+        super(RTFdev, self).__init__(filename)
+        self.file_filter = ("RTF files (*.rtf);;All files (*)")
+        self.Alignment = fname
+        self.bgds = list(settings["PSbgds"])
+        self.fgds = list(settings["PSfgds"])
+        self.FSize = settings["PSFsize"]
+        self.lcs = list(settings["PSLCs"])
+        self.compact = settings["RTFcompact"]
+        simflag = settings["simflag"]
+        globalflag = settings["globalflag"]
+        if not simflag:
+            self.fgds[2] = self.fgds[0]
+            self.bgds[2] = self.bgds[0]
+            self.lcs[2] = self.lcs[0]
+        if not globalflag:
+            self.fgds[3] = self.fgds[1]
+            self.bgds[3] = self.bgds[1]
+            self.lcs[3] = self.lcs[1]
+
+        dev_miny = 1.0
+        dev_maxy = 15000.0
+        dev_ysize = self.FSize * 20.0
+        self.lines_per_page = int((dev_maxy - dev_miny) / dev_ysize)
+
+    def colour_table(self):
+# the colours of the colour table, and the entries used for the foreground and background of each class.
+# The normal layout has the 5 foregrounds then the 5 backgrounds; the compact one lists each colour once.
+        fgds = [self.rgb(c) for c in self.fgds[0:4]] + [(0, 0, 0)]
+        bgds = [self.rgb(c) for c in self.bgds[0:4]] + [(255, 255, 255)]
+        if not self.compact:
+            return fgds + bgds, list(range(5)), list(range(5, 10))
+        table = list(dict.fromkeys(fgds + bgds))
+        return table, [table.index(c) for c in fgds], [table.index(c) for c in bgds]
+
+    def graphics_init(self):
+        if self.open_output_file():
+            self.outstream.write('{\\rtf1\\ansi\\deff0\n{\\fonttbl{\\f0\\fmodern Courier New;}}\n')
+            self.outstream.write('{{\\info{{\\author BOXSHADE}}{{\\title {}}}}}\n'.format(self.Alignment))
+            table, self.fgno, self.bgno = self.colour_table()
+            self.outstream.write('{\\colortbl\n')
+            self.outstream.write(''.join('\\red{}\\green{}\\blue{};'.format(*c) for c in table))
+            self.outstream.write('}\n')
+            self.outstream.write('\\paperw11880\\paperh16820\\margl1000\\margr500\n')
+            self.outstream.write('\\margt910\\margb910\\sectd\\cols1\\pard\\plain\n')
+            self.outstream.write('\\fs{}\n\\b\n'.format(self.FSize * 2))
+            self.outstream.flush()
+            self.line = []
+            self.act_col = None
+            self.act_fg, self.act_bg = None, None
+            return True
+        else:
+            return False
+
+    def set_colour(self, c):
+# the colour control words are only written when the shading class changes; the compact variant
+# only writes the ones for the colour that actually changes
+        if c == self.act_col:
+            return
+        self.act_col = c
+        if not self.compact:
+            self.line.append('\n\\chshdng0\\chcbpat{0}\\cb{0}\\cf{1} '.format(self.bgno[c], self.fgno[c]))
+            return
+        words = ''
+        if self.fgno[c] != self.act_fg:
+            self.act_fg = self.fgno[c]
+            words += '\\cf{}'.format(self.act_fg)
+        if self.bgno[c] != self.act_bg:
+            self.act_bg = self.bgno[c]
+            words += '\\chcbpat{0}\\cb{0}'.format(self.act_bg)
+        if words:
+            self.line.append(words+' ')
+
+    def block_start(self, block, pos):
+        self.act_col = None
+        self.act_fg, self.act_bg = None, None
+
+    def char_out(self,c):
+        self.line.append(c)
+
+    def runs_out(self, runs):
+        for c, text in runs:
+            self.set_colour(c)
+            self.line.append(text)
+
+    def string_out(self, str):
+        self.line.append(str)
+
+    def flush_line(self, end):
+# each line is built up in memory and written in one go
+        self.line.append(end)
+        self.outstream.write(''.join(self.line))
+        self.line = []
+
+    def newline(self):
+        if self.compact:
+            self.set_colour(4)
+            self.flush_line('\\line\n')
+        else:
+            self.flush_line('\n\\cb{}\\cf{} \\line\n'.format(self.bgno[4], self.fgno[4]))
+            self.act_col = None
+
+    def newpage(self):
+        self.flush_line('\\page\n')
+
+    def exit(self):
+        self.flush_line('\\b0}\n')
+        super().exit()
+
+
+class PSdev(Filedev):
+    pscc = ['C0', 'C1', 'C2', 'C3', 'C4']
+    ctypes = ['% -- different residues\n', "% -- identical residues\n", "% -- similar residues\n", "% -- conserved residues\n", "% -- normal text\n"]
+    parallel_blocks = True
+    def __init__(self, fname, settings, filename=None):
+        super(PSdev, self).__init__(filename)
+        self.file_filter = ("PS files (*.ps);;All files (*)")
+        self.Alignment = fname
+        self.bgds = list(settings["PSbgds"])
+        self.fgds = list(settings["PSfgds"])
+        self.FSize = settings["PSFsize"]
+        self.lcs = list(settings["PSLCs"])
+        simflag = settings["simflag"]
+        globalflag = settings["globalflag"]
+        self.landscapeflag = settings["PSlandscapeflag"]
+        self.outlen = settings["outlen"]
+        self.snameflag = settings["snameflag"]
+        self.LHsnumsflag = settings["LHsnumsflag"]
+        self.RHsnumsflag = settings["RHsnumsflag"]
+
+        if not simflag:
+            self.fgds[2] = self.fgds[0]
+            self.bgds[2] = self.bgds[0]
+            self.lcs[2] = self.lcs[0]
+        if not globalflag:
+            self.fgds[3] = self.fgds[1]
+            self.bgds[3] = self.bgds[1]
+            self.lcs[3] = self.lcs[1]
+        self.dev_minx = 30.0
+        self.dev_miny = 30.0
+        if self.landscapeflag:
+            self.dev_maxx = 800.0
+            self.dev_maxy = 545.0
+        else:
+            self.dev_maxx = 575.0
+            self.dev_maxy = 760.0
+        self.dev_xsize = self.FSize * 0.7
+        self.dev_ysize = self.FSize
+        self.lines_per_page = int((self.dev_maxy - self.dev_miny) / self.dev_ysize)
+
+    def PSrgb(self, col):
+        col = [x/255 for x in self.rgb(col)]
+        return col
+
+    def PageSetup(self, pn):
+        self.outstream.write("\n%%Page: {} {}\n%%BeginPageSetup\npsetup\n%%EndPageSetup\n".format(pn, pn))
+
+    def psfp(self, num, dp):
+# a number as written to the file, without trailing zeros, and followed by a space
+        s = '{:.{}f}'.format(num,dp)
+        s = s.rstrip('0').rstrip('.') if '.' in s else s
+        return s+' '
+
+    def coord_out(self, s, op):
+        self.close_sb()
+        self.outstream.write(s+op)
+        self.count += len(s+op)
+
+    def close_sb(self):
+        if self.save_sb != []:
+            sl = len(self.save_sb)
+            if (self.count+sl) > 200:
+                self.outstream.write("\n")
+                self.count = 0
+            xsl = 'S' if sl > 1 else 'C'
+            self.outstream.write("({}){} ".format(''.join(self.save_sb), xsl))
+            self.count += 4+len(self.save_sb)
+            self.save_sb = []
+
+    def add_sb(self, text):
+# add characters to the string being built up; the file line is ended once it passes 200 characters
+        while text:
+            room = max(201-self.count-len(self.save_sb), 1)
+            self.save_sb.extend(text[0:room])
+            if len(text) < room:
+                return
+            sl = len(self.save_sb)
+            xsl = 'S' if sl > 1 else 'C'
+            self.outstream.write("({}){} ".format(''.join(self.save_sb), xsl))
+            self.outstream.write("\n")
+            self.count = 0
+            self.save_sb = []
+            text = text[room:]
+
+    def confirm_width(self, page_width, line_length):
+# called when the lines are wider than the page and would be clipped; return False to give up.
+# Without anyone to ask, go ahead.
+        return True
+
+    def check_width(self):
+# False if the lines are wider than the page and confirm_width gives up
+        nchars = self.outlen
+        if self.snameflag:
+            nchars += 1 + len(self.seqnames[0])
+        if self.LHsnumsflag:
+            nchars += 1 + len(self.LHprenums[0][0])
+        if self.RHsnumsflag:
+            nchars += 1 + len(self.RHprenums[0][0])
+        line_length = self.dev_xsize * nchars
+        if line_length > (self.dev_maxx-self.dev_minx):
+            return self.confirm_width(self.dev_maxx-self.dev_minx, line_length)
+        return True
+
+    def graphics_init(self):
+        if not self.check_width():
+            return False
+
+        if self.open_output_file():
+            self.outstream.write("%!PS-Adobe-2.0\n")
+            self.outstream.write("%%Creator: PyBoxshade\n")
+            self.outstream.write("%%Title: BOXSHADE document from: {} \n".format(self.Alignment))
+            d = datetime.datetime.now()
+            self.outstream.write("%%CreationDate: {:%H:%M:%S %B %d, %Y}\n".format(d))
+            self.outstream.write("%%Pages: (atend)\n")
+            if self.landscapeflag:
+                self.outstream.write("%%BoundingBox: {:.0f} {:.0f} {:.0f} {:.0f}\n".format(self.dev_miny-1,self.dev_minx-1,self.dev_maxy+1,self.dev_maxx+1))
+                self.outstream.write("%%Orientation: landscape\n")
+            else:
+                self.outstream.write("%%BoundingBox: {:.0f} {:.0f} {:.0f} {:.0f}\n".format(self.dev_minx-1,self.dev_miny-1,self.dev_maxx+1,self.dev_maxy+1))
+                self.outstream.write("%%Orientation: portrait\n")
+
+            self.outstream.write("%%PaperSize: a4\n%%DocumentNeededFonts: Courier-Bold\n%%DocumentData: Clean7Bit\n")
+            self.outstream.write("%%LanguageLevel: 1\n%%EndComments\n%%BeginProlog\n")
+            self.outstream.write("/bd { bind def } bind def /xd { exch def } bd\n")
+            self.outstream.write("%\n% custom color selection\n%\n% grayscale:\n%\n% '<gray> setgray'\n%\n")
+            self.outstream.write("% where<gray> is a real number between\n%  0.0 (black) and 1.0 (white)\n%\n")
+            self.outstream.write("% RGB (red/green/blue) colors:\n%\n%  '<r> <g> <b> setrgbcolor'\n%\n% each color component is a real'\n")
+            self.outstream.write("% number between 0.0 (zero intensity) and\n%  1.0 (max intensity)\n%\n% Change the following definitions for your needs!\n%\n")
+            for i in range(4):
+                self.outstream.write(self.ctypes[i])
+                self.outstream.write("/bg{} {{ {:.2f} {:.2f} {:.2f} setrgbcolor }} bd % background\n".format(str(i), *self.PSrgb(self.bgds[i])))
+                self.outstream.write("/fg{} {{ {:.2f} {:.2f} {:.2f} setrgbcolor }} bd % foreground\n".format(str(i), *self.PSrgb(self.fgds[i])))
+            self.outstream.write(self.ctypes[4])
+            self.outstream.write("/bg4 { 1 setgray } bd % background\n")
+            self.outstream.write("/fg4 { 0 setgray } bd % foreground\n")
+
+            self.outstream.write("%\n% end of custom color selection\n%\n")
+            self.outstream.write("/px 0 def /py 0 def /fg {0 setgray} bd /bg {1 setgray} bd ")
+# S draws a run of one colour: a single background rectangle, then the string shown with ashow, which
+# spaces the characters out from the width of the font to the width of the boxes
+            self.outstream.write("/S {{dup length {:.2f} mul /w xd px py moveto gsave {:.1f} {:.1f} rmoveto w 0 rlineto 0 {:.1f} rlineto w neg 0 rlineto closepath ".format(self.dev_xsize, \
+                                                                                                     -0.03*self.FSize, -0.05*self.FSize, self.FSize))
+            self.outstream.write("bg fill grestore fg 0 2 rmoveto ax 0 3 -1 roll ashow /px px w add def} bd /C {S} bd\n")
+            self.outstream.write("/X {/px xd} bd /Y {/py xd} bd /A {Y X} bd\n")
+            d = " 575 0 translate 90 rotate" if self.landscapeflag else ""
+            self.outstream.write("/psetup {{/Courier-Bold findfont {} scalefont setfont /ax {:.2f} (0) stringwidth pop sub def 120 currentscreen 3 -1 roll pop setscreen {}}} bd\n".format(self.FSize, self.dev_xsize, d))
+            for i in range(5):
+                self.outstream.write("/{} {{/bg {{bg{}}} bd /fg {{fg{}}} bd}} bd ".format(self.pscc[i], (i), str(i)))
+            self.outstream.write("\n%%EndProlog\n%%%BeginSetup\nsave initgraphics")
+            self.outstream.write("\n%%EndSetup")
+            self.act_page = 1
+            self.PageSetup(self.act_page)
+            self.last_pscl = ''
+            self.act_col = 4
+# the coordinates are written from strings made once: the start of a line, and the height of each row
+            self.xstr = self.psfp(self.dev_minx, 1)
+            self.ystrs = [self.psfp(self.dev_maxy - self.dev_ysize*(i+1), 1) for i in range(self.lines_per_page+1)]
+            self.row = 0
+            self.new_x, self.new_y  = True, True
+            self.count = 0
+            self.save_sb = []
+            return True
+        else:
+            return False
+
+    def block_start(self, block, pos):
+# each block starts on a new line of the file, with the colour set again
+        self.close_sb()
+        self.outstream.write("\n")
+        self.count = 0
+        self.last_pscl = ''
+        self.act_page = pos.pages+1
+        self.row = pos.lines
+
+    def set_colour(self, c):
+        self.act_col = c
+
+    def char_out(self, ch):
+        if self.pscc[self.act_col] != self.last_pscl:
+            self.close_sb()
+            self.last_pscl = self.pscc[self.act_col]
+            self.outstream.write(self.last_pscl+" ")
+            self.count += len(self.last_pscl+" ")
+        if self.new_x and self.new_y:
+            self.coord_out(self.xstr+self.ystrs[self.row], "A ")
+            self.new_x, self.new_y = False, False
+        elif self.new_y:
+            self.coord_out(self.ystrs[self.row], "Y ")
+            self.new_y = False
+        elif self.new_x:
+            self.coord_out(self.xstr, "X ")
+            self.new_x = False
+        self.add_sb(ch)
+
+    def runs_out(self, runs):
+# the colour and position are only looked at for the first character of a run
+        for c, text in runs:
+            self.act_col = c
+            self.char_out(text[0])
+            self.add_sb(text[1:])
+
+    def string_out(self,str):
+        if str:
+            self.char_out(str[0])
+            self.add_sb(str[1:])
+
+    def newline(self):
+        self.close_sb()
+        self.row += 1
+        self.new_x, self.new_y = True, True
+
+    def newpage(self):
+        self.close_sb()
+        self.outstream.write("showpage erasepage ")
+        self.count += len("showpage erasepage ")
+        self.act_page += 1
+        self.PageSetup(self.act_page)
+        self.row = 0
+        self.new_x, self.new_y = True, True
+        self.last_pscl = ' '
+
+    def exit(self):
+        self.close_sb()
+        self.outstream.write("showpage erasepage\n%%Trailer\nrestore\n")
+        self.outstream.write("%%Pages: {}\n".format(self.act_page))
+        self.outstream.write("%%EOF\n")
+        super().exit()
+
+class PDFdev(PSdev):
+# PDF with the same page layout as the PostScript: each run of a colour is a background rectangle and
+# a string in Courier-Bold, spaced out to the width of the boxes with Tc. Each page is one compressed
+# content stream, written out when the page is finished, with the offsets of the objects kept for the
+# xref table at the end.
+    parallel_blocks = False
+    def __init__(self, fname, settings, filename=None):
+        super(PDFdev, self).__init__(fname, settings, filename)
+        self.file_filter = ("PDF files (*.pdf);;All files (*)")
+
+    def open_output_file(self):
+        self.file = open_sink(self.filename, binary=True)
+        self.outstream = self.file
+        return True
+
+    def tell(self):
+# the offset in the PDF, which need not start at the beginning of the file object it is written to
+        return self.outstream.tell()-self.start
+
+    def colour_op(self, col, op):
+        return ''.join(self.psfp(x, 3) for x in self.PSrgb(col)) + op
+
+    def obj_out(self, body, stream=None):
+# write the next object, and return its number
+        self.offsets.append(self.tell())
+        self.outstream.write("{} 0 obj\n{}\n".format(len(self.offsets), body).encode('latin-1', 'replace'))
+        if stream is not None:
+            self.outstream.write(b"stream\n" + stream + b"\nendstream\n")
+        self.outstream.write(b"endobj\n")
+        return len(self.offsets)
+
+    def graphics_init(self):
+        if not self.check_width():
+            return False
+
+        if self.open_output_file():
+            self.start = self.outstream.tell()
+            self.outstream.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+            self.offsets = []
+# objects 1 and 2 are the catalog and the page tree, which is written at the end when the pages are known
+            self.offsets.extend([0, 0])
+            d = datetime.datetime.now()
+            self.info = self.obj_out("<< /Creator (PyBoxshade) /Title (BOXSHADE document from: {}) /CreationDate (D:{:%Y%m%d%H%M%S}) >>".format(
+                                     self.escape(self.Alignment), d))
+            self.font = self.obj_out("<< /Type /Font /Subtype /Type1 /BaseFont /Courier-Bold /Encoding /WinAnsiEncoding >>")
+            self.pages = []
+            self.bgops = [self.colour_op(c, "rg ") for c in self.bgds[0:4]] + ["1 g "]
+            self.fgops = [self.colour_op(c, "rg ") for c in self.fgds[0:4]] + ["0 g "]
+# the string for each run is moved up 2 points from the bottom of the box, the box is moved by a fraction
+# of the font size, as in the PostScript
+            self.boxh = self.psfp(self.FSize, 2) + "re f "
+            self.ystrs = [(self.psfp(self.dev_maxy - self.dev_ysize*(i+1) - 0.05*self.FSize, 2),
+                           self.psfp(self.dev_maxy - self.dev_ysize*(i+1) + 2, 2)) for i in range(self.lines_per_page+1)]
+            self.act_col = 4
+            self.start_page()
+            return True
+        else:
+            return False
+
+    def start_page(self):
+        self.content = []
+        if self.landscapeflag:
+            self.content.append("0 1 -1 0 575 0 cm ")
+        self.content.append("BT /F1 {}Tf {}Tc ET\n".format(self.psfp(self.FSize, 2), self.psfp(self.dev_xsize-0.6*self.FSize, 3)))
+        self.row = 0
+        self.col = 0
+        self.run_col = 4
+        self.run = []
+
+    def escape(self, text):
+        return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+    def block_start(self, block, pos):
+        pass
+
+    def close_run(self):
+# draw the run of characters of one colour built up so far
+        if self.run:
+            text = ''.join(self.run)
+            x = self.dev_minx + self.col*self.dev_xsize
+            ybox, ytext = self.ystrs[self.row]
+            self.content.append("{}{}{}{}{}{}BT {}{}Td ({})Tj ET\n".format(self.bgops[self.run_col], self.psfp(x-0.03*self.FSize, 2),
+                                ybox, self.psfp(len(text)*self.dev_xsize, 2), self.boxh, self.fgops[self.run_col],
+                                self.psfp(x, 2), ytext, self.escape(text)))
+            self.col += len(text)
+            self.run = []
+
+    def set_colour(self, c):
+        self.act_col = c
+
+    def char_out(self, ch):
+        self.string_out(ch)
+
+    def runs_out(self, runs):
+        for c, text in runs:
+            self.act_col = c
+            self.string_out(text)
+
+    def string_out(self, str):
+        if self.act_col != self.run_col:
+            self.close_run()
+            self.run_col = self.act_col
+        self.run.append(str)
+
+    def newline(self):
+        self.close_run()
+        self.row += 1
+        self.col = 0
+
+    def end_page(self):
+        self.close_run()
+        data = zlib.compress(''.join(self.content).encode('cp1252', 'replace'), 6)
+        contents = self.obj_out("<< /Length {} /Filter /FlateDecode >>".format(len(data)), data)
+        self.pages.append(self.obj_out("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                                       "/Resources << /Font << /F1 {} 0 R >> >> /Contents {} 0 R >>".format(self.font, contents)))
+
+    def newpage(self):
+        self.end_page()
+        self.start_page()
+
+    def exit(self):
+# do_out can finish with newpage, which would leave an empty page at the end
+        if self.row > 0 or self.run or not self.pages:
+            self.end_page()
+        kids = ' '.join("{} 0 R".format(p) for p in self.pages)
+        for i, body in ((0, "<< /Type /Catalog /Pages 2 0 R >>"),
+                        (1, "<< /Type /Pages /Kids [{}] /Count {} >>".format(kids, len(self.pages)))):
+            self.offsets[i] = self.tell()
+            self.outstream.write("{} 0 obj\n{}\nendobj\n".format(i+1, body).encode('latin-1'))
+        xref = self.tell()
+        self.outstream.write("xref\n0 {}\n0000000000 65535 f \n".format(len(self.offsets)+1).encode('latin-1'))
+        self.outstream.write(''.join("{:010d} 00000 n \n".format(o) for o in self.offsets).encode('latin-1'))
+        self.outstream.write("trailer\n<< /Size {} /Root 1 0 R /Info {} 0 R >>\nstartxref\n{}\n%%EOF\n".format(
+                             len(self.offsets)+1, self.info, xref).encode('latin-1'))
+        Filedev.exit(self)
+
+class HTMLdev(Filedev):
+# The alignment as preformatted HTML, laid out as in the text output, with a <span> for each run of a
+# colour. The colours of each shading class are a CSS class; classes with the same colours share one, and
+# black on white needs none. With HTMLfragments set, each block of lines goes to a file of its own, next to
+# the main file, which has an empty <pre> for each block that is filled in when it scrolls into view.
+    script = (
+        "<script>\n"
+        "const blocks = new IntersectionObserver(function(entries) {\n"
+        "    for (const e of entries) {\n"
+        "        if (e.isIntersecting) {\n"
+        "            blocks.unobserve(e.target);\n"
+        "            fetch(e.target.dataset.src).then(r => r.text()).then(t => {e.target.innerHTML = t;});\n"
+        "        }\n"
+        "    }\n"
+        "}, {rootMargin: '2000px'});\n"
+        "document.querySelectorAll('pre[data-src]').forEach(b => blocks.observe(b));\n"
+        "</script>\n")
+
+    def __init__(self, fname, settings, filename=None):
+        super(HTMLdev, self).__init__(filename)
+        self.file_filter = ("HTML files (*.html *.htm);;All files (*)")
+        self.Alignment = fname
+        self.bgds = list(settings["PSbgds"])
+        self.fgds = list(settings["PSfgds"])
+        self.FSize = settings["PSFsize"]
+        self.lcs = list(settings["PSLCs"])
+        self.fragments = settings["HTMLfragments"]
+        self.interlines = settings["interlines"]
+        simflag = settings["simflag"]
+        globalflag = settings["globalflag"]
+        if not simflag:
+            self.fgds[2] = self.fgds[0]
+            self.bgds[2] = self.bgds[0]
+            self.lcs[2] = self.lcs[0]
+        if not globalflag:
+            self.fgds[3] = self.fgds[1]
+            self.bgds[3] = self.bgds[1]
+            self.lcs[3] = self.lcs[1]
+        self.lines_per_page = 9999
+
+    def hexcol(self, col):
+        return '#{:02x}{:02x}{:02x}'.format(*self.rgb(col))
+
+    def colour_classes(self):
+# the CSS class of each shading class (None for black on white), and the style rules for them
+        pairs = [(self.hexcol(self.fgds[c]), self.hexcol(self.bgds[c])) for c in range(4)] + [('#000000', '#ffffff')]
+        table = [p for p in dict.fromkeys(pairs) if p != ('#000000', '#ffffff')]
+        names = [None if p not in table else 'c{}'.format(table.index(p)) for p in pairs]
+        rules = ''.join(".c{} {{color: {}; background: {}}}\n".format(i, *p) for i, p in enumerate(table))
+        return names, rules
+
+    def graphics_init(self):
+        if self.fragments and not isinstance(self.filename, (str, os.PathLike)):
+            raise ValueError("HTML fragments are named after the main file, so it needs a file name")
+        if self.open_output_file():
+            self.names, rules = self.colour_classes()
+            self.main = self.outstream
+            self.outstream.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n')
+            self.outstream.write("<title>BOXSHADE document from: {}</title>\n".format(escape(self.Alignment)))
+            self.outstream.write("<style>\npre {{font-family: 'Courier New', Courier, monospace; font-weight: bold; "
+                                 "font-size: {}pt; line-height: 1.2; margin: 0; color: #000000; background: #ffffff}}\n".format(self.FSize))
+            if self.fragments:
+# an empty block still takes up the room of its lines, so that the ones further down stay out of view
+                self.outstream.write("pre[data-src]:empty {{height: {:g}em}}\n".format(round(1.2*(self.no_seqs+self.interlines), 2)))
+            self.outstream.write(rules+"</style>\n</head>\n<body>\n")
+            if not self.fragments:
+                self.outstream.write("<pre>")
+            self.line = []
+            self.span = None
+            self.act_col = 4
+            self.block = 0 # the number of blocks started
+            self.block_lines = 0 # the lines of the alignment written in the current block
+            return True
+        else:
+            return False
+
+    def start_block(self):
+        self.block += 1
+        self.block_lines = 0
+        if self.fragments:
+            if self.outstream is not self.main:
+                self.outstream.close()
+            stem = os.path.splitext(self.filename)[0]
+            fragment = "{}.{}.html".format(stem, self.block)
+            self.main.write('<pre data-src="{}"></pre>\n'.format(escape(os.path.basename(fragment), {'"': '&quot;'})))
+            self.outstream = open_sink(fragment)
+
+    def set_colour(self, c):
+        self.act_col = c
+
+    def char_out(self, ch):
+        self.string_out(ch)
+
+    def runs_out(self, runs):
+        for c, text in runs:
+            self.act_col = c
+            self.string_out(text)
+
+    def string_out(self, str):
+        if not self.line and (self.block == 0 or self.block_lines == self.no_seqs):
+            self.start_block()
+        name = self.names[self.act_col]
+        if name != self.span or not self.line:
+            if self.span:
+                self.line.append('</span>')
+            if name:
+                self.line.append('<span class="{}">'.format(name))
+            self.span = name
+        self.line.append(escape(str))
+
+    def end_line(self):
+        if self.span:
+            self.line.append('</span>')
+        self.span = None
+        self.line.append('\n')
+        self.outstream.write(''.join(self.line))
+        self.line = []
+
+    def newline(self):
+        if self.line:
+            self.block_lines += 1
+        self.end_line()
+
+    def newpage(self):
+# do_out calls this in place of the blank lines between blocks, when they would not fit on the page
+        if self.line:
+            self.block_lines += 1
+            self.end_line()
+
+    def exit(self):
+        if self.line:
+            self.end_line()
+        if self.outstream is not self.main:
+            self.outstream.close()
+        self.outstream = self.main
+        if not self.fragments:
+            self.outstream.write("</pre>\n")
+        else:
+            self.outstream.write(self.script)
+        self.outstream.write("</body>\n</html>\n")
+        super().exit()
+
+class ASCIIdev(Filedev):
+    parallel_blocks = True
+    whole_blocks = True
+
+    def __init__(self, fname, settings, filename=None):
+        super(ASCIIdev, self).__init__(filename)
+        self.file_filter = ("Text files (*.txt);;All files (*)")
+        self.Alignment = fname
+        self.Achars = list(settings["ASCIIchars"])
+        self.Achars.append('L')
+        simflag = settings["simflag"]
+        globalflag = settings["globalflag"]
+        if not simflag:
+            self.Achars[2] = self.Achars[0]
+        if not globalflag:
+            self.Achars[3] = self.Achars[1]
+        self.lcs = [(x.isalpha()) and (x == x.lower()) for x in self.Achars]
+        self.lines_per_page = 9999
+
+    def map_chars(self):
+# the character for every residue, worked out for the whole alignment at once: the residue itself in
+# the classes shown as 'L' or 'l', the symbol of the class in the others. Everything is then class 4
+# (shown as itself), so that each line of residues reaches runs_out as a single run.
+        shown = np.array([x.upper() == 'L' for x in self.Achars])
+        symbols = np.frombuffer(''.join(self.Achars).encode('latin-1'), dtype=np.uint8)
+        self.seqs = np.where(shown[self.cols], self.seqs, symbols[self.cols]).astype(np.uint8)
+        self.cols = np.full(self.cols.shape, 4, dtype=self.cols.dtype)
+
+    def graphics_init(self):
+        if self.open_output_file():
+            self.map_chars()
+            self.current_char = ''
+            self.outstream.write("Alignment file: {}\n".format(self.Alignment))
+            d = datetime.datetime.now()
+            self.outstream.write("Created by Boxshade: {:%H:%M:%S %B %d, %Y}\n\n".format(d))
+            return True
+        else:
+            return False
+
+    def set_colour(self, c):
+        self.current_char = self.Achars[c]
+
+    def char_out(self, ch):
+        if self.current_char.upper() == 'L':
+            self.outstream.write(ch)
+        else:
+            self.outstream.write(self.current_char)
+
+    def runs_out(self, runs):
+        self.outstream.write(''.join(text if self.Achars[c].upper() == 'L' else self.Achars[c]*len(text)
+                                     for c, text in runs))
+
+    def string_out(self, str):
+        self.outstream.write(str)
+
+    def block_text(self, heads, residues, tails, ends):
+# the residues are already the characters to show (map_chars), so a block is its rows joined up with
+# the names and numbers, and written in one go; the line ends are those of newline and newpage
+        width = residues.shape[1]
+        rows = residues.tobytes().decode('latin-1')
+        breaks = ['\n' if end == 'n' else '' for end in ends]
+        lines = [heads[j] + rows[j*width:(j+1)*width] + tails[j] + breaks[j] for j in range(len(heads))]
+        self.outstream.write(''.join(lines + breaks[len(heads):]))
+
+    def newline(self):
+        self.outstream.write('\n')
+
+    def newpage(self):
+        pass
+
+    def exit(self):
+        self.outstream.write('\n')
+        super().exit()
+
+
+class PNGfile():
+# A PNG file written a band of rows at a time, so that the whole picture never has to be held in memory.
+# The rows are 8 bit RGB, each filtered with the PNG "Sub" filter, which suits the runs of one colour.
+
+    def __init__(self, filename, width, height):
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.filename = filename
+        self.file = open_sink(filename, binary=True)
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self.chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        self.compressor = zlib.compressobj(6)
+
+    def chunk(self, kind, data):
+        self.file.write(struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data)))
+
+    def write_rows(self, data, nrows, stride):
+# data holds nrows rows of RGB bytes, each starting stride bytes after the last
+        rows = np.frombuffer(data, dtype=np.uint8, count=nrows*stride).reshape(nrows, stride)[:, 0:self.width*3]
+        filtered = np.empty((nrows, self.width*3+1), dtype=np.uint8)
+        filtered[:, 0] = 1
+        filtered[:, 1:4] = rows[:, 0:3]
+        np.subtract(rows[:, 3:], rows[:, :-3], out=filtered[:, 4:])
+        self.rows += nrows
+        compressed = self.compressor.compress(filtered.tobytes())
+        if compressed:
+            self.chunk(b'IDAT', compressed)
+
+    def close(self):
+        try:
+            if self.rows != self.height:
+                raise ValueError("PNG file given {} rows out of {}".format(self.rows, self.height))
+            self.chunk(b'IDAT', self.compressor.flush())
+            self.chunk(b'IEND', b'')
+        finally:
+            close_sink(self.file, self.filename)
+
+
+# A 5 x 8 bitmap font for the printable ASCII characters, from space to '~': 8 rows of 5 bits for each
+# character, written as 2 hex digits a row. The last row is for descenders.
+font_5x8 = (
+    '000000000000000004040404040004000a0a0a00000000000a0a1f0a1f0a0a00040f140e051e04001819020408130300'
+    '0c12140815120d000404040000000000020408080804020008040202020408000004150e150400000004041f04040000'
+    '00000000000c04080000001f0000000000000000000c0c0000010204081000000e11131519110e00040c040404040e00'
+    '0e11010204081f001f02040201110e0002060a121f0202001f101e0101110e000608101e11110e001f01020408080800'
+    '0e11110e11110e000e11110f01020c00000c0c000c0c0000000c0c000c040800020408100804020000001f001f000000'
+    '08040201020408000e110102040004000e11010d15150e000e11111f111111001e11111e11111e000e11101010110e00'
+    '1c12111111121c001f10101e10101f001f10101e101010000e11101711110f001111111f111111000e04040404040e00'
+    '0702020202120c0011121418141211001010101010101f00111b15151111110011111915131111000e11111111110e00'
+    '1e11111e101010000e11111115120d001e11111e141211000f10100e01011e001f040404040404001111111111110e00'
+    '11111111110a04001111111515150a0011110a040a11110011110a04040404001f01020408101f000e08080808080e00'
+    '00100804020100000e02020202020e00040a1100000000000000000000001f00080402000000000000000e010f110f00'
+    '1010161911111e0000000e1010110e0001010d1311110f0000000e111f100e000609081c0808080000000f11110f010e'
+    '101016191111110004000c0404040e00020006020202120c10101214181412000c04040404040e0000001a1515111100'
+    '000016191111110000000e1111110e0000001e11111e101000000f11110f0101000016191010100000000f100e011e00'
+    '08081c08080906000000111111130d0000001111110a04000000111115150a000000110a040a110000001111110f010e'
+    '00001f0204081f000204040804040200040404040404040008040402040408000000081502000000')
+font_bits = np.unpackbits(np.frombuffer(bytes.fromhex(''.join(font_5x8)), dtype=np.uint8).reshape(95, 8, 1), axis=2)[:, :, 3:]
+# the glyph of each character code, '?' for those outside the font
+font_index = np.full(256, ord('?')-32, dtype=np.intp)
+font_index[32:127] = np.arange(95)
+
+def overlaps(n, scale):
+# the fraction of each of the n pixels of a scaled glyph covered by each of its source pixels
+    edges = np.arange(n+1)/scale
+    src = np.arange(int(np.ceil(n/scale)))
+    return np.clip(np.minimum(edges[1:, None], src+1)-np.maximum(edges[:-1, None], src), 0, None)*scale
+
+
+class Picturedev(Filedev):
+# the layout of a picture of the alignment, shared by OutDevs.Paintdev and PNGdev: a grid of character
+# cells with margins round it. Colours are (r, g, b) tuples, with those of colour 4 added at the end.
+
+    def __init__(self, settings, filename=None):
+        super(Picturedev, self).__init__(filename)
+        self.top_mar = 30.0
+        self.left_mar = 30.0
+        self.bgds = list(settings["PSbgds"])
+        self.fgds = list(settings["PSfgds"])
+        self.FSize = settings["PSFsize"]
+        self.lcs = list(settings["PSLCs"])
+        self.simflag = settings["simflag"]
+        self.globalflag = settings["globalflag"]
+        self.interlines = settings["interlines"]
+        self.outlen = settings["outlen"]
+        self.snameflag = settings["snameflag"]
+        self.LHsnumsflag = settings["LHsnumsflag"]
+        self.RHsnumsflag = settings["RHsnumsflag"]
+
+        if not self.simflag:
+            self.fgds[2] = self.fgds[0]
+            self.bgds[2] = self.bgds[0]
+            self.lcs[2] = self.lcs[0]
+        if not self.globalflag:
+            self.fgds[3] = self.fgds[1]
+            self.bgds[3] = self.bgds[1]
+            self.lcs[3] = self.lcs[1]
+        self.fgds.append((0, 0, 0))
+        self.bgds.append((255, 255, 255))
+        self.dev_miny = self.top_mar
+        self.dev_minx = self.left_mar
+        if system() == "Darwin":
+            self.dev_xsize = self.FSize * 0.8
+            self.dev_ysize = self.FSize
+        else:
+            self.dev_xsize = self.FSize * 0.9
+            self.dev_ysize = self.FSize * 1.2
+        self.lines_per_page = 10000
+
+    def line_chars(self):
+# the number of characters in an output line
+        nchars = self.outlen
+        if self.snameflag:
+            nchars += 1+len(self.seqnames[0])
+        if self.LHsnumsflag:
+            nchars += 1+len(self.LHprenums[0][0])
+        if self.RHsnumsflag:
+            nchars += 1+len(self.RHprenums[0][0])
+        return nchars
+
+    def canvas_size(self):
+# the width and height of the picture, which can only be worked out once prep_out has filled in the
+# sequences, so graphics_init is called at the end of prep_out
+        blocks = (self.seqs.shape[1]//self.outlen)+1
+        height = int(self.top_mar+(self.dev_ysize*(blocks*(self.no_seqs+self.interlines)-self.interlines))+self.top_mar+0.5)
+        width = int(self.left_mar + (self.dev_xsize*self.line_chars())+self.left_mar+0.5)
+        return width, height
+
+
+class PNGdev(Picturedev):
+# Draws the picture into numpy arrays, a line of cells at a time, and writes it to a PNG file as it
+# goes, so it needs neither Qt nor a display. The cells are whole pixels; the characters come from
+# font_5x8, scaled to the cell with antialiasing and made bold.
+    parallel_blocks = True
+
+    def __init__(self, fname, settings, filename=None):
+        super(PNGdev, self).__init__(settings, filename)
+        self.file_filter = ("PNG files (*.png);;All files (*)")
+        self.Alignment = fname
+
+    def make_glyphs(self, cell_width, cell_height):
+# the coverage (0-255) of every character, centred in a cell_width x cell_height box
+        bold = np.pad(font_bits, ((0, 0), (0, 0), (0, 1))) | np.pad(font_bits, ((0, 0), (0, 0), (1, 0)))
+        scale_y = 0.8*self.dev_ysize/7
+        scale_x = min(scale_y, (self.dev_xsize-2)/6)
+        h, w = min(int(np.ceil(8*scale_y)), cell_height), min(int(np.ceil(6*scale_x)), cell_width)
+        ry, rx = overlaps(h, scale_y)[:, 0:8], overlaps(w, scale_x)[:, 0:6]
+        glyphs = np.zeros((95, cell_height, cell_width), dtype=np.uint8)
+        top, left = (cell_height-h)//2, (cell_width-w)//2
+        cover = np.einsum('yr,grc,xc->gyx', ry, bold.astype(float), rx)
+        glyphs[:, top:top+h, left:left+w] = np.rint(np.clip(cover, 0, 1)*255)
+        return glyphs
+
+    def graphics_init(self):
+        self.width, self.height = self.canvas_size()
+        edges = np.rint(self.dev_minx + np.arange(self.line_chars()+1)*self.dev_xsize).astype(np.intp)
+# for each pixel column: the cell it is in (-1 in the margins), and how far into the cell it is
+        self.cell_of = np.full(self.width, -1, dtype=np.intp)
+        self.cell_x = np.zeros(self.width, dtype=np.intp)
+        for i in range(edges.size-1):
+            self.cell_of[edges[i]:edges[i+1]] = i
+            self.cell_x[edges[i]:edges[i+1]] = np.arange(edges[i+1]-edges[i])
+        self.glyphs = self.make_glyphs(int(np.diff(edges).max()), int(np.ceil(self.dev_ysize)))
+        self.bg_lut = np.array(self.bgds, dtype=np.uint16)
+        self.fg_lut = np.array(self.fgds, dtype=np.uint16)
+        self.png = PNGfile(self.filename, self.width, self.height)
+        self.bands = None # the bands drawn by a worker process, kept to be written by the main one
+        self.done = 0 # the rows of the picture written so far
+        self.row = 0
+        self.act_col = 4
+        self.line = []
+        self.line_cols = []
+        return True
+
+    def white_rows(self, upto):
+        if upto > self.done:
+            self.png.write_rows(bytes([255])*(3*self.width*(upto-self.done)), upto-self.done, 3*self.width)
+            self.done = upto
+
+    def line_out(self):
+# draw the cells of a line: the background of each pixel column from its colour, then the characters
+# blended in between the background and foreground colours
+        top = int(round(self.dev_miny + self.row*self.dev_ysize))
+        bottom = min(int(round(self.dev_miny + (self.row+1)*self.dev_ysize)), self.height)
+        if bottom <= top:
+            self.band_out(top, top, b'')
+            return
+        band = np.full((bottom-top, self.width, 3), 255, dtype=np.uint16)
+        codes = np.frombuffer(''.join(self.line).encode('latin-1', 'replace'), dtype=np.uint8)
+        cols = np.array(self.line_cols, dtype=np.intp)
+        px = np.nonzero((self.cell_of >= 0) & (self.cell_of < codes.size))[0]
+        cells = self.cell_of[px]
+        alpha = self.glyphs[font_index[codes[cells]], 0:bottom-top, self.cell_x[px]].T[:, :, None]
+        band[:, px] = (self.bg_lut[cols[cells]]*(255-alpha) + self.fg_lut[cols[cells]]*alpha + 127)//255
+        self.band_out(top, bottom, band.astype(np.uint8).tobytes())
+
+    def band_out(self, top, bottom, data):
+# write the rows from top to bottom, after white ones down to top
+        if self.bands is not None:
+            self.bands.append((top, bottom, data))
+            return
+        self.white_rows(top)
+        if bottom > top:
+            self.png.write_rows(data, bottom-top, 3*self.width)
+            self.done = bottom
+
+    def block_start(self, block, pos):
+        self.row = pos.newlines
+        self.line = []
+        self.line_cols = []
+
+    def capture(self):
+        self.bands = []
+
+    def captured(self):
+        return self.bands
+
+    def fragment_out(self, fragment):
+        for band in fragment:
+            self.band_out(*band)
+
+    def __getstate__(self):
+        state = super(PNGdev, self).__getstate__()
+        state.update(png=None)
+        return state
+
+    def set_colour(self, c):
+        self.act_col = c
+
+    def char_out(self, ch):
+        self.line.append(ch)
+        self.line_cols.append(self.act_col)
+
+    def runs_out(self, runs):
+        for c, text in runs:
+            self.line.append(text)
+            self.line_cols.extend([c]*len(text))
+
+    def string_out(self, str):
+        self.line.append(str)
+        self.line_cols.extend([self.act_col]*len(str))
+
+    def newline(self):
+        if self.line:
+            self.line_out()
+        self.line = []
+        self.line_cols = []
+        self.row += 1
+
+    def newpage(self):
+        pass
+
+    def exit(self):
+        self.white_rows(self.height)
+        self.png.close()
+
+
+class SVGdev(Picturedev):
+# The picture as SVG: a rectangle for each run of a background colour and a text element for each run of
+# a foreground colour, styled by CSS classes, one for each distinct colour. Each line is written out as
+# soon as it is finished, and there is no limit on the size of the picture.
+    parallel_blocks = True
+
+    def __init__(self, fname, settings, filename=None):
+        super(SVGdev, self).__init__(settings, filename)
+        self.file_filter = ("SVG files (*.svg);;All files (*)")
+        self.Alignment = fname
+
+    def num(self, x):
+        return '{:g}'.format(round(x, 2))
+
+    def colour_classes(self, cols, prefix):
+# the CSS class of each shading class, shared by those with the same colour, and the style rules for them
+        names, rules = [], []
+        for col in cols:
+            hexcol = '#{:02x}{:02x}{:02x}'.format(*self.rgb(col))
+            rule = " {{fill: {}}}\n".format(hexcol)
+            if rule not in rules:
+                rules.append(rule)
+            names.append(prefix+str(rules.index(rule)))
+        return names, ''.join(".{}{}{}".format(prefix, i, rule) for i, rule in enumerate(rules))
+
+    def graphics_init(self):
+        self.width, self.height = self.canvas_size()
+        if self.open_output_file():
+            self.bgnames, bgrules = self.colour_classes(self.bgds, 'b')
+            self.fgnames, fgrules = self.colour_classes(self.fgds, 'f')
+# no rectangles are needed for backgrounds the colour of the page
+            self.blank = [tuple(self.rgb(c)) == (255, 255, 255) for c in self.bgds]
+            self.outstream.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            self.outstream.write('<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" viewBox="0 0 {0} {1}">\n'.format(
+                                 self.width, self.height))
+            self.outstream.write("<title>BOXSHADE document from: {}</title>\n".format(escape(self.Alignment)))
+# the characters are centred in their boxes: letter-spacing widens the advance of the font (0.6 of the
+# font size) to the width of a box
+            self.outstream.write("<style>\ntext {{font-family: 'Courier New', Courier, monospace; font-weight: bold; "
+                                 "font-size: {}px; letter-spacing: {}px; white-space: pre; dominant-baseline: central}}\n".format(
+                                 self.FSize, self.num(self.dev_xsize-0.6*self.FSize)))
+            self.outstream.write(bgrules+fgrules+"</style>\n")
+            self.outstream.write('<rect width="100%" height="100%" fill="#ffffff"/>\n')
+            self.xoff = (self.dev_xsize-0.6*self.FSize)/2
+            self.row = 0
+            self.act_col = 4
+            self.start_line()
+            return True
+        else:
+            return False
+
+    def block_start(self, block, pos):
+        self.row = pos.newlines
+        self.start_line()
+
+    def start_line(self):
+        self.rects = []
+        self.texts = []
+        self.col = 0
+        self.rect = None # the background run being built up: [class name, start, length]
+        self.text = None # the text run being built up: [class name, start, characters]
+
+    def close_rect(self):
+        if self.rect:
+            name, start, length = self.rect
+            self.rects.append('<rect class="{}" x="{}" y="{}" width="{}" height="{}"/>\n'.format(name,
+                             self.num(self.dev_minx+start*self.dev_xsize), self.num(self.dev_miny+self.row*self.dev_ysize),
+                             self.num(length*self.dev_xsize), self.num(self.dev_ysize)))
+            self.rect = None
+
+    def close_text(self):
+        if self.text:
+            name, start, chars = self.text
+            text = ''.join(chars).rstrip(' ')
+            if text.strip():
+                self.texts.append('<text class="{}" x="{}" y="{}">{}</text>\n'.format(name,
+                                  self.num(self.dev_minx+start*self.dev_xsize+self.xoff),
+                                  self.num(self.dev_miny+(self.row+0.5)*self.dev_ysize), escape(text)))
+            self.text = None
+
+    def set_colour(self, c):
+        self.act_col = c
+
+    def char_out(self, ch):
+        self.string_out(ch)
+
+    def runs_out(self, runs):
+        for c, text in runs:
+            self.act_col = c
+            self.string_out(text)
+
+    def string_out(self, str):
+# the background and text runs are ended separately, when their own colour changes
+        c = self.act_col
+        if self.rect and (self.blank[c] or self.rect[0] != self.bgnames[c]):
+            self.close_rect()
+        if not self.blank[c]:
+            if self.rect:
+                self.rect[2] += len(str)
+            else:
+                self.rect = [self.bgnames[c], self.col, len(str)]
+        if self.text and self.text[0] != self.fgnames[c]:
+            self.close_text()
+        if self.text:
+            self.text[2].append(str)
+        else:
+            self.text = [self.fgnames[c], self.col, [str]]
+        self.col += len(str)
+
+    def newline(self):
+# the rectangles go before the text, so that they don't cover the parts of characters outside their box
+        self.close_rect()
+        self.close_text()
+        self.outstream.write(''.join(self.rects+self.texts))
+        self.row += 1
+        self.start_line()
+
+    def newpage(self):
+        pass
+
+    def exit(self):
+        self.close_rect()
+        self.close_text()
+        self.outstream.write(''.join(self.rects+self.texts)+"</svg>\n")
+        super().exit()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+
+# Streaming readers for the alignment formats BS_core recognises. They put the residues straight into
+# a uint8 matrix instead of building Bio.AlignIO SeqRecords, so that a large file is never held as
+# Python strings. Each reader is a generator of (row, fragment) pairs in file order, filling in the
+# list of sequence names as it meets them; read_matrix runs it once to size the matrix and once more
+# to fill it. The readers follow what AlignIO makes of the same file, and raise ValueError for
+# anything they are not sure of, in which case BS_core reads the file with AlignIO instead.
+#
+# A large FASTA or Phylip file with every sequence on one line, at the same width, need not be read at
+# all: the residues sit at fixed offsets, so map_fasta/map_phylip give the matrix as a strided view of a
+# read-only memory map of the file, and the pages are only brought in as the shading reaches them.
+
+import re
+
+import numpy as np
+
+unusual = re.compile(rb'[^\t\n\x20-\x7e]')
+
+def lines(f):
+# the lines of a binary file, with CRLF ends as LF; anything but printable ASCII text is left to AlignIO
+    for line in f:
+        if line.endswith(b'\r\n'):
+            line = line[:-2] + b'\n'
+        if unusual.search(line):
+            raise ValueError("not plain ASCII text")
+        yield line
+
+map_residue = np.zeros(256, dtype=bool) # bytes a mapped matrix may hold: printable, no space or lowercase
+map_residue[0x21:0x7f] = True
+map_residue[ord('a'):ord('z')+1] = False
+printable = (np.arange(256) >= 0x20) & (np.arange(256) < 0x7f)
+map_cells = 1 << 22 # matrix cells checked per numpy pass
+
+def check_mapped(seqs, allowed):
+# every byte of the view must be a residue that needs no case change; a stray line end shows up here too
+    step = max(1, map_cells // max(seqs.shape[1], 1))
+    for r0 in range(0, seqs.shape[0], step):
+        if not allowed[seqs[r0:r0+step]].all():
+            raise ValueError("not a fixed width file of uppercase residues")
+
+def line_ends(mm, count):
+# offsets just past the first count line ends of a mapped file
+    ends = []
+    for pos in range(0, mm.size, 1 << 20):
+        ends.extend(pos+e+1 for e in np.flatnonzero(mm[pos:pos+(1 << 20)] == ord('\n'))[0:count-len(ends)])
+        if len(ends) == count:
+            return ends
+    raise ValueError("no fixed width layout")
+
+def fixed_rows(mm, start, stride, eol, ends):
+# the file from start as a (rows, stride) matrix of equal lines, checking the line ends at the given offsets
+    if stride <= 0 or (mm.size-start) % stride:
+        raise ValueError("no fixed width layout")
+    rows = mm[start:].reshape(-1, stride).view(np.ndarray)
+    for e in ends:
+        if not (rows[:, e-1] == ord('\n')).all() or (eol == 2 and not (rows[:, e-2] == ord('\r')).all()):
+            raise ValueError("no fixed width layout")
+    return rows
+
+def map_fasta(fileName):
+# FASTA with the titles all the same length and each sequence on a single line
+    mm = np.memmap(fileName, dtype=np.uint8, mode='r')
+    h, s = line_ends(mm, 2)
+    eol = 2 if mm[h-2] == ord('\r') else 1
+    rows = fixed_rows(mm, 0, s, eol, [h, s])
+    if not (rows[:, 0] == ord('>')).all() or s-h-eol < 1:
+        raise ValueError("no fixed width layout")
+    seqs = rows[:, h:s-eol]
+    check_mapped(seqs[:, 0:1], map_residue & (np.arange(256) != ord('>')))
+    check_mapped(seqs, map_residue)
+    titles = rows[:, 1:h-eol]
+    check_mapped(titles, printable)
+    names = []
+    for title in titles:
+        title = title.tobytes().split(None, 1)
+        names.append(title[0].decode('ascii') if title else '')
+    return seqs, names
+
+def map_phylip(fileName):
+# Phylip with every "name sequence" line the same length, so that the sequences line up in one block
+    mm = np.memmap(fileName, dtype=np.uint8, mode='r')
+    h, s = line_ends(mm, 2)
+    parts = mm[0:h].tobytes().split()
+    if len(parts) != 2 or not all(p.isdigit() for p in parts):
+        raise ValueError("First line should have two integers")
+    nseqs, nchar = int(parts[0]), int(parts[1])
+    eol = 2 if mm[h-2] == ord('\r') else 1
+    rows = fixed_rows(mm, h, s-h, eol, [s-h])
+    start = s-h-eol-nchar # column of the first residue
+    if rows.shape[0] != nseqs or nchar < 1 or start < 2 or not (rows[:, start-1] == ord(' ')).all():
+        raise ValueError("no fixed width layout")
+    seqs = rows[:, start:start+nchar]
+    check_mapped(seqs, map_residue & (np.arange(256) != ord('.')))
+    prefix = rows[:, 0:start]
+    check_mapped(prefix, printable)
+    names = []
+    for name in prefix:
+        name = name.tobytes().split()
+        if len(name) != 1:
+            raise ValueError("no fixed width layout")
+        names.append(name[0].decode('ascii'))
+    return seqs, names
+
+def read_matrix(fileName, reader):
+# (matrix of ASCII codes, list of names) for a file, using one of the reader generators below
+    names = []
+    lengths = []
+    with open(fileName, 'rb') as f:
+        for row, frag in reader(f, names):
+# a record with no residues yields nothing, so the rows can skip ahead
+            lengths.extend([0] * (row+1-len(lengths)))
+            lengths[row] += len(frag)
+    lengths.extend([0] * (len(names)-len(lengths)))
+    if not names or len(lengths) != len(names):
+        raise ValueError("No records found")
+    if min(lengths) != max(lengths) or lengths[0] == 0:
+        raise ValueError("Sequences must all be the same length")
+    seqs = np.empty((len(names), lengths[0]), dtype=np.uint8)
+    pos = [0] * len(names)
+    with open(fileName, 'rb') as f:
+        for row, frag in reader(f, []):
+            p = pos[row]
+            seqs[row, p:p+len(frag)] = np.frombuffer(frag, dtype=np.uint8)
+            pos[row] = p+len(frag)
+    return seqs, [name.decode('ascii') for name in names]
+
+def fasta_reader(f, names):
+# the record id is the first word of the title; whitespace in the sequence lines is dropped
+    row = -1
+    for line in lines(f):
+        if line.startswith(b'>'):
+            title = line[1:].split(None, 1)
+            names.append(title[0] if title else b'')
+            row += 1
+        elif row < 0:
+            raise ValueError("text before the first record")
+        else:
+            frag = line.translate(None, b' \t\r\n')
+            if frag:
+                yield row, frag
+
+clustal_headers = [b"CLUSTAL", b"PROBCONS", b"MUSCLE", b"MSAPROBS", b"Kalign", b"Biopython"]
+
+def clustal_reader(f, names):
+# blocks of "name sequence [residue count]" lines, with the names of the first block repeated in the
+# same order in every later one; lines starting with a space are the conservation (consensus) lines
+    it = lines(f)
+    line = next(it, b'')
+    if not line.strip() or line.split()[0] not in clustal_headers:
+        raise ValueError("not a known CLUSTAL header")
+    first = True
+    row = 0
+    letters = []
+    for line in it:
+        if not line.strip() or line.startswith(b' '):
+            if row:
+                raise ValueError("block with missing sequences")
+            first = first and not names
+            continue
+        fields = line.split()
+        if fields[0] in clustal_headers:
+            raise ValueError("more than one alignment in the file")
+        if len(fields) < 2 or len(fields) > 3:
+            raise ValueError("Could not parse line")
+        if first:
+            names.append(fields[0])
+            letters.append(0)
+            row = len(names)-1
+        elif fields[0] != names[row]:
+            raise ValueError("Identifiers out of order")
+        letters[row] += len(fields[1]) - fields[1].count(b'-')
+        if len(fields) == 3 and (not fields[2].isdigit() or int(fields[2]) != letters[row]):
+            raise ValueError("invalid sequence number")
+        yield row, fields[1]
+        row = 0 if first or row+1 == len(names) else row+1
+    if row:
+        raise ValueError("End of file mid-block")
+
+def phylip_reader(f, names):
+# relaxed (interleaved) Phylip as AlignIO reads it: a line with the numbers of sequences and columns,
+# then a first block of "name sequence" lines, then blocks of sequence lines in the same order
+    it = lines(f)
+    parts = next(it, b'').split()
+    if len(parts) != 2 or not all(p.isdigit() for p in parts):
+        raise ValueError("First line should have two integers")
+    nseqs = int(parts[0])
+    if nseqs == 0:
+        raise ValueError("no sequences")
+    for row in range(nseqs):
+        line = next(it, b'')
+        fields = line.rstrip().split(None, 1)
+        if len(fields) != 2:
+            raise ValueError("Could not split line into identifier and sequence")
+        frag = fields[1].strip().replace(b' ', b'')
+        if b'.' in frag:
+            raise ValueError("dots in a Phylip sequence")
+        names.append(fields[0])
+        yield row, frag
+    row = 0
+    for line in it:
+        if row == 0:
+            if not line.strip():
+                continue
+            parts = line.split()
+            if len(parts) == 2 and all(p.isdigit() for p in parts):
+                raise ValueError("more than one alignment in the file")
+        frag = line.strip().replace(b' ', b'')
+        if b'.' in frag:
+            raise ValueError("dots in a Phylip sequence")
+        yield row, frag
+        row = (row+1) % nseqs
+    if row:
+        raise ValueError("End of file mid-block")
+
+msf_headers = [b"!!NA_MULTIPLE_ALIGNMENT", b"!!AA_MULTIPLE_ALIGNMENT", b"PileUp"]
+
+def msf_reader(f, names):
+# GCG MSF: a header with "MSF: <columns> Type: <P|N> ... Check: <n> ..", the Name: lines up to "//",
+# then blocks of 50 columns, each optionally headed by a line of column numbers
+    it = lines(f)
+    line = next(it, b'')
+    if not line.strip() or line.split()[0] not in msf_headers:
+        raise ValueError("not a known GCG MSF header")
+    while line and b' MSF: ' not in line:
+        line = next(it, b'')
+    parts = line.split()
+    if not parts:
+        raise ValueError("no MSF/Type/Check header line")
+    offset = parts.index(b'MSF:')
+    if (len(parts) < offset+4 or parts[offset+2] != b'Type:' or parts[-3] not in (b'Check:', b'CompCheck:')
+            or parts[-1] != b'..' or not parts[offset+1].isdigit() or parts[offset+3] not in (b'P', b'N')):
+        raise ValueError("unusual GCG MSF header line")
+    aln_length = int(parts[offset+1])
+    ids = []
+    lengths = []
+    line = next(it, b'')
+    while line and line.strip() != b'//':
+        line = next(it, b'')
+        if line.strip().startswith(b'Name: '):
+            rest = line[line.index(b'Name: ')+6:].strip()
+            if rest.count(b' Len: ') != 1 or rest.count(b' Check: ') != 1 or rest.count(b' Weight: ') != 1:
+                raise ValueError("Malformed GCG MSF name line")
+            name, rest = rest.split(b' Len: ')
+            name = name.strip()
+            if name.endswith(b' oo'):
+                name = name[:-3]
+            if name in ids or b' ' in name:
+                raise ValueError("unusual GCG MSF name")
+            ids.append(name)
+            lengths.append(int(rest.split(b' Check: ')[0]))
+    if not line or not ids or max(lengths) != aln_length or min(lengths) != aln_length:
+        raise ValueError("GCG MSF lengths do not match")
+    names.extend(ids)
+    if next(it, b'x').strip():
+        raise ValueError("After // line, expected blank line before sequences.")
+    done = 0
+    while done < aln_length:
+        for idx, name in enumerate(ids):
+            line = next(it, b'')
+            while idx == 0 and line and not line.strip():
+                line = next(it, b'')
+            words = line.split()
+            if idx == 0 and words and words[0] != name:
+# a line of column numbers before the block
+                end = min(done+50, aln_length)
+                if words[0] != str(done+1).encode() or (len(words) > 1 and words[1:] != [str(end).encode()]):
+                    raise ValueError("Expected GCG MSF coordinate line")
+                words = next(it, b'').split()
+            if len(words) < 2 or words[0] != name:
+                raise ValueError("Expected sequence for {}".format(name))
+            yield idx, b''.join(words[1:]).replace(b'~', b'-').replace(b'.', b'-')
+        done += 50
+        if next(it, b'').strip():
+            raise ValueError("Expected blank line")
+    for line in it:
+        if line.strip():
+            raise ValueError("Unexpected line after GCG MSF alignment")
+
+def stockholm_reader(f, names):
+# "name sequence" lines, interleaved blocks joined by name; '.' gaps become '-'.
+# The per-column (#=GC) annotation must match the alignment length, as AlignIO checks.
+    it = lines(f)
+    if next(it, b'').strip() != b'# STOCKHOLM 1.0':
+        raise ValueError("Did not find STOCKHOLM header")
+    rows = {}
+    seqlen = {}
+    gc = {}
+    gr = {}
+    passed_end = False
+    for line in it:
+        line = line.strip()
+        if line == b'# STOCKHOLM 1.0':
+            raise ValueError("more than one alignment in the file")
+        elif line == b'//':
+            passed_end = True
+        elif line == b'':
+            pass
+        elif line[0:1] != b'#':
+            parts = [x.strip() for x in line.split(b' ', 1)]
+            if passed_end or len(parts) != 2:
+                raise ValueError("Could not split line into identifier and sequence")
+            if parts[0] not in rows:
+                rows[parts[0]] = len(names)
+                names.append(parts[0])
+            row = rows[parts[0]]
+            seqlen[row] = seqlen.get(row, 0) + len(parts[1])
+            yield row, parts[1].replace(b'.', b'-')
+        elif line[0:5] == b'#=GC ':
+            parts = line[5:].strip().split(None, 2)
+            if len(parts) != 2:
+                raise ValueError("unusual #=GC line")
+            gc[parts[0]] = gc.get(parts[0], 0) + len(parts[1].strip())
+        elif line[0:5] == b'#=GF ' and len(line[5:].strip().split(None, 1)) != 2:
+            raise ValueError("unusual #=GF line")
+        elif line[0:5] == b'#=GR ':
+            parts = line[5:].strip().split(None, 2)
+            if len(parts) != 3:
+                raise ValueError("unusual #=GR line")
+            gr[tuple(parts[0:2])] = gr.get(tuple(parts[0:2]), 0) + len(parts[2].strip())
+    if seqlen and any(n != seqlen[0] for n in list(gc.values()) + list(gr.values())):
+        raise ValueError("#=GC or #=GR annotation does not match the alignment length")
+
+nexus_chars = set(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-?*')
+
+def nexus_reader(f, names):
+# only the plainest Nexus files: a single DATA block with DIMENSIONS and FORMAT (datatype, missing=?,
+# gap=-, interleave), and a matrix with one "name sequence" line per taxon (per block if interleaved)
+    it = lines(f)
+    if next(it, b'').strip().upper() != b'#NEXUS':
+        raise ValueError("not a Nexus file")
+    head = []
+    for line in it:
+        if line.strip().upper() == b'MATRIX':
+            break
+        head.append(line)
+    else:
+        raise ValueError("no matrix")
+    commands = [c.split() for c in b' '.join(head).upper().replace(b'=', b' = ').split(b';')]
+    if (commands.pop(-1) or len(commands) != 3 or commands[0] != [b'BEGIN', b'DATA']
+            or [c[0:1] for c in commands[1:]] != [[b'DIMENSIONS'], [b'FORMAT']]):
+        raise ValueError("not a plain Nexus DATA block")
+    dims = commands[1][1:]
+    fmt = commands[2][1:]
+    if dims[0:3] != [b'NTAX', b'=', dims[2]] or dims[3:5] != [b'NCHAR', b'='] or len(dims) != 6:
+        raise ValueError("unusual Nexus dimensions")
+    ntax, nchar = int(dims[2]), int(dims[5])
+    interleave = False
+    while fmt:
+        key = fmt.pop(0)
+        if key == b'INTERLEAVE':
+            if fmt[0:1] == [b'=']:
+                interleave = fmt[1] == b'YES'
+                fmt = fmt[2:]
+            else:
+                interleave = True
+        elif fmt[0:1] != [b'='] or (key, fmt[1]) not in [(b'MISSING', b'?'), (b'GAP', b'-')] and key != b'DATATYPE':
+            raise ValueError("unusual Nexus format")
+        else:
+            fmt = fmt[2:]
+    done = [0] * ntax
+    row = 0
+    for line in it:
+        if line.strip() == b';':
+            break
+        words = line.split()
+        if not words:
+            continue
+        if row == len(names):
+            if len(names) == ntax or words[0][0:1] in (b"'", b'"', b'['):
+                raise ValueError("unusual Nexus matrix")
+            names.append(words[0])
+        elif not interleave or words[0] != names[row]:
+            raise ValueError("unusual Nexus matrix")
+        frag = b''.join(words[1:])
+        if not set(frag) <= nexus_chars:
+            raise ValueError("unusual Nexus characters")
+        done[row] += len(frag)
+        yield row, frag
+        row = (row+1) % ntax if interleave else row+1
+    else:
+        raise ValueError("no end to the matrix")
+    if len(names) != ntax or any(n != nchar for n in done):
+        raise ValueError("Nexus matrix does not match its dimensions")
+    for line in it:
+        if line.strip() and line.strip().upper() not in (b'END;', b'ENDBLOCK;'):
+            raise ValueError("more than the DATA block")
+
+readers = {"fasta": fasta_reader, "clustal": clustal_reader, "phylip-relaxed": phylip_reader, "msf": msf_reader,
+           "stockholm": stockholm_reader, "nexus": nexus_reader}
+mappers = {"fasta": map_fasta, "phylip-relaxed": map_phylip}
@@ -1,40 +1,32 @@
 #!/usr/bin/env python
 
-import numpy as np
 import BS_config as BS
-from platform import system
+from bisect import bisect_right
+from collections import OrderedDict
+import copy
+from math import ceil, floor, log2
 
-import datetime
-from PyQt5.QtCore import (QFile, Qt, QFileInfo, QTextStream, QDir, QSettings,QRectF)
-from PyQt5.QtGui import QColor,QPalette, QPixmap, QFont, QPainter, QPen, QIcon
-from PyQt5.QtWidgets import (QAction, QFileDialog, QLabel, QMessageBox, QApplication, QStyleFactory,
-                             QScrollArea, QSizePolicy, QVBoxLayout, QWidget, QToolBar)
+import numpy as np
 
-# class object that will handle output to a file
-# will subclass this for output to RTF/ASCII/PDF
-# noinspection PyMethodMayBeStatic
-class Filedev():
-
-    def __init__(self):
-# create the reference points for instance variables that will hold all the data to be processed by this instance
-        self.seqs = np.array([[' ', ' '], [' ', ' ']], dtype=str)
-        self.cols = np.full(self.seqs.shape, 0, dtype=np.int32)
-        self.seqnames =[]
-        self.no_seqs = 0
-        self.LHprenums = []
-        self.RHprenums = []
-        self.seqlens = []
-        self.startnums = []
-        self.lcs = []
-        self.interlines = 0
-        self.file_filter = ("All files (*);;PDF files (*.pdf);;RTF files (*.rtf);;ASCII files (*.txt)")
-        self.file = None
-        self.outstream = None
-        self.parent = None
-
-
-    def rgb(self, col):
-        return col.red(), col.green(), col.blue()
+from PyQt5.QtCore import (Qt, QFileInfo, QPoint, QRectF, pyqtSignal)
+from PyQt5.QtGui import QColor,QPalette, QFont, QPainter, QIcon, QImage
+from PyQt5.QtWidgets import (QAction, QFileDialog, QMessageBox, QApplication, QStyleFactory,
+                             QScrollArea, QHBoxLayout, QVBoxLayout, QWidget, QToolBar)
+
+import BS_devices
+
+# Pictures are drawn as a column of bands, each this many pixels high, as QPainter can't work beyond 32768
+# pixels; the bands are written to a PNG file as they are finished.
+TILE_HEIGHT = 4096
+
+def png_rows(png, image):
+# add the rows of a QImage to a BS_devices.PNGfile
+    image = image.convertToFormat(QImage.Format_RGB888)
+    png.write_rows(image.constBits().asstring(image.sizeInBytes()), image.height(), image.bytesPerLine())
+
+# The file devices live in BS_devices.py, free of Qt. The versions here ask for the output file with
+# a dialog and report problems and questions in message boxes.
+class GUIfile():
 
     def open_output_file(self):
         QApplication.restoreOverrideCursor()
@@ -43,105 +35,257 @@ class Filedev():
         TDialog = QFileDialog()
         fileName, _ = TDialog.getSaveFileName(self.parent,"Save file as:", BS.lastdir, self.file_filter, options=options)
         if fileName:
-            self.file = QFile(fileName)
+            self.filename = fileName
             BS.lastdir = QFileInfo(fileName).absolutePath()
-            if not self.file.open(QFile.WriteOnly | QFile.Text):  # open to write
+            try:
+                return super(GUIfile, self).open_output_file()
+            except OSError as e:
                 mb = QMessageBox()
                 mb.setTextFormat(Qt.RichText)
                 mb.setText("<p style='font-size: 18pt'>Open File error</p>"
                            "<p style='font-size: 14pt; font-weight: normal'> Can't open file <i>{}</i> for writing.<br><br>"
-                           " File error was: \"{}\".</p>".format(fileName, self.file.errorString()))
+                           " File error was: \"{}\".</p>".format(fileName, e.strerror))
                 mb.setIcon(QMessageBox.Warning)
                 mb.exec()
                 return False
-            else:
-                self.outstream = QTextStream(self.file)
-                return True
         else:
             return False
 
-    def make_lowercase(self, rulerflag):
-        if self.lcs[0]:
-            self.seqs[self.cols==0]=np.char.lower(self.seqs[self.cols==0])
-        if self.lcs[1]:
-            self.seqs[self.cols==1]=np.char.lower(self.seqs[self.cols==1])
-        if self.lcs[2]:
-            self.seqs[self.cols==2]=np.char.lower(self.seqs[self.cols==2])
-        if self.lcs[3]:
-            self.seqs[self.cols==3]=np.char.lower(self.seqs[self.cols==3])
-
-    def exit(self):
-        if self.file.isWritable():
-            self.file.close()
-        self.file=None
-
-class RTFdev(Filedev):
-
-    def __init__(self, fname):
-        super(RTFdev, self).__init__()
-        self.file_filter = ("RTF files (*.rtf);;All files (*)")
-        self.Alignment = fname
-        settings = QSettings("Boxshade", "Boxshade")
-        self.bgds = settings.value("PSbgds")
-        self.fgds = settings.value("PSfgds")
-        self.FSize = settings.value("PSFsize", type=int)
-        self.lcs = settings.value("PSLCs", type=bool)
-        simflag = settings.value("simflag", type=bool)
-        globalflag = settings.value("globalflag", type=bool)
-        if not simflag:
-            self.fgds[2] = self.fgds[0]
-            self.bgds[2] = self.bgds[0]
-            self.lcs[2] = self.lcs[0]
-        if not globalflag:
-            self.fgds[3] = self.fgds[1]
-            self.bgds[3] = self.bgds[1]
-            self.lcs[3] = self.lcs[1]
-
-        dev_miny = 1.0
-        dev_maxy = 15000.0
-        dev_ysize = self.FSize * 20.0
-        self.lines_per_page = int((dev_maxy - dev_miny) / dev_ysize)
-
-    def graphics_init(self):
-        if self.open_output_file():
-            self.outstream << '{\\rtf1\\ansi\\deff0\n{\\fonttbl{\\f0\\fmodern Courier New;}}\n'
-            self.outstream << '{{\\info{{\\author BOXSHADE}}{{\\title {}}}}}\n'.format(self.Alignment)
-            self.outstream << '{\\colortbl\n'
-            for i in range(4):
-                self.outstream << '\\red{}\\green{}\\blue{};'.format(*self.rgb(self.fgds[i]))
-
-            self.outstream << '\\red0\\green0\\blue0;' # equivalent to fgds[4]
-            for i in range(4):
-                self.outstream << '\\red{}\\green{}\\blue{};'.format(*self.rgb(self.bgds[i]))
-
-            self.outstream << '\\red255\\green255\\blue255;}\n' # equivalent to bgds[4]
-            self.outstream << '\\paperw11880\\paperh16820\\margl1000\\margr500\n'
-            self.outstream << '\\margt910\\margb910\\sectd\\cols1\\pard\\plain\n'
-            self.outstream << '\\fs{}\n\\b\n'.format(self.FSize * 2)
-            self.outstream.flush()
-            return True
+class RTFdev(GUIfile, BS_devices.RTFdev):
+    pass
+
+class ASCIIdev(GUIfile, BS_devices.ASCIIdev):
+    pass
+
+class SVGdev(GUIfile, BS_devices.SVGdev):
+    pass
+
+class HTMLdev(GUIfile, BS_devices.HTMLdev):
+    pass
+
+class PSdev(GUIfile, BS_devices.PSdev):
+
+    def confirm_width(self, page_width, line_length):
+        mb = QMessageBox()
+        mb.setTextFormat(Qt.RichText)
+        mb.setText("<p style='font-size: 18pt'>Picture too wide for page!</p>"
+                   "<p style='font-size: 14pt; font-weight: normal'> Be aware, at your current settings, the image "
+                   "will be wider than the page and will be clipped.<br>"
+                   "The page width is {:n} pixels and your output would have a width of {:n} pixels.<br><br>"
+                   "Do you want to continue?</p>".format(page_width, line_length))
+        mb.setIcon(QMessageBox.Information)
+        mb.setStandardButtons(QMessageBox.Yes|QMessageBox.No)
+        mb.setDefaultButton(QMessageBox.No)
+        ret = mb.exec()
+        return ret != QMessageBox.No
+
+class PDFdev(PSdev, BS_devices.PDFdev):
+    pass
+
+
+class AlignView(QWidget):
+# Shows the picture of an alignment at a scale, drawn a tile at a time as the tiles come into view,
+# straight from the laid out alignment, so that there is no picture of the whole thing to make first
+# or to scale. The tiles drawn most recently, at any scale, are kept.
+# When the characters would be too small to read, the cells are drawn as blocks of their background
+# colour instead, from a pyramid of pictures with a pixel for each cell, each 2x2 cells, 4x4 cells...
+# Its levels are made when they are first needed, and the least recently used are dropped to keep
+# the pyramid within pyramid_bytes.
+    tile_size = 256
+    cache_size = 400
+    overview_below = 4 # pixels on the screen a cell is wide
+    pyramid_bytes = 64 << 20
+
+    def __init__(self, parent=None):
+        super(AlignView, self).__init__(parent)
+        self.aln = None
+        self.scale = 1.0
+        self.tiles = OrderedDict() # (scale, column, row) -> QImage
+
+    def set_alignment(self, aln, gr_out):
+# aln has been laid out on gr_out, a Viewdev, by prep_out
+        self.aln, self.gr_out = aln, gr_out
+        self.layout, end = aln.out_layout(gr_out)
+        self.block_rows = [start.newlines for start, ends in self.layout]
+        self.rows = end.newlines
+        self.cells = None
+        self.levels = OrderedDict() # k -> level k of the pyramid, an array of (r, g, b) pixels
+        self.tiles.clear()
+        self.set_scale(1.0)
+
+    def set_scale(self, scale):
+        self.scale = scale
+        self.gr_out.set_scale(scale)
+        self.resize(int(self.gr_out.width*scale+0.5), int(self.gr_out.height*scale+0.5))
+        self.update()
+
+    def line_rows(self, i):
+# the row of the picture each line of block i is drawn in
+        start, ends = self.layout[i]
+        return start.newlines + np.cumsum([0] + [end == 'n' for end in ends[0:self.gr_out.no_seqs-1]])
+
+    def head(self):
+# the number of cells before the residues of a line, for the name and number
+        dev = self.gr_out
+        return (len(dev.seqnames[0])+1 if dev.snameflag else 0) + (len(dev.LHprenums[0][0])+1 if dev.LHsnumsflag else 0)
+
+    def cell_map(self):
+# the colour of every cell: the residues have the colours they were shaded with, and the names and
+# numbers either side of them, and the blank lines, are on white (colour 4)
+        if self.cells is None:
+            dev = self.gr_out
+            head = self.head()
+            self.cells = np.full((self.rows, dev.line_chars()), 4, dtype=np.uint8)
+            for i in range(len(self.layout)):
+                cols = dev.cols[:, i*dev.outlen:(i+1)*dev.outlen]
+                self.cells[self.line_rows(i)[:, None], head+np.arange(cols.shape[1])] = cols
+        return self.cells
+
+    def level(self, k):
+# level k of the pyramid has a pixel for each square of 2**k by 2**k cells, the average of their colours
+        image = self.levels.get(k)
+        if image is not None:
+            self.levels.move_to_end(k)
+            return image
+        if k == 0:
+            palette = np.array([c.getRgb()[0:3] for c in self.gr_out.bgds], dtype=np.uint8)
+            image = palette[self.cell_map()]
         else:
-            return False
-
-    def set_colour(self, c):
-        colno = c
-        self.outstream << '\n\\chshdng0\\chcbpat{0}\\cb{0}\\cf{1} '.format(5+colno, colno)
-
-    def char_out(self,c):
-        self.outstream << c
-
-    def string_out(self, str):
-        self.outstream << str
-
-    def newline(self):
-        self.outstream << '\n\\cb{}\\cf{} \\line'.format(9, 4)
-
-    def newpage(self):
-        self.outstream << '\\page'
-
-    def exit(self):
-        self.outstream << '\\b0}\n'
-        super().exit()
+            below = self.level(k-1)
+            h, w = below.shape[0:2]
+# a row or column left over at the edge is averaged with white
+            padded = np.full(((h+1)//2*2, (w+1)//2*2, 3), 255, dtype=np.uint16)
+            padded[0:h, 0:w] = below
+            quads = padded.reshape(padded.shape[0]//2, 2, padded.shape[1]//2, 2, 3)
+            image = ((quads.sum(axis=(1, 3))+2)//4).astype(np.uint8)
+        self.levels[k] = image
+        while len(self.levels) > 1 and sum(a.nbytes for a in self.levels.values()) > self.pyramid_bytes:
+            self.levels.popitem(last=False)
+        return image
+
+    def draw_overview(self, paint, x0, y0, x1, y1):
+# the cells in x0-x1, y0-y1, from the level of the pyramid with about a pixel on the screen to each of its
+# pixels
+        dev = self.gr_out
+        cells_per_pixel = 1/(self.scale*min(dev.dev_xsize, dev.dev_ysize))
+        k = floor(log2(cells_per_pixel)) if cells_per_pixel > 1 else 0
+        image = self.level(k)
+        xsize, ysize = dev.dev_xsize*(1 << k), dev.dev_ysize*(1 << k)
+        h, w = image.shape[0:2]
+        c0, c1 = max(floor((x0-dev.dev_minx)/xsize), 0), min(floor((x1-dev.dev_minx)/xsize)+1, w)
+        r0, r1 = max(floor((y0-dev.dev_miny)/ysize), 0), min(floor((y1-dev.dev_miny)/ysize)+1, h)
+        if c0 >= c1 or r0 >= r1:
+            return
+        pixels = image[r0:r1, c0:c1].tobytes()
+        part = QImage(pixels, c1-c0, r1-r0, 3*(c1-c0), QImage.Format_RGB888)
+        paint.drawImage(QRectF(dev.dev_minx+c0*xsize, dev.dev_miny+r0*ysize, (c1-c0)*xsize, (r1-r0)*ysize), part)
+
+    def tile(self, tx, ty):
+        key = (self.scale, tx, ty)
+        image = self.tiles.get(key)
+        if image is None:
+            image = self.tiles[key] = self.draw_tile(tx, ty)
+            if len(self.tiles) > self.cache_size:
+                self.tiles.popitem(last=False)
+        else:
+            self.tiles.move_to_end(key)
+        return image
+
+    def draw_tile(self, tx, ty):
+        size = self.tile_size
+        dev = self.gr_out
+        image = QImage(size, size, QImage.Format_RGB32)
+        image.fill(QColor(255, 255, 255))
+        x0, y0 = tx*size/self.scale, ty*size/self.scale
+        x1, y1 = (tx+1)*size/self.scale, (ty+1)*size/self.scale
+        if self.scale*min(dev.dev_xsize, dev.dev_ysize) < self.overview_below:
+            paint = QPainter(image)
+            paint.scale(self.scale, self.scale)
+            paint.translate(-x0, -y0)
+            self.draw_overview(paint, x0, y0, x1, y1)
+            paint.end()
+            return image
+# the cells that reach into the tile, and one more all round for characters that stick out of their cells
+        dev.first_col = floor((x0-dev.dev_minx)/dev.dev_xsize)-1
+        dev.last_col = floor((x1-dev.dev_minx)/dev.dev_xsize)+1
+        row0 = floor((y0-dev.dev_miny)/dev.dev_ysize)-1
+        row1 = floor((y1-dev.dev_miny)/dev.dev_ysize)+1
+        paint = QPainter(image)
+        paint.setRenderHint(QPainter.Antialiasing, True)
+        dev.paint = paint
+        dev.left, dev.top = tx*size, ty*size
+        for i in range(max(bisect_right(self.block_rows, row0)-1, 0), len(self.layout)):
+            if self.block_rows[i] > row1:
+                break
+            rows = self.line_rows(i)
+            lines = set(np.flatnonzero((rows >= row0) & (rows <= row1)).tolist())
+            if lines:
+                self.aln.block_out(dev, i, *self.layout[i], lines)
+        paint.end()
+        dev.paint = None
+        return image
+
+    def paintEvent(self, event):
+        if self.aln is None:
+            return
+        rect = event.rect()
+        size = self.tile_size
+        paint = QPainter(self)
+        for ty in range(rect.top()//size, rect.bottom()//size+1):
+            for tx in range(rect.left()//size, rect.right()//size+1):
+                paint.drawImage(tx*size, ty*size, self.tile(tx, ty))
+        paint.end()
+
+
+class MapView(QWidget):
+# A navigator beside the picture: the whole alignment at once, from Alignment.overview, turned on its side
+# so that it runs down the page as the blocks of the picture do, with a sequence to each column of
+# pixels, squeezed or stretched to fit. The part of the alignment in view is outlined. A click, or a drag,
+# gives the sequence and position under the mouse.
+    clicked = pyqtSignal(int, int)
+
+    def __init__(self, parent=None):
+        super(MapView, self).__init__(parent)
+        self.image = None
+        self.shown = None # the positions in view, first and last
+        self.setFixedWidth(120)
+        self.setCursor(Qt.PointingHandCursor)
+
+    def set_overview(self, pic):
+        self.pixels = np.ascontiguousarray(pic.transpose(1, 0, 2))
+        height, width = self.pixels.shape[0:2]
+        self.image = QImage(self.pixels.data, width, height, 3*width, QImage.Format_RGB888)
+        self.update()
+
+    def set_shown(self, first, last):
+        self.shown = (first, last)
+        self.update()
+
+    def paintEvent(self, event):
+        if self.image is None:
+            return
+        paint = QPainter(self)
+        paint.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        paint.drawImage(QRectF(self.rect()), self.image)
+        if self.shown:
+            first, last = self.shown
+            scale = self.height()/self.image.height()
+            paint.setPen(QColor(255, 0, 0))
+            paint.drawRect(QRectF(0.5, first*scale+0.5, self.width()-1, max((last-first+1)*scale, 3)-1))
+        paint.end()
+
+    def mousePressEvent(self, event):
+        self.mouse_at(event.pos())
+
+    def mouseMoveEvent(self, event):
+        self.mouse_at(event.pos())
+
+    def mouse_at(self, pos):
+        if self.image is None:
+            return
+        seq = min(max(pos.x()*self.image.width()//self.width(), 0), self.image.width()-1)
+        column = min(max(pos.y()*self.image.height()//self.height(), 0), self.image.height()-1)
+        self.clicked.emit(seq, column)
 
 
 # noinspection PyMethodMayBeStatic
@@ -154,24 +298,69 @@ class ImageDisp(QWidget):
         self.file_filter = ("PNG files (*.png);;All files (*)")
         self.setWindowFlag(Qt.Window, True)
         self.scaleFactor = 0.0
-        self.imageLabel = QLabel()
-        self.imageLabel.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
-        self.imageLabel.setScaledContents(True)
+        self.alignView = AlignView()
 
         self.scrollArea = QScrollArea()
         self.scrollArea.setBackgroundRole(QPalette.Dark)
-        self.scrollArea.setWidget(self.imageLabel)
+        self.scrollArea.setWidget(self.alignView)
         self.scrollArea.setAlignment(Qt.AlignLeft| Qt.AlignTop)
+        self.mapView = MapView()
+        self.mapView.clicked.connect(self.jump_to)
+        self.scrollArea.verticalScrollBar().valueChanged.connect(self.update_map)
         central = QVBoxLayout()
         self.tb = QToolBar()
         central.setMenuBar(self.tb)
-        central.addWidget(self.scrollArea)
+        views = QHBoxLayout()
+        views.addWidget(self.mapView)
+        views.addWidget(self.scrollArea)
+        central.addLayout(views)
         self.setLayout(central)
         self.resize(930,400)
 
         self.createActions()
         self.createToolBar()
 
+    def set_alignment(self, aln, settings):
+# the view keeps its own copy of the alignment, shaded as it is now, to draw from and to save. Only what
+# process() or the start numbers dialog change in place is copied: seqs, which may be a memory map
+# of the file, is only ever replaced, so it is shared.
+        self.aln = copy.copy(aln)
+        for name in ('cols', 'cons', 'conschar', 'level', 'startnums'):
+            setattr(self.aln, name, getattr(aln, name).copy())
+        self.aln.seqnames, self.aln.inputs = list(aln.seqnames), dict(aln.inputs)
+        self.settings = settings
+        gr_out = Viewdev(self.MW, settings)
+        self.aln.prep_out(gr_out, settings)
+        self.alignView.set_alignment(self.aln, gr_out)
+        self.mapView.set_overview(self.aln.overview(settings))
+        self.update_map()
+
+    def jump_to(self, seq, column):
+# show the block with that position at the top of the view, and the position in the middle of it across
+        view = self.alignView
+        dev = view.gr_out
+        i = column//dev.outlen
+        x = (dev.dev_minx + (view.head() + column % dev.outlen + 0.5)*dev.dev_xsize)*view.scale
+        self.scrollArea.verticalScrollBar().setValue(int((dev.dev_miny + view.block_rows[i]*dev.dev_ysize)*view.scale))
+        self.scrollArea.horizontalScrollBar().setValue(int(x - self.scrollArea.viewport().width()/2))
+
+    def update_map(self):
+# outline the blocks that can be seen in the navigator
+        view = self.alignView
+        if view.aln is None:
+            return
+        dev = view.gr_out
+        top = self.scrollArea.verticalScrollBar().value()/view.scale
+        bottom = top + self.scrollArea.viewport().height()/view.scale
+        row = lambda y: (y-dev.dev_miny)/dev.dev_ysize
+        first = max(bisect_right(view.block_rows, row(top))-1, 0)
+        last = max(bisect_right(view.block_rows, row(bottom))-1, first)
+        self.mapView.set_shown(first*dev.outlen, min((last+1)*dev.outlen, self.aln.consenslen)-1)
+
+    def resizeEvent(self, event):
+        super(ImageDisp, self).resizeEvent(event)
+        self.update_map()
+
     def closeEvent(self, event):
         self.MW.viewList.remove(self)
         event.accept()
@@ -208,13 +397,14 @@ class ImageDisp(QWidget):
 
     def scaleImage(self, factor):
         self.scaleFactor *= factor
-        self.imageLabel.resize(self.scaleFactor * self.imageLabel.pixmap().size())
+        self.alignView.set_scale(self.scaleFactor)
 
         self.adjustScrollBar(self.scrollArea.horizontalScrollBar(), factor)
         self.adjustScrollBar(self.scrollArea.verticalScrollBar(), factor)
         self.scrollArea.ensureVisible(30,30)
         self.zoomInAct.setEnabled(self.scaleFactor < 3.0)
-        self.zoomOutAct.setEnabled(self.scaleFactor > 0.333)
+        self.zoomOutAct.setEnabled(self.scaleFactor > 0.02)
+        self.update_map()
 
     def adjustScrollBar(self, scrollBar, factor):
         scrollBar.setValue(int(factor * scrollBar.value()
@@ -229,107 +419,138 @@ class ImageDisp(QWidget):
         TDialog = QFileDialog()
         fileName, _ = TDialog.getSaveFileName(None,"Save file as:", BS.lastdir, self.file_filter, options=options)
         if fileName:
-            self.file = QFile(fileName)
             BS.lastdir = QFileInfo(fileName).absolutePath()
-            if not self.file.open(QFile.WriteOnly):  # open to write
+            try:
+# the picture is drawn again, at full size, in bands that are written as they are finished
+                gr_out = Paintdev(self.MW, self.settings, fileName)
+                if not self.aln.prep_out(gr_out, self.settings):
+                    mb = QMessageBox(self)
+                    mb.setTextFormat(Qt.RichText)
+                    mb.setText("<p style='font-size: 18pt'>Picture too wide</p>"
+                               "<p style='font-size: 14pt; font-weight: normal'> The picture is too wide to be "
+                               "saved; try a shorter line length or a smaller font.</p>")
+                    mb.setIcon(QMessageBox.Warning)
+                    mb.exec()
+                    return False
+                self.aln.do_out(gr_out)
+            except OSError as e:
                 mb = QMessageBox(self)
                 mb.setTextFormat(Qt.RichText)
                 mb.setText("<p style='font-size: 18pt'>Open File error</p>"
                            "<p style='font-size: 14pt; font-weight: normal'> Can't open file <i>{}</i> for writing.<br><br>"
-                           " File error was: \"{}\".</p>".format(fileName, self.file.errorString()))
+                           " File error was: \"{}\".</p>".format(fileName, e.strerror))
                 mb.setIcon(QMessageBox.Warning)
                 mb.exec()
 
                 return False
             else:
-                self.imageLabel.pixmap().save(self.file, fmt)
                 return True
         else:
             return False
 
 
-class Paintdev(Filedev):
+class Paintdev(BS_devices.Picturedev):
 
-    def __init__(self,mw):
-        super(Paintdev, self).__init__()
+    def __init__(self, mw, settings, filename=None):
+        super(Paintdev, self).__init__(settings, filename)
         self.MW=mw
-        self.top_mar = 30.0
-        self.left_mar = 30.0
-        settings = QSettings("Boxshade", "Boxshade")
-        self.bgds = settings.value("PSbgds")
-        self.fgds = settings.value("PSfgds")
-        self.FSize = settings.value("PSFsize", type=int)
-        self.lcs = settings.value("PSLCs", type=bool)
-        self.simflag = settings.value("simflag", type=bool)
-        self.globalflag = settings.value("globalflag", type=bool)
-        self.interlines = settings.value("interlines", type=int)
-        self.outlen = settings.value("outlen", type=int)
-        self.snameflag = settings.value("snameflag", type=bool)
-        self.LHsnumsflag = settings.value("LHsnumsflag", type=bool)
-        self.RHsnumsflag = settings.value("RHsnumsflag", type=bool)
-
-        if not self.simflag:
-            self.fgds[2] = self.fgds[0]
-            self.bgds[2] = self.bgds[0]
-            self.lcs[2] = self.lcs[0]
-        if not self.globalflag:
-            self.fgds[3] = self.fgds[1]
-            self.bgds[3] = self.bgds[1]
-            self.lcs[3] = self.lcs[1]
-        self.fgds.append(QColor(0,0,0))
-        self.bgds.append(QColor(255, 255, 255))
-        self.dev_miny = self.top_mar
-        self.dev_minx = self.left_mar
-        if system() == "Darwin":
-            self.dev_xsize = self.FSize * 0.8
-            self.dev_ysize = self.FSize
-        else:
-            self.dev_xsize = self.FSize * 0.9
-            self.dev_ysize = self.FSize * 1.2
-        self.lines_per_page = 10000
+        self.bgds = [QColor(*c) for c in self.bgds]
+        self.fgds = [QColor(*c) for c in self.fgds]
 
     def graphics_init(self):
 # For this to work, I have to calculate how big a drawing I am going to make based on data passed in from calling routine
 # For this reason, I have moved gr_out.graphics_init() to the end of prep_out in the calling routine
 # as this "device" needs to know what it is drawing in order to initialise itself.
 #
-        blocks = (self.seqs.shape[1]//self.outlen)+1
-        canvas_height = int(self.top_mar+(self.dev_ysize*(blocks*(self.no_seqs+self.interlines)-self.interlines))+self.top_mar+0.5)
-        nchars = self.outlen
-        if self.snameflag:
-            nchars += 1+len(self.seqnames[0])
-        if self.LHsnumsflag:
-            nchars += 1+len(self.LHprenums[0][0])
-        if self.RHsnumsflag:
-            nchars += 1+len(self.RHprenums[0][0])
-        canvas_width = int(self.left_mar + (self.dev_xsize*(nchars))+self.left_mar+0.5)
-        self.canvas = QPixmap(canvas_width,canvas_height)
-        if self.canvas.isNull():
+        canvas_width, canvas_height = self.canvas_size()
+        if canvas_width > 32767:
             return False
-        self.canvas.fill(QColor(255,255,255))
+        self.width, self.height = canvas_width, canvas_height
+        self.nbands = (canvas_height-1)//TILE_HEIGHT+1
+        self.bands = {} # the bands being drawn: band number -> (image, painter)
+        self.done = 0 # the number of bands finished
+        self.png = BS_devices.PNGfile(self.filename, canvas_width, canvas_height)
 
         BS.monofont.setPointSize(self.FSize)
         BS.monofont.setWeight(QFont.Bold)
-        self.pen = QPen()
-        self.paint = QPainter(self.canvas)
-        self.paint.setFont(BS.monofont)
-        self.paint.setRenderHint(QPainter.Antialiasing, True)
-        self.paint.setRenderHint(QPainter.TextAntialiasing, True)
+        self.font = BS.monofont
 
         self.xpos = self.top_mar
         self.ypos = self.left_mar
         self.act_col = 4
+        self.glyphs = {}
+        self.margin = ceil(self.FSize)
         return True
 
+    def make_glyph(self, ch, c, x, y, scale=1):
+# a character drawn once, on a transparent image, just as it would be in the cell at pixel x, y of a
+# picture drawn at the given scale; there is a margin round the cell for any part of the character
+# that sticks out of it
+        m = self.margin
+        glyph = QImage(ceil(self.dev_xsize*scale)+2*m+1, ceil(self.dev_ysize*scale)+2*m+1,
+                       QImage.Format_ARGB32_Premultiplied)
+        glyph.fill(Qt.transparent)
+        paint = QPainter(glyph)
+        paint.setFont(self.font)
+        paint.setRenderHint(QPainter.Antialiasing, True)
+        paint.setRenderHint(QPainter.TextAntialiasing, True)
+        paint.translate(m-floor(x), m-floor(y))
+        paint.scale(scale, scale)
+        paint.setPen(self.fgds[c])
+        paint.drawText(QRectF(x/scale, y/scale, self.dev_xsize, self.dev_ysize), Qt.AlignCenter, ch)
+        paint.end()
+        return glyph
+
+    def band(self, b):
+# the painter of band b, started when it is first drawn on
+        if b not in self.bands:
+            image = QImage(self.width, min(TILE_HEIGHT, self.height-b*TILE_HEIGHT), QImage.Format_RGB32)
+            image.fill(QColor(255, 255, 255))
+            paint = QPainter(image)
+            paint.setRenderHint(QPainter.Antialiasing, True)
+            self.bands[b] = (image, paint)
+        return self.bands[b][1]
+
+    def finish_bands(self, b):
+# pass on the bands above band b, which will not be drawn on again, in order
+        for i in range(self.done, min(b, self.nbands)):
+            self.band(i)
+            image, paint = self.bands.pop(i)
+            paint.end()
+            png_rows(self.png, image)
+        self.done = max(self.done, min(b, self.nbands))
+
+    def glyph_out(self, ch, c):
+# the background is filled as before, but the text is copied from a cache of each character, colour
+# and offset within a pixel, which saves laying out and drawing the text for every cell. A cell near the
+# edge of a band, with its margin, is drawn on both bands.
+        ix, iy = floor(self.xpos), floor(self.ypos)
+        key = (ch, c, round(self.xpos-ix, 6), round(self.ypos-iy, 6))
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            glyph = self.glyphs[key] = self.make_glyph(ch, c, self.xpos, self.ypos)
+        first = max((iy-self.margin)//TILE_HEIGHT, 0)
+        last = min((iy+glyph.height()-self.margin)//TILE_HEIGHT, self.nbands-1)
+        for b in range(first, last+1):
+            top = b*TILE_HEIGHT
+            paint = self.band(b)
+            paint.fillRect(QRectF(self.xpos, self.ypos-top, self.dev_xsize, self.dev_ysize), self.bgds[c])
+            paint.drawImage(QPoint(ix-self.margin, iy-self.margin-top), glyph)
+# the positions are kept rounded: Qt can round the text either way when the error that builds up
+# in a sum lands it on a pixel boundary, and then a cell would not match its cached character
+        self.xpos = round(self.xpos+self.dev_xsize, 6)
+
     def set_colour(self, c):
         self.act_col = c
 
     def char_out(self, ch):
-        myrect=QRectF(self.xpos,self.ypos, self.dev_xsize, self.dev_ysize)
-        self.paint.fillRect(myrect,self.bgds[self.act_col])
-        self.paint.setPen(self.fgds[self.act_col])
-        self.paint.drawText(myrect, Qt.AlignCenter, ch)
-        self.xpos += self.dev_xsize
+        self.glyph_out(ch, self.act_col)
+
+    def runs_out(self, runs):
+        for c, text in runs:
+            self.act_col = c
+            for ch in text:
+                self.glyph_out(ch, c)
 
     def string_out(self, str):
         for i in range(len(str)):
@@ -337,277 +558,85 @@ class Paintdev(Filedev):
 
     def newline(self):
         self.xpos = self.dev_minx
-        self.ypos += self.dev_ysize
+        self.ypos = round(self.ypos+self.dev_ysize, 6)
+        self.finish_bands((floor(self.ypos)-self.margin)//TILE_HEIGHT)
 
     def newpage(self):
         pass
 
     def exit(self):
-        self.paint.end()
-
-
-class PSdev(Filedev):
-    pscc = ['C0', 'C1', 'C2', 'C3', 'C4']
-    ctypes = ['% -- different residues\n', "% -- identical residues\n", "% -- similar residues\n", "% -- conserved residues\n", "% -- normal text\n"]
-    def __init__(self, fname):
-        super(PSdev, self).__init__()
-        self.file_filter = ("PS files (*.ps);;All files (*)")
-        self.Alignment = fname
-        settings = QSettings("Boxshade", "Boxshade")
-        self.bgds = settings.value("PSbgds")
-        self.fgds = settings.value("PSfgds")
-        self.FSize = settings.value("PSFsize", type=int)
-        self.lcs = settings.value("PSLCs", type=bool)
-        simflag = settings.value("simflag", type=bool)
-        globalflag = settings.value("globalflag", type=bool)
-        self.landscapeflag = settings.value("PSlandscapeflag", type=bool)
-        self.outlen = settings.value("outlen", type=int)
-        self.snameflag = settings.value("snameflag", type=bool)
-        self.LHsnumsflag = settings.value("LHsnumsflag", type=bool)
-        self.RHsnumsflag = settings.value("RHsnumsflag", type=bool)
-
-        if not simflag:
-            self.fgds[2] = self.fgds[0]
-            self.bgds[2] = self.bgds[0]
-            self.lcs[2] = self.lcs[0]
-        if not globalflag:
-            self.fgds[3] = self.fgds[1]
-            self.bgds[3] = self.bgds[1]
-            self.lcs[3] = self.lcs[1]
-        self.dev_minx = 30.0
-        self.dev_miny = 30.0
-        if self.landscapeflag:
-            self.dev_maxx = 800.0
-            self.dev_maxy = 545.0
-        else:
-            self.dev_maxx = 575.0
-            self.dev_maxy = 760.0
-        self.dev_xsize = self.FSize * 0.7
-        self.dev_ysize = self.FSize
-        self.xpos = self.dev_minx
-        self.ypos = self.dev_maxy - self.dev_ysize
-        self.lines_per_page = int((self.dev_maxy - self.dev_miny) / self.dev_ysize)
-
-    def PSrgb(self, col):
-        col = [x/255 for x in self.rgb(col)]
-        return col
-
-    def PageSetup(self, pn):
-        self.outstream << "\n%%Page: {} {}\n%%BeginPageSetup\npsetup\n%%EndPageSetup\n".format(pn, pn)
-
-    def psfp(self, num, dp):
-        s = '{:.{}f}'.format(num,dp)
-        s = s.rstrip('0').rstrip('.') if '.' in s else s
-        self.outstream << s
-        self.outstream << ' '
-        self.count += len(s)+1
-
-    def close_sb(self):
-        if self.save_sb != []:
-            sl = len(self.save_sb)
-            if (self.count+sl) > 200:
-                self.outstream << "\n"
-                self.count = 0
-            xsl = 'S' if sl > 1 else 'C'
-            self.outstream << "({}){} ".format(''.join(self.save_sb), xsl)
-            self.count += 4+len(self.save_sb)
-            self.save_sb = []
-
-    def add_sb(self, ch):
-        self.save_sb.append(ch)
-        sl = len(self.save_sb)
-        if (self.count+sl) > 200:
-            xsl = 'S' if sl > 1 else 'C'
-            self.outstream << "({}){} ".format(''.join(self.save_sb), xsl)
-            self.outstream << "\n"
-            self.count = 0
-            self.save_sb = []
+        self.finish_bands(self.nbands)
+        self.png.close()
 
-    def graphics_init(self):
-        nchars = self.outlen
-        if self.snameflag:
-            nchars += 1 + len(self.seqnames[0])
-        if self.LHsnumsflag:
-            nchars += 1 + len(self.LHprenums[0][0])
-        if self.RHsnumsflag:
-            nchars += 1 + len(self.RHprenums[0][0])
-        line_length = self.dev_xsize * nchars
-        if line_length > (self.dev_maxx-self.dev_minx):
-            mb = QMessageBox()
-            mb.setTextFormat(Qt.RichText)
-            mb.setText("<p style='font-size: 18pt'>Picture too wide for page!</p>"
-                       "<p style='font-size: 14pt; font-weight: normal'> Be aware, at your current settings, the PostScript image "
-                       "will be wider than the page and will be clipped.<br>"
-                       "The page width is {:n} pixels and your output would have a width of {:n} pixels.<br><br>"
-                       "Do you want to continue?</p>".format((self.dev_maxx-self.dev_minx), line_length))
-            mb.setIcon(QMessageBox.Information)
-            mb.setStandardButtons(QMessageBox.Yes|QMessageBox.No)
-            mb.setDefaultButton(QMessageBox.No)
-            ret = mb.exec()
-            if ret == QMessageBox.No:
-                return False
 
-        if self.open_output_file():
-            self.outstream << "%!PS-Adobe-2.0\n"
-            self.outstream << "%%Creator: PyBoxshade\n"
-            self.outstream << "%%Title: BOXSHADE document from: {} \n".format(self.Alignment)
-            d = datetime.datetime.now()
-            self.outstream << "%%CreationDate: {:%H:%M:%S %B %d, %Y}\n".format(d)
-            self.outstream << "%%Pages: (atend)\n"
-            if self.landscapeflag:
-                self.outstream << "%%BoundingBox: {:.0f} {:.0f} {:.0f} {:.0f}\n".format(self.dev_miny-1,self.dev_minx-1,self.dev_maxy+1,self.dev_maxx+1)
-                self.outstream << "%%Orientation: landscape\n"
-            else:
-                self.outstream << "%%BoundingBox: {:.0f} {:.0f} {:.0f} {:.0f}\n".format(self.dev_minx-1,self.dev_miny-1,self.dev_maxx+1,self.dev_maxy+1)
-                self.outstream << "%%Orientation: portrait\n"
-
-            self.outstream << "%%PaperSize: a4\n%%DocumentNeededFonts: Courier-Bold\n%%DocumentData: Clean7Bit\n"
-            self.outstream << "%%LanguageLevel: 1\n%%EndComments\n%%BeginProlog\n"
-            self.outstream << "/bd { bind def } bind def /xd { exch def } bd\n"
-            self.outstream << "%\n% custom color selection\n%\n% grayscale:\n%\n% '<gray> setgray'\n%\n"
-            self.outstream << "% where<gray> is a real number between\n%  0.0 (black) and 1.0 (white)\n%\n"
-            self.outstream << "% RGB (red/green/blue) colors:\n%\n%  '<r> <g> <b> setrgbcolor'\n%\n% each color component is a real'\n"
-            self.outstream << "% number between 0.0 (zero intensity) and\n%  1.0 (max intensity)\n%\n% Change the following definitions for your needs!\n%\n"
-            for i in range(4):
-                self.outstream << self.ctypes[i]
-                self.outstream << "/bg{} {{ {:.2f} {:.2f} {:.2f} setrgbcolor }} bd % background\n".format(str(i), *self.PSrgb(self.bgds[i]))
-                self.outstream << "/fg{} {{ {:.2f} {:.2f} {:.2f} setrgbcolor }} bd % foreground\n".format(str(i), *self.PSrgb(self.fgds[i]))
-            self.outstream << self.ctypes[4]
-            self.outstream << "/bg4 { 1 setgray } bd % background\n"
-            self.outstream << "/fg4 { 0 setgray } bd % foreground\n"
-
-            self.outstream << "%\n% end of custom color selection\n%\n"
-            self.outstream << "/px 0 def /py 0 def /fg {0 setgray} bd /bg {1 setgray} bd "
-            self.outstream << "/C {{px py moveto gsave {:.1f} {:.1f} rmoveto {:.1f} 0 rlineto 0 {:.1f} rlineto {:.1f} 0 rlineto closepath ".format(-0.03*self.FSize, \
-                                                                                                     -0.05*self.FSize, 0.70*self.FSize, self.FSize, -0.70*self.FSize)
-            self.outstream << "bg fill grestore fg 0 2 rmoveto show /px px {:.2f} add def}} bd\n".format(self.dev_xsize)
-            self.outstream << "/X {/px xd} bd /Y {/py xd} bd /A {Y X} bd /S {0 1 2 index length 1 sub {2 copy 1 getinterval C pop} for pop} bd\n"
-            d = " 575 0 translate 90 rotate" if self.landscapeflag else ""
-            self.outstream << "/psetup {{/Courier-Bold findfont {} scalefont setfont 120 currentscreen 3 -1 roll pop setscreen {}}} bd\n".format(self.FSize, d)
-            for i in range(5):
-                self.outstream << "/{} {{/bg {{bg{}}} bd /fg {{fg{}}} bd}} bd ".format(self.pscc[i], (i), str(i))
-            self.outstream << "\n%%EndProlog\n%%%BeginSetup\nsave initgraphics"
-            self.outstream << "\n%%EndSetup"
-            self.act_page = 1
-            self.PageSetup(self.act_page)
-            self.last_pscl = ''
-            self.act_col = 4
-            self.new_x, self.new_y  = True, True
-            self.count = 0
-            self.save_sb = []
-            return True
-        else:
-            return False
-
-    def set_colour(self, c):
-        self.act_col = c
-
-    def char_out(self, ch):
-        if self.pscc[self.act_col] != self.last_pscl:
-            self.close_sb()
-            self.last_pscl = self.pscc[self.act_col]
-            self.outstream << self.last_pscl+" "
-            self.count += len(self.last_pscl+" ")
-        if self.new_x and self.new_y:
-            self.close_sb()
-            self.psfp(self.xpos, 1)
-            self.psfp(self.ypos, 1)
-            self.outstream << "A "
-            self.count += 2
-            self.new_x, self.new_y = False, False
-        elif self.new_y:
-            self.close_sb()
-            self.psfp(self.ypos, 1)
-            self.outstream << "Y "
-            self.count += 2
-            self.new_y = False
-        elif self.new_x:
-            self.close_sb()
-            self.psfp(self.xpos, 1)
-            self.outstream << "X "
-            self.count += 2
-            self.new_x = False
-        self.add_sb(ch)
-        self.xpos +=self.dev_xsize
-
-    def string_out(self,str):
-        for i in range(len(str)):
-            self.char_out(str[i])
-
-    def newline(self):
-        self.close_sb()
-        self.xpos = self.dev_minx
-        self.ypos -= self.dev_ysize
-        self.new_x, self.new_y = True, True
-
-    def newpage(self):
-        self.close_sb()
-        self.xpos = self.dev_minx
-        self.outstream << "showpage erasepage "
-        self.count += len("showpage erasepage ")
-        self.act_page += 1
-        self.PageSetup(self.act_page)
-        self.ypos = self.dev_maxy - self.dev_ysize
-        self.new_x, self.new_y = True, True
-        self.last_pscl = ' '
-
-    def exit(self):
-        self.close_sb()
-        self.outstream << "showpage erasepage\n%%Trailer\nrestore\n"
-        self.outstream << "%%Pages: {}\n".format(self.act_page)
-        self.outstream << "%%EOF\n"
-        super().exit()
-
-class ASCIIdev(Filedev):
-
-    def __init__(self, fname):
-        super(ASCIIdev, self).__init__()
-        self.file_filter = ("Text files (*.txt);;All files (*)")
-        self.Alignment = fname
-        settings = QSettings("Boxshade", "Boxshade")
-        self.Achars = settings.value("ASCIIchars")
-        self.Achars.append('L')
-        simflag = settings.value("simflag", type=bool)
-        globalflag = settings.value("globalflag", type=bool)
-        if not simflag:
-            self.Achars[2] = self.Achars[0]
-        if not globalflag:
-            self.Achars[3] = self.Achars[1]
-        self.lcs = [(x.isalpha()) and (x == x.lower()) for x in self.Achars]
-        self.lines_per_page = 9999
+class Viewdev(Paintdev):
+# The alignment as AlignView shows it. Nothing is drawn until the view asks for a tile; then the view
+# sets the painter, the pixel of the picture at the tile's corner and the columns of cells that reach
+# into the tile, and has the lines that cross it drawn, with block_start giving the row each block
+# starts on. Cells outside the columns are skipped. The characters come from a cache like Paintdev's,
+# made at the scale of the view; the offset within a pixel is kept to a sixteenth of a pixel so that
+# the cache stays small whatever the scale.
 
     def graphics_init(self):
-        if self.open_output_file():
-            self.current_char = ''
-            self.outstream << "Alignment file: {}\n".format(self.Alignment)
-            d = datetime.datetime.now()
-            self.outstream << "Created by Boxshade: {:%H:%M:%S %B %d, %Y}\n\n".format(d)
-            return True
-        else:
-            return False
+        self.width, self.height = self.canvas_size()
+        self.font = QFont(BS.monofont)
+        self.font.setPointSize(self.FSize)
+        self.font.setWeight(QFont.Bold)
+        self.paint = None
+        self.act_col = 4
+        self.row = self.col = 0
+        self.first_col, self.last_col = 0, -1
+        self.left = self.top = 0
+        self.set_scale(1.0)
+        return True
 
-    def set_colour(self, c):
-        self.current_char = self.Achars[c]
+    def set_scale(self, scale):
+# the characters are drawn again for a new scale
+        self.scale = scale
+        self.margin = ceil(self.FSize*scale)
+        self.glyphs = {}
+
+    def glyph_at(self, ch, c, x, y):
+        x, y = round(x*16)/16, round(y*16)/16
+        ix, iy = floor(x), floor(y)
+        key = (ch, c, x-ix, y-iy)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            glyph = self.glyphs[key] = self.make_glyph(ch, c, x-ix, y-iy, self.scale)
+        self.paint.drawImage(QPoint(ix-self.margin, iy-self.margin), glyph)
+
+    def block_start(self, block, pos):
+        self.row = pos.newlines
+        self.col = 0
+
+    def cells_out(self, c, text):
+        first = max(self.col, self.first_col)
+        last = min(self.col+len(text)-1, self.last_col)
+        if first <= last:
+            s = self.scale
+            x = (self.dev_minx+first*self.dev_xsize)*s-self.left
+            y = (self.dev_miny+self.row*self.dev_ysize)*s-self.top
+            self.paint.fillRect(QRectF(x, y, (last-first+1)*self.dev_xsize*s, self.dev_ysize*s), self.bgds[c])
+            for k in range(first, last+1):
+                ch = text[k-self.col]
+                if ch != ' ':
+                    self.glyph_at(ch, c, x+(k-first)*self.dev_xsize*s, y)
+        self.col += len(text)
 
     def char_out(self, ch):
-        if self.current_char.upper() == 'L':
-            self.outstream << ch
-        else:
-            self.outstream << self.current_char
+        self.cells_out(self.act_col, ch)
+
+    def runs_out(self, runs):
+        for c, text in runs:
+            self.act_col = c
+            self.cells_out(c, text)
 
     def string_out(self, str):
-        self.outstream << str
+        self.cells_out(self.act_col, str)
 
     def newline(self):
-        self.outstream << '\n'
-
-    def newpage(self):
-        pass
+        self.row += 1
+        self.col = 0
 
     def exit(self):
-        self.outstream << '\n'
-        super().exit()
-
-
-
-
+        pass
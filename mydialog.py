@@ -55,7 +55,6 @@ class prefsDialog(QDialog):
         self.GenTab.simflagbox.toggle()
         self.GenTab.grpflagbox.toggle()
         self.GenTab.grpflagbox.toggle()
-        self.proc_flag=False
 
         buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttonBox.accepted.connect(self.exit)
@@ -74,8 +73,6 @@ class prefsDialog(QDialog):
             self.PSTab.exit()
             self.SimTab.exit()
             self.GrpTab.exit()
-            if self.GenTab.proc_flag or self.SimTab.proc_flag or self.GrpTab.proc_flag:
-                self.proc_flag = True
             self.accept()
 
     def changeStyle(self, styleName):
@@ -93,7 +90,6 @@ class GeneralTab(QWidget):
         self.consensnum = c
         if c > self.no_seqs:
             self.consensnum = 0
-        self.proc_flag = False # flag to indicate that need to remake consensus and colours
 
         self.settings = QSettings("Boxshade", "Boxshade")
         self.scflag = self.settings.value("scflag", type=bool)
@@ -317,12 +313,6 @@ class GeneralTab(QWidget):
                 ret_code = mb.exec()
                 if ret_code == QMessageBox.No:
                     return False
-        if (self.scflag != self.scbox.isChecked() or self.pepseqsflag != self.ProtRB.isChecked()
-            or self.consflag != self.conslinebox.isChecked() or self.countGaps != self.countgapsbox.isChecked() or
-            (self.conslinebox.isChecked() and self.symbcons != self.consbox.text()) or
-                (self.scbox.isChecked() and self.consensnum != 1+self.consnum.currentIndex()) or
-                (self.thrfrac != self.thrbox.value())):
-            self.proc_flag =True
         self.settings.setValue("scflag", self.scbox.isChecked())
         self.settings.setValue("consflag", self.conslinebox.isChecked())
         self.settings.setValue("symbcons", self.consbox.text())
@@ -629,7 +619,6 @@ class simsTab(QWidget):
     
     def __init__(self, parent=None):
         super(simsTab, self).__init__(parent)
-        self.proc_flag=False
         self.settings = QSettings("Boxshade", "Boxshade")
         self.simsline = self.settings.value("simsline")
         self.simsline = self.simsline.split(":")
@@ -703,7 +692,6 @@ class simsTab(QWidget):
                 simsline.append(aaset[i] + ' ' + b)
         simsline = 'SIMS:'+ ':'.join(simsline)+':END'
         if simsline != self.settings.value("simsline"):
-            self.proc_flag=True
             self.settings.setValue("simsline", simsline)
         DNAline = []
         for i in range(len(naset)):
@@ -712,14 +700,12 @@ class simsTab(QWidget):
                 DNAline.append(naset[i] + ' ' + b)
         DNAline = 'SIMS:' + ':'.join(DNAline) + ':END'
         if DNAline != self.settings.value("DNAsimsline"):
-            self.proc_flag=True
             self.settings.setValue("DNAsimsline", DNAline)
 
 
 class grpsTab(QWidget):
     def __init__(self, parent=None):
         super(grpsTab, self).__init__(parent)
-        self.proc_flag=False
         self.settings = QSettings("Boxshade", "Boxshade")
         self.grpsline = self.settings.value("grpsline")
         self.grpsline = self.grpsline.split(":")
@@ -783,7 +769,6 @@ class grpsTab(QWidget):
                 grpsline.append(b)
         grpsline = 'GRPS:'+ ':'.join(grpsline)+':END'
         if grpsline != self.settings.value('grpsline'):
-            self.proc_flag=True
             self.settings.setValue("grpsline", grpsline)
         grpsline = []
         for i in range(self.no_lines):
@@ -792,7 +777,6 @@ class grpsTab(QWidget):
                 grpsline.append(b)
         grpsline = 'GRPS:' + ':'.join(grpsline) + ':END'
         if grpsline != self.settings.value('DNAgrpsline'):
-            self.proc_flag = True
             self.settings.setValue("DNAgrpsline", grpsline)
 
 if __name__ == '__main__':
@@ -0,0 +1,87 @@
+# The command line renderer: every file is tried, failures are reported and set the exit status.
+import gzip
+import json
+
+import pytest
+
+import BS_batch
+
+FASTA = ">one\nAAAILD\n>two\nAAAVLE\n>three\nAKWLIE\n>four\nACKIV-\n"
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    (tmp_path / "a.fas").write_text(FASTA)
+    (tmp_path / "b.fas").write_text(FASTA.replace("one", "uno"))
+    (tmp_path / "bad.fas").write_text("not an alignment\n")
+    return tmp_path
+
+
+def test_pool_with_failure(inputs, capsys):
+    out = inputs / "out"
+    rc = BS_batch.main(["-f", "ps", "-j", "2", "-o", str(out), str(inputs / "*.fas"), str(inputs / "missing.fas")])
+    assert rc == 1
+    assert sorted(p.name for p in out.iterdir()) == ["a.ps", "b.ps"]
+    assert (out / "a.ps").read_text().startswith("%!PS-Adobe-2.0")
+    captured = capsys.readouterr()
+    assert "2 file(s) shaded, 2 failed" in captured.out
+    assert "bad.fas" in captured.err and "missing.fas" in captured.err
+
+
+def test_settings_file_and_flags(inputs):
+    settings = inputs / "settings.json"
+    settings.write_text(json.dumps({"scflag": True, "outlen": 4, "ASCIIchars": ["L", "=", "l", "*"]}))
+    rc = BS_batch.main(["-f", "txt", "-j", "1", "-s", str(settings), "--consensnum", "2", "--no-snameflag",
+                        str(inputs / "a.fas")])
+    assert rc == 0
+    lines = (inputs / "a.txt").read_text().split('\n')
+    assert lines[3:7] == ["*AAI", "AAAV", "*KWL", "*CKI"]
+
+
+def test_text_needs_scflag(inputs):
+    assert BS_batch.main(["-f", "txt", "-j", "1", str(inputs / "a.fas")]) == 1
+
+
+def test_bad_settings(inputs):
+    settings = inputs / "settings.json"
+    settings.write_text(json.dumps({"nosuchkey": 1}))
+    with pytest.raises(SystemExit):
+        BS_batch.main(["-s", str(settings), str(inputs / "a.fas")])
+
+
+def test_parse_value():
+    assert BS_batch.parse_value("PSbgds", "#ffffff,#000000,#b4b4b4,#000000")[2] == (180, 180, 180)
+    assert BS_batch.parse_value("PSLCs", "true,false,1,0") == [True, False, True, False]
+    assert BS_batch.parse_value("thrfrac", "0.5") == 0.5
+    assert BS_batch.parse_value("outlen", "50") == 50
+
+
+def test_png_renderers(inputs):
+    out = inputs / "out"
+    assert BS_batch.main(["-f", "png", "-j", "1", "--renderer", "numpy", "-o", str(out), str(inputs / "a.fas")]) == 0
+    assert (out / "a.png").read_bytes().startswith(b'\x89PNG')
+
+
+def test_compressed_output(inputs):
+    out = inputs / "out"
+    assert BS_batch.main(["-f", "ps", "-j", "1", "--compress", "gz", "-o", str(out), str(inputs / "a.fas")]) == 0
+    assert gzip.decompress((out / "a.ps.gz").read_bytes()).startswith(b"%!PS-Adobe-2.0")
+    with pytest.raises(SystemExit):
+        BS_batch.main(["-f", "png", "--compress", "gz", str(inputs / "a.fas")])
+
+
+def test_shared_stems(inputs, capsys):
+    for family in ("f1", "f2"):
+        (inputs / family).mkdir()
+        (inputs / family / "aln.fas").write_text(FASTA)
+    out = inputs / "out"
+    assert BS_batch.main(["-f", "ps", "-j", "2", "-o", str(out), str(inputs / "f*" / "aln.fas")]) == 0
+    assert sorted(str(p.relative_to(out)) for p in out.rglob("*.ps")) == ["f1/aln.ps", "f2/aln.ps"]
+# without an output directory, inputs side by side keep their extensions
+    (inputs / "f1" / "aln.aln").write_text(FASTA.replace("one", "uno"))
+    assert BS_batch.main(["-f", "ps", "-j", "1", str(inputs / "f1" / "aln.*")]) == 0
+    assert (inputs / "f1" / "aln.aln.ps").exists() and (inputs / "f1" / "aln.fas.ps").exists()
+# the same file given twice is written once, and the second is a failure
+    capsys.readouterr()
+    assert BS_batch.main(["-f", "ps", "-j", "1", "-o", str(out), str(inputs / "a.fas"), str(inputs / "a.fas")]) == 1
+    assert "1 file(s) shaded, 1 failed" in capsys.readouterr().out
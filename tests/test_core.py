@@ -0,0 +1,403 @@
+# The core library must shade and lay out an alignment without Qt.
+import gzip
+import io
+import lzma
+import os
+import re
+import struct
+import subprocess
+import sys
+import zlib
+from xml.dom import minidom
+
+import numpy as np
+import pytest
+
+import BS_core
+from BS_devices import ASCIIdev, Filedev, HTMLdev, PDFdev, PNGdev, PNGfile, PSdev, RTFdev, SVGdev
+
+FASTA = ">one\nAAAILD\n>two\nAAAVLE\n>three\nAKWLIE\n>four\nACKIV-\n"
+
+
+@pytest.fixture
+def fasta(tmp_path):
+    path = tmp_path / "aln.fas"
+    path.write_text(FASTA)
+    return path
+
+
+def shaded(path, *args, **kwargs):
+# the alignment in path, read and processed with Settings(*args, **kwargs); returns it and the settings
+    settings = BS_core.Settings(*args, **kwargs)
+    aln = BS_core.Alignment()
+    aln.read(str(path))
+    aln.process(settings)
+    return aln, settings
+
+
+def written(aln, settings, device, target, name="aln.fas", jobs=1, **attrs):
+# a new device, with attrs set on it, that aln has been laid out on and written to target with
+    gr_out = device(name, settings, target)
+    for key, value in attrs.items():
+        setattr(gr_out, key, value)
+    assert aln.prep_out(gr_out, settings)
+    aln.do_out(gr_out, jobs)
+    return gr_out
+
+
+def test_no_qt_import():
+    code = "import sys, BS_core, BS_devices; assert not any(m.startswith('PyQt5') for m in sys.modules)"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.abspath(BS_core.__file__)))
+
+
+def test_read_and_process(fasta):
+    aln = BS_core.Alignment()
+    aln.read(str(fasta))
+    assert aln.seqnames == ['one', 'two', 'three', 'four']
+    assert aln.no_seqs == 4 and aln.consenslen == 6
+    assert list(aln.seqlens) == [6, 6, 6, 5]
+    aln.process(BS_core.Settings())
+    assert bytes(aln.cons[0:6]) == b'A  ile'
+    assert list(aln.cols[:, 0]) == [3, 3, 3, 3]
+    assert list(aln.cols[:, 5]) == [2, 2, 2, 0]
+
+
+def test_unknown_format(tmp_path):
+    path = tmp_path / "aln.txt"
+    path.write_text("not an alignment\n")
+    with pytest.raises(BS_core.UnknownFormatError):
+        BS_core.Alignment().read(str(path))
+
+
+def test_ascii_output(fasta, tmp_path):
+    out = tmp_path / "aln.txt"
+    written(*shaded(fasta, scflag=True, outlen=4), ASCIIdev, out)
+    lines = out.read_text().split('\n')
+    assert lines[0] == "Alignment file: aln.fas"
+    assert lines[3:13] == ["one   AAAI", "two   *AAV", "three *KWl", "four  *CK.", "",
+                           "one   LD", "two   .e", "three ie", "four  V-", ""]
+
+
+def test_rtf_output(fasta, tmp_path):
+    out = tmp_path / "aln.rtf"
+    written(*shaded(fasta), RTFdev, out)
+    text = out.read_text()
+    assert text.startswith('{\\rtf1') and text.endswith('\\b0}\n')
+    assert '\\red180\\green180\\blue180;' in text
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_rtf_colour_changes(fasta, tmp_path, compact):
+    out = tmp_path / "aln.rtf"
+    written(*shaded(fasta, RTFcompact=compact, snameflag=False), RTFdev, out)
+    lines = out.read_text().split('\\line\n')
+# colour words only where the class changes, and in the compact file only for the colour that changes
+    if compact:
+        assert lines[0].endswith('\\b\n\\cf1\\chcbpat0\\cb0 A\\cf0\\chcbpat1\\cb1 AA\\chcbpat2\\cb2 ILD\\chcbpat1\\cb1 ')
+        assert '\\red0\\green0\\blue0;\\red255\\green255\\blue255;\\red180\\green180\\blue180;}' in out.read_text()
+    else:
+        assert lines[0].count('\\chshdng0') == 3
+
+
+def test_ps_output(fasta, tmp_path):
+    out = tmp_path / "aln.ps"
+    written(*shaded(fasta), PSdev, out)
+    text = out.read_text()
+# one string, drawn on one background rectangle, for each run of a colour
+    assert "C4 30 748 A (one   )S C3 (A)C C0 (AA)S C2 (ILD)S C4 30 736 A (two   )S" in text
+    assert text.endswith("%%Pages: 1\n%%EOF\n")
+
+
+def test_pdf_output(fasta, tmp_path):
+    out = tmp_path / "aln.pdf"
+    written(*shaded(fasta, outlen=3), PDFdev, out, lines_per_page=5)
+    data = out.read_bytes()
+    assert data.startswith(b"%PDF-1.4") and data.endswith(b"%%EOF\n")
+# every object is where the xref table says it is
+    xref = int(data.split(b"startxref\n")[1].split()[0])
+    table = data[xref:].split(b"\n")
+    size = int(table[1].split()[1])
+    for i in range(1, size):
+        assert data[int(table[2+i][0:10]):].startswith(b"%d 0 obj" % i)
+    assert b"/Count 2" in data
+    pages = [zlib.decompress(m) for m in re.findall(rb"stream\n(.*?)\nendstream", data, re.S)]
+    assert len(pages) == 2
+# one background rectangle and one string for each run of a colour
+    assert b"BT 30 750 Td (one   )Tj ET\n0 0 0 rg 80.04 747.4 8.4 12 re f 1 1 1 rg BT 80.4 750 Td (A)Tj ET\n" in pages[0]
+
+
+def test_svg_output(fasta, tmp_path):
+    out = tmp_path / "aln.svg"
+    gr_out = written(*shaded(fasta, outlen=4, PSFsize=10), SVGdev, out, name="<aln>.fas")
+    svg = minidom.parse(str(out)).documentElement
+    assert (int(svg.getAttribute("width")), int(svg.getAttribute("height"))) == gr_out.canvas_size()
+    texts = [(t.getAttribute("class"), t.firstChild.data) for t in svg.getElementsByTagName("text")]
+# text runs are split where the foreground colour changes, and names run on into residues of the same colour
+    assert texts[0:3] == [("f0", "one"), ("f1", "A"), ("f0", "AAI")]
+    assert texts[-1] == ("f0", "four  V-")
+# classes with the same colour share a CSS class, so their runs join up; white backgrounds need no rectangle
+    assert gr_out.bgnames == ["b0", "b1", "b2", "b1", "b0"] and gr_out.fgnames == ["f0", "f1", "f0", "f1", "f0"]
+    rects = [r.getAttribute("class") for r in svg.getElementsByTagName("rect")]
+    assert rects[1:3] == ["b1", "b2"] and "b0" not in rects
+
+
+@pytest.mark.parametrize("fragments", [False, True])
+def test_html_output(fasta, tmp_path, fragments):
+    out = tmp_path / "aln.html"
+    written(*shaded(fasta, outlen=4, LHsnumsflag=True, HTMLfragments=fragments), HTMLdev, out)
+    text = out.read_text()
+    assert ".c0 {color: #ffffff; background: #000000}" in text and text.endswith("</html>\n")
+# a span for each run of a colour, none for black on white
+    first = 'one   1 <span class="c0">A</span>AA<span class="c1">I</span>\n'
+    second = 'two   5 <span class="c1">LE</span>\n'
+    if fragments:
+        assert '<pre data-src="aln.1.html"></pre>\n<pre data-src="aln.2.html"></pre>\n<script>' in text
+        assert (tmp_path / "aln.1.html").read_text().startswith(first)
+        assert second in (tmp_path / "aln.2.html").read_text()
+        assert not (tmp_path / "aln.3.html").exists()
+    else:
+        assert "<pre>"+first in text and second in text
+
+
+@pytest.mark.parametrize("device", [PSdev, RTFdev, ASCIIdev, SVGdev, PNGdev])
+def test_parallel_blocks(fasta, tmp_path, device):
+    aln, settings = shaded(fasta, outlen=2, scflag=True, rulerflag=True, LHsnumsflag=True, RTFcompact=True)
+    outputs = []
+    for jobs in (1, 2):
+        out = tmp_path / "aln{}".format(jobs)
+# short pages, so that some blocks start on a new page and some in the middle of one
+        written(aln, settings, device, out, jobs=jobs, lines_per_page=8)
+        outputs.append(out.read_bytes())
+    assert outputs[0] == outputs[1]
+
+
+def test_overview(fasta):
+    aln, settings = shaded(fasta, simflag=False)
+    pic = aln.overview(settings)
+    assert pic.shape == (4, 6, 3) and pic.dtype == np.uint8
+    bgds = settings["PSbgds"]
+    assert [tuple(p) for p in pic[:, 0]] == [bgds[3]]*4
+# without simflag, similar residues are shown as different ones; the gap is white
+    assert [tuple(p) for p in pic[:, 5]] == [bgds[0]]*3 + [(255, 255, 255)]
+    settings = BS_core.Settings({"scflag": True})
+    aln.consensnum = 2
+    aln.process(settings)
+    assert (aln.overview(settings)[1] == 255).all()
+
+
+def test_prep_out_shares_matrices(fasta, tmp_path):
+# with no lines added the device uses the alignment's matrices, and copies any it changes
+    aln, settings = shaded(fasta, PSLCs=[False]*4)
+    gr_out = PSdev("aln.fas", settings, str(tmp_path / "aln.ps"))
+    assert aln.prep_out(gr_out, settings)
+    assert gr_out.seqs is aln.seqs and gr_out.cols is aln.cols
+    seqs = aln.seqs.copy()
+    settings = BS_core.Settings({"PSLCs": [True]*4, "scflag": True})
+    aln.consensnum = 2
+    aln.process(settings)
+    cols = aln.cols.copy()
+    gr_out = PSdev("aln.fas", settings, str(tmp_path / "aln.ps"))
+    assert aln.prep_out(gr_out, settings)
+    assert gr_out.cols.dtype == np.uint8
+    assert (gr_out.cols[1] == 4).all() and (aln.cols == cols).all()
+    assert bytes(gr_out.seqs[0]) == b"aaaild" and (aln.seqs == seqs).all()
+
+
+def test_block_out_lines(fasta, tmp_path):
+# the lines of a block left out are not drawn, but every line still ends
+    aln, settings = shaded(fasta, outlen=3)
+    gr_out = RTFdev("aln.fas", settings, str(tmp_path / "aln.rtf"))
+    assert aln.prep_out(gr_out, settings)
+    layout, end = aln.out_layout(gr_out)
+    gr_out.capture()
+    aln.block_out(gr_out, 0, *layout[0], {1, 3})
+    text = gr_out.captured()
+    assert "two" in text and "four" in text
+    assert "one" not in text and "three" not in text
+    assert text.count("\\line") == len(layout[0][1])
+
+
+def test_output_targets(fasta, tmp_path):
+    aln, settings = shaded(fasta)
+
+    def make(device, target):
+        written(aln, settings, device, target)
+
+    make(RTFdev, str(tmp_path / "aln.rtf"))
+    plain = (tmp_path / "aln.rtf").read_bytes()
+    make(RTFdev, tmp_path / "aln.rtf.gz")
+    make(RTFdev, str(tmp_path / "aln.rtf.xz"))
+    assert gzip.decompress((tmp_path / "aln.rtf.gz").read_bytes()) == plain
+    assert lzma.decompress((tmp_path / "aln.rtf.xz").read_bytes()) == plain
+# file objects are written to and left open
+    binary, text = io.BytesIO(), io.StringIO()
+    make(RTFdev, binary)
+    make(RTFdev, text)
+    assert binary.getvalue() == plain and text.getvalue().encode() == plain
+    binary = io.BytesIO()
+    binary.write(b"ahead of the PDF")
+    make(PDFdev, binary)
+    pdf = binary.getvalue()[16:]
+    xref = int(pdf.split(b"startxref\n")[1].split()[0])
+    assert pdf[xref:].startswith(b"xref")
+
+
+def test_ascii_whole_blocks(fasta):
+    aln, settings = shaded(fasta, scflag=True, outlen=4, LHsnumsflag=True, RHsnumsflag=True,
+                           ASCIIchars=["L", ".", "l", "*"])
+    outputs = []
+    for whole in (True, False):
+        text = io.StringIO()
+# the line at a time path, with the characters chosen by runs_out, gives the same text
+        written(aln, settings, ASCIIdev, text, whole_blocks=whole, lines_per_page=6)
+        outputs.append(text.getvalue().split("\n", 2)[2])
+    assert outputs[0] == outputs[1]
+    assert "two   1 *AAV 4\nthree 1 *KWl 4\n" in outputs[0] and "four  5 V- 5\n" in outputs[0]
+
+
+def test_process_reruns_affected_stages(fasta):
+    aln = BS_core.Alignment()
+    aln.read(str(fasta))
+    settings = BS_core.Settings()
+    assert aln.process(settings) == ["tables", "consensus", "colours", "consline"]
+    assert aln.process(settings) == []
+    assert aln.process(BS_core.Settings(consflag=True, simflag=False, outlen=30)) == []
+    assert aln.process(BS_core.Settings(symbcons='*LU')) == ["consline"]
+    assert bytes(aln.conschar[0:6]) == b'A  ile'.replace(b' ', b'*')
+# DNA tables are not used for a protein alignment, so the consensus is left alone
+    assert aln.process(BS_core.Settings(symbcons='*LU', DNAgrpsline='GRPS:AG:END')) == ["tables"]
+    assert aln.process(BS_core.Settings(symbcons='*LU', thrfrac=0.5)) == ["tables", "consensus", "colours", "consline"]
+    fresh = BS_core.Alignment()
+    fresh.read(str(fasta))
+    fresh.process(BS_core.Settings(symbcons='*LU', thrfrac=0.5))
+    assert (fresh.cols == aln.cols).all() and (fresh.conschar == aln.conschar).all()
+# the consensus is rerun for a new consensnum, but is unchanged without scflag, so nothing after it is
+    aln.consensnum = 2
+    assert aln.process(BS_core.Settings(symbcons='*LU', thrfrac=0.5)) == ["consensus"]
+    assert aln.process(BS_core.Settings(symbcons='*LU', thrfrac=0.5, scflag=True))[0] == "consensus"
+
+
+class ZeroRng:
+    def integers(self, low, high, size, dtype):
+        return np.zeros(size, dtype=dtype)
+
+
+@pytest.mark.parametrize("collide", [False, True])
+def test_distinct_columns(tmp_path, monkeypatch, collide):
+    rng = np.random.default_rng(5)
+    blocks = rng.choice(np.frombuffer(b"ACGT-", dtype=np.uint8), (12, 40))
+    seqs = blocks[:, rng.integers(0, 40, 300)]
+    if collide:
+# with all weights 1 the hash is the column sum, so columns that are permutations of each other collide
+        monkeypatch.setattr(BS_core.np.random, "default_rng", lambda seed: ZeroRng())
+    reps, inverse = BS_core.distinct_columns(seqs)
+    distinct = np.unique(seqs, axis=1).shape[1]
+    assert reps.size > distinct if collide else reps.size == distinct
+    assert (seqs[:, reps[inverse]] == seqs).all()
+    path = tmp_path / "aln.fas"
+    path.write_bytes(b"".join(b">s%d\n" % i + bytes(row) + b"\n" for i, row in enumerate(seqs)))
+    aln = BS_core.Alignment()
+    aln.read(str(path))
+    assert aln.colmap is not None
+# small chunks, so that the distinct columns are shaded in many blocks
+    monkeypatch.setattr(BS_core, "chunk_cells", 50)
+    aln.process(BS_core.Settings(pepseqsflag=False))
+    whole = BS_core.Alignment()
+    whole.read(str(path))
+    whole.colmap = None
+    whole.process(BS_core.Settings(pepseqsflag=False))
+    assert (aln.cons == whole.cons).all() and (aln.cols == whole.cols).all() and (aln.conschar == whole.conschar).all()
+
+
+def test_settings_snapshot():
+    import pickle
+    settings = BS_core.Settings({"thrfrac": "0.5", "outlen": "50", "scflag": "true", "PSLCs": ["true", "false", 1, 0]},
+                                PSbgds=[[255, 255, 255, 255], (0, 0, 0), (180, 180, 180), (0, 0, 0)])
+    assert settings.thrfrac == 0.5 and settings["outlen"] == 50 and settings.scflag is True
+    assert settings.PSLCs == (True, False, True, False) and settings.PSbgds[0] == (255, 255, 255)
+    with pytest.raises(AttributeError):
+        settings.outlen = 10
+    with pytest.raises(TypeError):
+        settings["outlen"] = 10
+    with pytest.raises(ValueError):
+        BS_core.Settings(nosuchkey=1)
+    with pytest.raises(ValueError):
+        BS_core.Settings(ASCIIchars=['L', '.'])
+    copy = pickle.loads(pickle.dumps(settings))
+    assert copy == settings and hash(copy) == hash(settings)
+    assert BS_core.Settings(dict(settings), symbcons='*LU') != settings
+# the tables are built once for each pair of strings, and shared read only
+    assert settings.tables is BS_core.Settings().tables
+    assert not settings.tables[0].flags.writeable
+    assert BS_core.Settings(pepseqsflag=False).tables is not settings.tables
+
+
+def test_colour_runs():
+    cols = np.array([0, 0, 1, 1, 1, 3, 0], dtype=np.int32)
+    assert BS_core.colour_runs("ABCDEFG", cols) == [(0, "AB"), (1, "CDE"), (3, "F"), (0, "G")]
+    assert BS_core.colour_runs("", cols[0:0]) == []
+
+
+@pytest.mark.parametrize("device", [ASCIIdev, RTFdev, PSdev])
+def test_runs_out_matches_char_out(fasta, tmp_path, monkeypatch, device):
+    aln, settings = shaded(fasta, scflag=True, outlen=5, consflag=True, LHsnumsflag=True, rulerflag=True)
+    outputs = []
+    for name in ["runs", "chars"]:
+        if name == "chars":
+            monkeypatch.setattr(device, "runs_out", Filedev.runs_out)
+        out = tmp_path / name
+        written(aln, settings, device, out)
+        outputs.append([line for line in out.read_text().split('\n') if "Created" not in line and "Date" not in line])
+    assert outputs[0] == outputs[1]
+
+
+def png_chunks(data):
+    assert data.startswith(b'\x89PNG') and data.endswith(b'IEND\xaeB`\x82')
+    chunks, pos = [], 8
+    while pos < len(data):
+        size = int.from_bytes(data[pos:pos+4], 'big')
+        chunks.append((data[pos+4:pos+8], data[pos+8:pos+8+size]))
+        pos += size+12
+    assert chunks[0][0] == b'IHDR' and chunks[-1][0] == b'IEND'
+    return chunks
+
+
+def png_pixels(data):
+# the RGB pixels of a PNG written by PNGfile, which always uses the Sub filter
+    chunks = png_chunks(data)
+    width, height = struct.unpack('>II', chunks[0][1][0:8])
+    raw = zlib.decompress(b''.join(body for kind, body in chunks if kind == b'IDAT'))
+    rows = np.frombuffer(raw, dtype=np.uint8).reshape(height, 3*width+1)
+    assert (rows[:, 0] == 1).all()
+    return np.cumsum(rows[:, 1:].reshape(height, width, 3), axis=1, dtype=np.uint8)
+
+
+def test_png_in_bands(tmp_path):
+    rng = np.random.default_rng(1)
+    pic = rng.integers(0, 256, (7, 5, 3), dtype=np.uint8)
+    out = tmp_path / "pic.png"
+    png = PNGfile(str(out), 5, 7)
+    for top, bottom in [(0, 4), (4, 7)]:
+# rows padded out to a stride of 16 bytes, as QImage does
+        band = np.zeros((bottom-top, 16), dtype=np.uint8)
+        band[:, 0:15] = pic[top:bottom].reshape(bottom-top, 15)
+        png.write_rows(band.tobytes(), bottom-top, 16)
+    png.close()
+    assert (png_pixels(out.read_bytes()) == pic).all()
+
+
+def test_png_without_qt(fasta, tmp_path):
+    out = tmp_path / "aln.png"
+    aln, settings = shaded(fasta, outlen=4, PSFsize=10)
+    dev = written(aln, settings, PNGdev, out)
+    pic = png_pixels(out.read_bytes())
+    assert pic.shape == (dev.height, dev.width, 3)
+    assert (pic[0:30] == 255).all() and (pic[:, 0:30] == 255).all()
+# the first residue of every sequence is identical (class 3): its cell has that background, with a
+# character drawn in the foreground colour in the middle of it
+    x0 = dev.cell_of.tolist().index(len(dev.seqnames[0])+1)
+    for i in range(4):
+        y0 = int(round(dev.dev_miny + i*dev.dev_ysize))
+        cell = pic[y0:y0+int(dev.dev_ysize), x0:x0+int(dev.dev_xsize)]
+        assert tuple(cell[0, 0]) == settings["PSbgds"][3]
+        assert (cell == settings["PSfgds"][3]).all(axis=2).any()
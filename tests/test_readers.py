@@ -0,0 +1,205 @@
+# The streaming readers must give the same matrix and names as reading the file with AlignIO.
+import numpy as np
+import pytest
+from Bio import AlignIO
+from Bio.Align import MultipleSeqAlignment
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+import BS_core
+import BS_readers
+
+CLUSTAL = """CLUSTAL W (1.83) multiple sequence alignment
+
+one             MKV-LAAGIV 9
+two             MKVSLAGG-- 8
+three           -KISLPAGLV 9
+                 *:.*  *.
+
+one             ALLA 13
+two             -LLA 11
+three           GLLS 13
+                 **:
+"""
+
+PHYLIP = """3 14
+one    MKV-LAAGIV
+two    MKVS LAGG--
+three  -KISLPAGLV
+
+ALLA
+-LLA
+GLLS
+"""
+
+MSF = """PileUp
+
+   MSF: 12  Type: P  Check:  1234  ..
+
+ Name: one  Len: 12  Check: 1  Weight: 1.00
+ Name: two  Len: 12  Check: 2  Weight: 1.00
+
+//
+
+           1                                                   12
+one      MKV.LAAGIV AL
+two      MKV~LAGG.. ~L
+
+"""
+
+STOCKHOLM = """# STOCKHOLM 1.0
+#=GF ID test
+one/1-9     MKV.LAA
+two         MKVSLAG
+#=GR two SS CCHHHHC
+#=GC SS_cons CCHHHHC
+
+one/1-9     GIV
+two         G..
+#=GR two SS CCC
+#=GC SS_cons CCC
+//
+"""
+
+NEXUS = """#NEXUS
+begin data;
+dimensions ntax=3 nchar=12;
+format datatype=protein missing=? gap=- interleave;
+matrix
+seq_one   MKV-LA AG
+seq.two   MKVsLA GG
+Seq3      ?KISLP AG
+
+seq_one   IVAL
+seq.two   --?L
+Seq3      LVGL
+;
+end;
+"""
+
+SAMPLES = {"clustal": CLUSTAL, "phylip-relaxed": PHYLIP, "msf": MSF, "stockholm": STOCKHOLM, "nexus": NEXUS,
+           "fasta": ">one desc\nMKV-LA\nAG IV\n>two\r\nmkvsla\r\nGG--\r\n>three\n-KISLPAGLV\n\n"}
+
+
+def alignio(path, fmt):
+    al = AlignIO.read(str(path), fmt)
+    return [str(rec.seq).upper() for rec in al], [rec.id for rec in al]
+
+
+def native(path, fmt):
+    seqs, names = BS_readers.read_matrix(str(path), BS_readers.readers[fmt])
+    return [bytes(row).decode().upper() for row in seqs], names
+
+
+@pytest.mark.parametrize("fmt", sorted(SAMPLES))
+def test_samples(tmp_path, fmt):
+    path = tmp_path / "aln"
+    path.write_bytes(SAMPLES[fmt].encode())
+    assert native(path, fmt) == alignio(path, fmt)
+
+
+@pytest.mark.parametrize("fmt", ["fasta", "clustal", "phylip-relaxed", "stockholm", "nexus"])
+def test_written_by_alignio(tmp_path, fmt):
+    rng = np.random.default_rng(7)
+    letters = np.frombuffer(b"ACDEFGHIKLMNPQRSTVWY-", dtype=np.uint8)
+    recs = [SeqRecord(Seq(bytes(rng.choice(letters, 237)).decode()), id="seq{}".format(i), description="")
+            for i in range(9)]
+    al = MultipleSeqAlignment(recs)
+    if fmt == "nexus":
+        for rec in al:
+            rec.annotations["molecule_type"] = "protein"
+    path = tmp_path / "aln"
+    AlignIO.write(al, str(path), fmt)
+    assert native(path, fmt) == alignio(path, fmt)
+
+
+@pytest.mark.parametrize("fmt, text", [
+    ("fasta", ">one\nMKV\n>two\nMK\n"),
+    ("clustal", CLUSTAL + "\nCLUSTAL W (1.83) multiple sequence alignment\n\none  MK\ntwo  MK\n"),
+    ("clustal", CLUSTAL.replace("9\ntwo", "8\ntwo")),
+    ("phylip-relaxed", PHYLIP.replace("GLLS", "GL.S")),
+    ("msf", MSF.replace("Len: 12  Check: 2", "Len: 10  Check: 2")),
+    ("stockholm", STOCKHOLM.replace("#=GC SS_cons CCC", "#=GC SS_cons CC")),
+    ("nexus", NEXUS.replace("begin data;", "[a comment]\nbegin data;")),
+    ("nexus", NEXUS.replace("missing=?", "missing=X")),
+    ("fasta", ">one\nMK\xe9\n>two\nMKV\n"),
+    ("fasta", ">one\n>two\nMK\n"),
+    ("fasta", ">one\nMK\n>two\n"),
+])
+def test_unusual_files_rejected(tmp_path, fmt, text):
+    path = tmp_path / "aln"
+    path.write_bytes(text.encode('utf-8'))
+    with pytest.raises(ValueError):
+        native(path, fmt)
+
+
+def test_fallback_to_alignio(tmp_path):
+# a Nexus comment is left to AlignIO, which still reads the file
+    path = tmp_path / "aln.nex"
+    path.write_text(NEXUS.replace("begin data;", "[a comment]\nbegin data;"))
+    aln = BS_core.Alignment()
+    aln.read(str(path))
+    assert aln.seqnames == ["seq_one", "seq.two", "Seq3"]
+    assert bytes(aln.seqs[1]) == b"MKVSLAGG--?L"
+
+
+@pytest.mark.parametrize("text", [">one\nMKV\n>two\nMK\n", ">one\n>two\nMK\n"])
+def test_unreadable_file(tmp_path, text):
+    path = tmp_path / "aln.fas"
+    path.write_text(text)
+    with pytest.raises(BS_core.AlignmentFormatError):
+        BS_core.Alignment().read(str(path))
+
+
+@pytest.mark.parametrize("data, error", [(b">s\xe9q1\nMKV\n>two\nMKV\n", BS_core.AlignmentFormatError),
+                                         (b"\xe9\xe9\nMKV\n", BS_core.UnknownFormatError)])
+def test_not_utf8(tmp_path, data, error):
+    path = tmp_path / "aln.fas"
+    path.write_bytes(data)
+    with pytest.raises(error):
+        BS_core.Alignment().read(str(path))
+
+
+def fixed_width(tmp_path, eol="\n"):
+    rng = np.random.default_rng(3)
+    letters = np.frombuffer(b"ACDEFGHIKLMNPQRSTVWY-.", dtype=np.uint8)
+    seqs = [bytes(rng.choice(letters, 150)).decode() for i in range(20)]
+    fasta = tmp_path / "fixed.fas"
+    fasta.write_bytes("".join(">s{:03d} x\n{}\n".format(i, s) for i, s in enumerate(seqs)).replace("\n", eol).encode())
+    phylip = tmp_path / "fixed.phy"
+    phylip.write_bytes(("20 150\n" + "".join("s{:<6d} {}\n".format(i, s.replace(".", "-"))
+                                             for i, s in enumerate(seqs))).replace("\n", eol).encode())
+    return fasta, phylip
+
+
+@pytest.mark.parametrize("eol", ["\n", "\r\n"])
+def test_mapped_matches_streamed(tmp_path, eol):
+    for path, fmt in zip(fixed_width(tmp_path, eol), ["fasta", "phylip-relaxed"]):
+        seqs, names = BS_readers.mappers[fmt](str(path))
+        assert not seqs.flags.writeable and not seqs.flags.owndata
+        assert native(path, fmt) == ([bytes(row).decode() for row in seqs], names)
+
+
+@pytest.mark.parametrize("text", [">a\nMKV\n>b\nMK\nV\n", ">a\nMKV\n>b\nMKv\n", ">a\nMKV\n>bb\nMK\n", ">a\nMKV\n>b\n>KV\n"])
+def test_irregular_not_mapped(tmp_path, text):
+    path = tmp_path / "aln.fas"
+    path.write_text(text)
+    with pytest.raises(ValueError):
+        BS_readers.map_fasta(str(path))
+
+
+def test_mapped_alignment(tmp_path, monkeypatch):
+    fasta, phylip = fixed_width(tmp_path)
+    streamed = BS_core.Alignment()
+    streamed.read(str(fasta))
+    monkeypatch.setattr(BS_core, "map_bytes", 0)
+    monkeypatch.setattr(BS_core, "chunk_cells", 64)
+    mapped = BS_core.Alignment()
+    mapped.read(str(fasta))
+    assert not mapped.seqs.flags.writeable
+    settings = BS_core.Settings()
+    streamed.process(settings)
+    mapped.process(settings)
+    assert (mapped.seqs == streamed.seqs).all() and mapped.seqnames == streamed.seqnames
+    assert (mapped.cols == streamed.cols).all() and (mapped.cons == streamed.cons).all()
+    assert (mapped.seqlens == streamed.seqlens).all()
@@ -0,0 +1,218 @@
+# The vectorised consensus and shading must give exactly what the original column by column loops gave.
+# The reference functions below are those loops, with the settings passed in explicitly.
+from itertools import chain
+
+import numpy as np
+import pytest
+
+import BS_core
+
+PEPSIMS = 'SIMS:F YW:Y FW:W FY:I LM:L IM:M IL:R KH:K RH:H KR:A G:S T:D EN:E DQ:N EQ:P G:V M:END'
+PEPGRPS = 'GRPS:FYW:ILVM:DE:GA:ST:NQ:RKH:END'
+DNASIMS = 'SIMS:A GR:G AR:C TY:T CY:R AG:Y CT:END'
+DNAGRPS = 'GRPS:AGR:CTY:END'
+
+
+def ref_sim(tables, a, b):
+    p1 = BS_core.aa_dict[a] if a in BS_core.aa_dict else False
+    p2 = BS_core.aa_dict[b] if b in BS_core.aa_dict else False
+    return bool(tables[0][p1, p2]) if p1 and p2 else False
+
+
+def ref_grp(tables, a, b):
+    p1 = BS_core.aa_dict[a] if a in BS_core.aa_dict else False
+    p2 = BS_core.aa_dict[b] if b in BS_core.aa_dict else False
+    return bool(tables[1][p1, p2]) if p1 and p2 else False
+
+
+def ref_consensus(tables, seqs, thrfrac, countGaps):
+    no_seqs, consenslen = seqs.shape
+    cons = np.full(consenslen, ' ', dtype=str)
+    thr = round(thrfrac*no_seqs)
+    uf = np.frompyfunc(lambda a, b: ref_grp(tables, a, b), 2, 1)
+    for i in range(0, consenslen):
+        x = seqs[:, i]
+        xx = np.char.isalpha(x)
+        if not countGaps:
+            thr = round(thrfrac*np.sum(xx))
+        idcount = np.sum(x == x[xx, None], 0)
+        grpcount = np.sum(uf(x, x[xx, None]).astype(bool), 0)
+        maxidcount = np.amax(idcount)
+        maxgrpcount = np.amax(grpcount)
+        idindex = list(chain.from_iterable(np.where(idcount == maxidcount)))
+        grpindex = list(chain.from_iterable(np.where(grpcount == maxgrpcount)))
+        if maxidcount >= thr:
+            if len(idindex) == 1:
+                cons[i] = x[idindex[0]]
+            elif np.all(x[idindex[0]] == x[idindex]):
+                cons[i] = x[idindex[0]]
+        elif maxgrpcount >= thr:
+            if len(grpindex) == 1:
+                cons[i] = x[grpindex[0]]
+            elif np.all(uf(x[grpindex[0]], x[grpindex]).astype(bool)):
+                (vv, cc) = np.unique(x[grpindex], return_counts=True)
+                cons[i] = vv[np.argmax(cc)].lower()
+    return cons
+
+
+def ref_colours(tables, seqs, cons, thrfrac, countGaps, symbcons):
+    no_seqs, consenslen = seqs.shape
+    cols = np.zeros(seqs.shape, dtype=np.int32)
+    conschar = np.full(consenslen, ' ', dtype=str)
+    thr = round(thrfrac * no_seqs)
+    seqcount = no_seqs
+    for i in range(0, consenslen):
+        idcount = 0
+        simcount = 0
+        aasetflag = cons[i] in BS_core.aaset
+        if not countGaps:
+            seqcount = np.sum(np.char.isalpha(seqs[:, i]))
+            thr = round(thrfrac * seqcount)
+        if cons[i] in BS_core.aasetlow:
+            for j in range(0, no_seqs):
+                if ref_grp(tables, seqs[j, i], cons[i].upper()):
+                    cols[j, i] = 2
+                    simcount += 1
+        else:
+            for j in range(0, no_seqs):
+                if seqs[j, i] == cons[i]:
+                    idcount += 1
+                elif ref_sim(tables, seqs[j, i], cons[i]):
+                    simcount += 1
+            if (idcount == seqcount) and aasetflag:
+                if countGaps:
+                    cols[:, i] = 3
+                else:
+                    for j in range(0, no_seqs):
+                        cols[j, i] = 0 if seqs[j, i] in BS_core.gapchars else 3
+            elif ((idcount+simcount) >= thr) and aasetflag:
+                for j in range(0, no_seqs):
+                    if seqs[j, i] == cons[i]:
+                        cols[j, i] = 1
+                    elif ref_sim(tables, seqs[j, i], cons[i]):
+                        cols[j, i] = 2
+        if idcount == seqcount:
+            k = 2
+        elif (idcount+simcount) >= thr:
+            k = 1
+        else:
+            k = 0
+        symbchar = symbcons[k].upper()
+        if symbchar == 'U':
+            conschar[i] = cons[i].upper()
+        elif symbchar == 'L':
+            conschar[i] = cons[i].lower()
+        elif symbchar == 'B' or symbchar == ' ':
+            conschar[i] = ' '
+        else:
+            conschar[i] = symbcons[k]
+    return cols, conschar
+
+
+def as_matrix(rows):
+    return np.array([list(r) for r in rows], dtype=str)
+
+
+def codes(a):
+# the engine works on uint8 ASCII codes
+    return np.vectorize(ord, otypes=[np.uint8])(a)
+
+
+def text(a):
+    return [chr(c) for c in a]
+
+
+@pytest.fixture
+def peptables():
+    return BS_core.make_tables(PEPSIMS, PEPGRPS)
+
+
+# columns: 0 unanimous, 1 single majority, 2 three-way tie across groups, 3 group consensus I/L/V/M,
+# 4 group tie broken alphabetically, 5 D/E group with an unrelated residue, 6 and 7 all gaps,
+# 8 'Z' and 'X', 9 K/R/H group mixed with gaps
+FIXED = as_matrix([
+    "AAAILD--ZK",
+    "AAAVLE-.ZK",
+    "AAWLIE--XR",
+    "AKWMVD.-Z-",
+    "ACKIIW--ZH",
+    "AAK-M---X.",
+])
+
+
+@pytest.mark.parametrize("thrfrac", [0.0, 0.3, 0.5, 0.7, 1.0])
+@pytest.mark.parametrize("countGaps", [True, False])
+def test_consensus_fixed(peptables, thrfrac, countGaps):
+    expect = ref_consensus(peptables, FIXED, thrfrac, countGaps)
+    got = BS_core.vector_consensus(codes(FIXED), thrfrac, countGaps, peptables[1])
+    assert text(got) == list(expect)
+
+
+def test_consensus_rules(peptables):
+    cons = text(BS_core.vector_consensus(codes(FIXED), 0.7, True, peptables[1]))
+    assert cons[0] == 'A'  # unanimous
+    assert cons[2] == ' '  # A/W/K tie, in different groups
+    assert cons[3] == 'i'  # lowercase group consensus, most common member
+    assert cons[4] == 'i'  # I and L tie within the group: alphabetical first
+    assert cons[5] == 'd'  # D and E tie within the group
+    assert cons[6] == ' '  # all gaps
+
+
+def test_all_gap_column_zero_threshold(peptables):
+# with no residues and a zero threshold every row ties: the column takes its character if all agree
+    seqs = as_matrix(["--A", "--A", ".-A"])
+    for countGaps in (True, False):
+        expect = ref_consensus(peptables, seqs, 0.0, countGaps)
+        assert text(BS_core.vector_consensus(codes(seqs), 0.0, countGaps, peptables[1])) == list(expect)
+    assert text(BS_core.vector_consensus(codes(seqs), 0.0, False, peptables[1])) == [' ', '-', 'A']
+
+
+@pytest.mark.parametrize("thrfrac", [0.3, 0.5, 0.7, 1.0])
+@pytest.mark.parametrize("countGaps", [True, False])
+@pytest.mark.parametrize("symbcons", [' LU', '*.u', 'BlB'])
+def test_colours_fixed(peptables, thrfrac, countGaps, symbcons):
+    cons = ref_consensus(peptables, FIXED, thrfrac, countGaps)
+    expect_cols, expect_line = ref_colours(peptables, FIXED, cons, thrfrac, countGaps, symbcons)
+    cols, level = BS_core.vector_colours(codes(FIXED), codes(cons), thrfrac, countGaps, *peptables)
+    assert np.array_equal(cols, expect_cols)
+    assert text(BS_core.consensus_line(codes(cons), level, symbcons)) == list(expect_line)
+
+
+def test_group_consensus_not_thresholded(peptables):
+# a lowercase (group) consensus shades every group member, whatever the threshold
+    seqs = as_matrix(["I", "L", "V", "W", "-"])
+    cons = np.array(['i'])
+    cols, level = BS_core.vector_colours(codes(seqs), codes(cons), 1.0, True, *peptables)
+    assert list(cols[:, 0]) == [2, 2, 2, 0, 0]
+    assert np.array_equal(cols, ref_colours(peptables, seqs, cons, 1.0, True, ' LU')[0])
+
+
+def test_all_identical_with_gaps_not_counted(peptables):
+# with countGaps off a column whose residues all agree is "all the same", but the gaps stay unshaded
+    seqs = as_matrix(["K", "-", "K", ".", "K"])
+    cons = np.array(['K'])
+    cols, level = BS_core.vector_colours(codes(seqs), codes(cons), 0.7, False, *peptables)
+    assert list(cols[:, 0]) == [3, 0, 3, 0, 3]
+    assert level[0] == 2
+    cols, level = BS_core.vector_colours(codes(seqs), codes(cons), 0.5, True, *peptables)
+    assert list(cols[:, 0]) == [1, 0, 1, 0, 1]
+
+
+def test_random_alignments():
+    rng = np.random.default_rng(1)
+    for trial in range(60):
+        sims, grps = (PEPSIMS, PEPGRPS) if trial % 2 else (DNASIMS, DNAGRPS)
+        alphabet = list("ACDEFGHIKLMNPQRSTVWYXZ" if trial % 2 else "ACGTNR")
+        tables = BS_core.make_tables(sims, grps)
+        n, length = int(rng.integers(2, 10)), int(rng.integers(1, 30))
+        base = rng.choice(alphabet, length)
+        seqs = np.where(rng.random((n, length)) < rng.random(), base, rng.choice(alphabet, (n, length)))
+        seqs = np.where(rng.random((n, length)) < 0.3*rng.random(), rng.choice(list("-.~"), (n, length)), seqs)
+        thrfrac = float(rng.choice([0.0, 0.3, 0.5, 0.7, 1.0]))
+        countGaps = bool(trial % 3)
+        cons = ref_consensus(tables, seqs, thrfrac, countGaps)
+        assert text(BS_core.vector_consensus(codes(seqs), thrfrac, countGaps, tables[1])) == list(cons)
+        cols, line = ref_colours(tables, seqs, cons, thrfrac, countGaps, '*LU')
+        got, level = BS_core.vector_colours(codes(seqs), codes(cons), thrfrac, countGaps, *tables)
+        assert np.array_equal(got, cols)
+        assert text(BS_core.consensus_line(codes(cons), level, '*LU')) == list(line)